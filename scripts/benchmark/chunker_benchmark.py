@@ -0,0 +1,132 @@
+"""
+Throughput benchmark of the chunkers.
+
+The NLTK-based TextSplitter and the FastChunker split the same corpus. The benchmark reports
+throughput, the number of chunks and their token sizes as counted by the FastChunker. The
+FastChunker is run in one process and across a process pool.
+
+Usage, from the repository root:
+    python -m scripts.benchmark.chunker_benchmark --corpus cache/parsed --output results.json
+    python -m scripts.benchmark.chunker_benchmark --documents 200 --pages 50
+
+`--corpus` is a directory of parsed markdown or text files, e.g. the parse cache. Without it, a
+synthetic corpus of markdown filings is generated.
+"""
+import os
+import json
+import time
+import random
+import argparse
+
+import numpy as np
+
+from scripts.data_processing.chunker import TextSplitter, FastChunker
+
+
+def synthetic_corpus(documents: int, pages: int, seed: int = 0) -> list:
+    """
+    Generates markdown documents shaped like parsed filings: headings, paragraphs, lists and tables.
+    """
+    rng = random.Random(seed)
+    words = ("revenue income margin capital liquidity risk exposure credit loan deposit interest rate "
+             "segment quarter fiscal year growth decline reserve provision asset liability equity").split()
+
+    def sentence():
+        text = ' '.join(rng.choice(words) for _ in range(rng.randint(8, 30)))
+        return f"{text.capitalize()} was {rng.randint(1, 999)}.{rng.randint(0, 9)}% in {rng.randint(2000, 2024)}."
+
+    corpus = []
+    for _ in range(documents):
+        parts = []
+        for page in range(pages):
+            parts.append(f"## Section {page + 1}")
+            for _ in range(rng.randint(2, 5)):
+                parts.append(' '.join(sentence() for _ in range(rng.randint(2, 8))))
+            parts.append('\n'.join(f"- {sentence()}" for _ in range(rng.randint(2, 5))))
+            parts.append('| Item | 2023 | 2024 |\n|---|---|---|\n' + '\n'.join(
+                f"| {rng.choice(words)} | {rng.randint(1, 9999)} | {rng.randint(1, 9999)} |" for _ in range(6)))
+        corpus.append('\n\n'.join(parts))
+    return corpus
+
+
+def load_corpus(directory: str) -> list:
+    """
+    Reads the markdown and text files of a directory.
+    """
+    corpus = []
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith(('.md', '.txt')):
+            with open(os.path.join(directory, file_name), encoding='utf-8') as f:
+                corpus.append(f.read())
+    return corpus
+
+
+def measure(name: str, split, corpus: list, counter: FastChunker) -> dict:
+    """
+    Splits the corpus and reports throughput and chunk sizes.
+    """
+    start = time.perf_counter()
+    chunked = split(corpus)
+    seconds = time.perf_counter() - start
+    tokens = np.array([counter.count_tokens(chunk) for chunks in chunked for chunk in chunks])
+    megabytes = sum(len(text.encode('utf-8')) for text in corpus) / 2 ** 20
+    return {
+        'chunker': name,
+        'seconds': seconds,
+        'mb_per_s': megabytes / seconds,
+        'chunks': int(len(tokens)),
+        'mean_tokens': float(tokens.mean()) if len(tokens) else 0.0,
+        'max_tokens': int(tokens.max()) if len(tokens) else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', default=None, help='Directory of parsed .md or .txt documents')
+    parser.add_argument('--documents', type=int, default=100, help='Number of synthetic documents')
+    parser.add_argument('--pages', type=int, default=30, help='Sections per synthetic document')
+    parser.add_argument('--chunk-size', type=int, default=500, help='TextSplitter chunk size, in characters')
+    parser.add_argument('--chunk-overlap', type=int, default=250, help='TextSplitter overlap, in characters')
+    parser.add_argument('--chunk-tokens', type=int, default=128, help='FastChunker chunk size, in tokens')
+    parser.add_argument('--overlap-tokens', type=int, default=64, help='FastChunker overlap, in tokens')
+    parser.add_argument('--workers', type=int, default=None, help='Processes of the parallel run')
+    parser.add_argument('--skip-nltk', action='store_true', help='Only benchmark the FastChunker')
+    parser.add_argument('--output', default=None, help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.documents, args.pages)
+    megabytes = sum(len(text.encode('utf-8')) for text in corpus) / 2 ** 20
+    print(f"Corpus: {len(corpus)} documents, {megabytes:.1f}MB")
+
+    fast = FastChunker(chunk_tokens=args.chunk_tokens, overlap_tokens=args.overlap_tokens)
+    runs = [
+        ('FastChunker', lambda texts: [fast.split_text(text) for text in texts]),
+        ('FastChunker (parallel)', lambda texts: [
+            [text[start:end] for start, end in offsets]
+            for text, offsets in zip(texts, fast.split_many(texts, workers=args.workers))
+        ]),
+    ]
+    if not args.skip_nltk:
+        nltk_splitter = TextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+        runs.insert(0, ('TextSplitter (NLTK)', lambda texts: [nltk_splitter.split_text(text) for text in texts]))
+
+    results = []
+    for name, split in runs:
+        try:
+            result = measure(name, split, corpus, fast)
+        except Exception as e:
+            # e.g. the NLTK punkt data is not installed
+            print(f"{name:<24} failed: {type(e).__name__}")
+            results.append({'chunker': name, 'error': str(e)})
+            continue
+        results.append(result)
+        print(f"{name:<24} {result['mb_per_s']:8.2f}MB/s {result['seconds']:8.2f}s chunks={result['chunks']} "
+              f"mean_tokens={result['mean_tokens']:.1f} max_tokens={result['max_tokens']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'documents': len(corpus), 'megabytes': megabytes, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Memory/recall benchmark of compact vector representations.
+
+Every VectorCodec configuration (vector type and dimension reduction, optionally with a quantized
+index type) stores the same corpus in a scratch collection. Recall@k is measured against exact
+search on the full-precision float32 vectors, and memory against the float32 representation.
+
+Usage, from the repository root:
+    python -m scripts.benchmark.compression_benchmark
+    python -m scripts.benchmark.compression_benchmark --corpus vectors.npy --output results.json
+    python -m scripts.benchmark.compression_benchmark --uri http://localhost:19530 --config-file configs.json
+
+`--config-file` holds a list of VectorCodec arguments, with an optional IndexConfig 'index_type', e.g.
+    [{"vector_type": "FLOAT16_VECTOR", "reduction": "pca", "dim": 512},
+     {"vector_type": "FLOAT_VECTOR", "index_type": "IVF_SQ8"}]
+By default the collections are stored by the EmbeddedBackend in a temporary directory and searched
+exactly, so only the codec is measured. With `--uri` they are stored on Milvus, which also reports
+the memory of the loaded segments; quantized index types (IVF_SQ8, IVF_PQ) need a Milvus server.
+"""
+import json
+import time
+import tempfile
+import argparse
+
+import numpy as np
+from pymilvus import utility
+
+from scripts.rag.index_config import IndexConfig
+from scripts.rag.vector_codec import VectorCodec
+from scripts.rag.milvus_backend import MilvusBackend
+from scripts.rag.embedded_backend import EmbeddedBackend
+from scripts.benchmark.index_benchmark import synthetic_corpus, exact_top_k
+
+DEFAULT_CONFIGS = [
+    {},
+    {"vector_type": "FLOAT16_VECTOR"},
+    {"vector_type": "BFLOAT16_VECTOR"},
+    {"reduction": "truncate", "dim": 1024},
+    {"reduction": "truncate", "dim": 512},
+    {"reduction": "pca", "dim": 512},
+    {"reduction": "pca", "dim": 256},
+    {"vector_type": "FLOAT16_VECTOR", "reduction": "pca", "dim": 256},
+]
+
+
+def benchmark_codec(backend, codec: VectorCodec, index_config: IndexConfig, corpus: np.ndarray,
+                    queries: np.ndarray, truth: np.ndarray, k: int, fit_size: int, batch_size: int = 1000) -> dict:
+    """
+    Stores the corpus with one codec and measures recall, latency and memory.
+    """
+    colname = f"bench_codec_{int(time.time() * 1000)}"
+    fields = [
+        {"name": "id", "dtype": "INT64", "is_primary": True, "auto_id": True},
+        {"name": "vector", "dtype": codec.vector_type, "dim": codec.output_dim(corpus.shape[1])},
+    ]
+    backend.create_collection(colname, fields, index_config)
+    try:
+        start = time.perf_counter()
+        codec.fit(corpus[:fit_size])
+        pks = []
+        for offset in range(0, len(corpus), batch_size):
+            pks.extend(backend.insert(colname, {"vector": codec.reduce(corpus[offset:offset + batch_size])}))
+        build_seconds = time.perf_counter() - start
+        # Primary keys back to corpus rows
+        rows = {pk: row for row, pk in enumerate(pks)}
+
+        latencies, hits = [], 0
+        reduced = codec.reduce(queries)
+        for query, expected in zip(reduced, truth):
+            start = time.perf_counter()
+            result = backend.search(colname, [query], k, filters=None, output_fields=[],
+                                    param=index_config.search_param())
+            latencies.append(time.perf_counter() - start)
+            hits += len({rows[hit["id"]] for hit in result[0]} & set(expected.tolist()))
+
+        memory = None
+        if isinstance(backend, MilvusBackend):
+            try:
+                memory = sum(segment.mem_size for segment in utility.get_query_segment_info(colname))
+            except Exception:
+                memory = None
+        latencies_ms = np.array(latencies) * 1000
+        return {
+            **codec.to_dict(),
+            'index_type': index_config.index_type,
+            'bytes_per_vector': codec.bytes_per_vector(corpus.shape[1]),
+            'vector_bytes': codec.bytes_per_vector(corpus.shape[1]) * len(corpus),
+            'segment_memory_bytes': memory,
+            f'recall@{k}': hits / (len(queries) * k),
+            'p50_ms': float(np.percentile(latencies_ms, 50)),
+            'p99_ms': float(np.percentile(latencies_ms, 99)),
+            'build_s': build_seconds,
+        }
+    finally:
+        backend.drop_collection(colname)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', default=None, help='Milvus URI or Milvus Lite file, defaults to the embedded store')
+    parser.add_argument('--config-file', default=None, help='JSON list of VectorCodec arguments')
+    parser.add_argument('--index-type', default='FLAT', help='Index type of configs that do not set one')
+    parser.add_argument('--metric', default='L2', help='Metric of the collections and of the exact search')
+    parser.add_argument('--corpus', default=None, help='Recorded corpus as a .npy float32 matrix')
+    parser.add_argument('--queries', default=None, help='Recorded queries as a .npy float32 matrix')
+    parser.add_argument('--n', type=int, default=10000, help='Size of the synthetic corpus')
+    parser.add_argument('--dim', type=int, default=4096, help='Dimension of the synthetic corpus')
+    parser.add_argument('--n-queries', type=int, default=200, help='Number of synthetic queries')
+    parser.add_argument('--fit-size', type=int, default=2000, help='Vectors the PCA projections are fitted on')
+    parser.add_argument('--k', type=int, default=6, help='Number of neighbours retrieved per query')
+    parser.add_argument('--output', default=None, help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    if args.corpus:
+        corpus = np.load(args.corpus).astype(np.float32)
+        queries = np.load(args.queries).astype(np.float32) if args.queries else \
+            corpus[np.random.default_rng(1).choice(len(corpus), args.n_queries, replace=False)]
+    else:
+        corpus = synthetic_corpus(args.n, args.dim)
+        queries = synthetic_corpus(args.n_queries, args.dim, seed=1)
+    truth = exact_top_k(corpus, queries, args.k, args.metric)
+
+    if args.uri:
+        backend = MilvusBackend(uri=args.uri)
+    else:
+        backend = EmbeddedBackend(tempfile.mkdtemp(prefix='compression_benchmark_'))
+
+    configs = DEFAULT_CONFIGS
+    if args.config_file:
+        with open(args.config_file, encoding='utf-8') as f:
+            configs = json.load(f)
+
+    full_bytes = VectorCodec().bytes_per_vector(corpus.shape[1])
+    results, baseline = [], None
+    for config in configs:
+        config = dict(config)
+        index_config = IndexConfig(index_type=config.pop('index_type', args.index_type), metric_type=args.metric)
+        codec = VectorCodec(**config)
+        result = benchmark_codec(backend, codec, index_config, corpus, queries, truth, args.k, args.fit_size)
+        recall = result[f'recall@{args.k}']
+        if baseline is None and codec.is_identity and codec.vector_type == 'FLOAT_VECTOR':
+            baseline = recall
+        result['memory_saved'] = 1 - result['bytes_per_vector'] / full_bytes
+        result['recall_lost'] = (baseline if baseline is not None else 1.0) - recall
+        results.append(result)
+        name = f"{codec.vector_type}" + (f" {codec.reduction}({codec.dim})" if codec.reduction else '')
+        print(f"{name:<32} {index_config.index_type:<9} {result['bytes_per_vector']:>6}B/vector "
+              f"saved={result['memory_saved']:6.1%} recall@{args.k}={recall:.3f} lost={result['recall_lost']:+.3f} "
+              f"p50={result['p50_ms']:.2f}ms")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'n': len(corpus), 'dim': int(corpus.shape[1]), 'k': args.k, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
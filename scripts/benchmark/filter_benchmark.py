@@ -0,0 +1,178 @@
+"""
+Latency benchmark of document-filtered search as the number of documents grows.
+
+For every FilterConfig (no scalar index, an INVERTED index on pdf_name, pdf_name or a derived
+doc_id as partition key) and every corpus size, a scratch collection holds `--chunks` chunks per
+document. The benchmark reports the p50/p95 latency of searches restricted to one document, as
+issued by `MilvusDB.search_batch`, and of the first-chunk existence checks of `existing_files`.
+
+Usage, from the repository root:
+    python -m scripts.benchmark.filter_benchmark --documents 100 1000 5000 --output results.json
+    python -m scripts.benchmark.filter_benchmark --uri http://localhost:19530 --config-file configs.json
+
+`--config-file` holds a list of FilterConfig arguments, e.g.
+    [{"scalar_index": null}, {"partition_key": "doc_id", "num_partitions": 256}]
+By default the collections are stored by the EmbeddedBackend in a temporary directory, which serves
+the filter from its SQLite index whatever the configuration. With `--uri` they are stored on Milvus;
+partition keys need a Milvus server, configurations the server rejects are reported as failed.
+"""
+import json
+import time
+import random
+import tempfile
+import argparse
+
+import numpy as np
+
+from scripts.rag.index_config import IndexConfig
+from scripts.rag.filter_config import FilterConfig
+from scripts.rag.embedded_backend import EmbeddedBackend
+from scripts.benchmark.index_benchmark import synthetic_corpus
+
+DEFAULT_CONFIGS = [
+    {"scalar_index": None},
+    {"scalar_index": "INVERTED"},
+    {"partition_key": "pdf_name"},
+    {"partition_key": "doc_id"},
+]
+FIELDS = [
+    {"name": "id", "dtype": "INT64", "is_primary": True, "auto_id": True},
+    {"name": "pdf_name", "dtype": "VARCHAR", "max_length": 200},
+    {"name": "chunk_number", "dtype": "INT64"},
+    {"name": "vector", "dtype": "FLOAT_VECTOR"},
+]
+
+
+def latencies(call, arguments: list) -> dict:
+    """
+    Times a call once per argument.
+
+    Returns:
+        dict: The p50 and p95 latency, in milliseconds.
+    """
+    seconds = []
+    for argument in arguments:
+        start = time.perf_counter()
+        call(argument)
+        seconds.append(time.perf_counter() - start)
+    milliseconds = np.array(seconds) * 1000
+    return {'p50_ms': float(np.percentile(milliseconds, 50)), 'p95_ms': float(np.percentile(milliseconds, 95))}
+
+
+def benchmark_filter(backend, filter_config: FilterConfig, index_config: IndexConfig, documents: int, chunks: int,
+                     dim: int, queries: int, k: int, batch_size: int = 5000) -> dict:
+    """
+    Stores `documents` documents of `chunks` chunks with one filter configuration and measures
+    filtered search and existence check latencies.
+    """
+    colname = f"bench_filter_{int(time.time() * 1000)}"
+    fields = filter_config.apply([{**field, "dim": dim} if field["name"] == "vector" else field for field in FIELDS],
+                                 "vector")
+    backend.create_collection(colname, fields, index_config,
+                              num_partitions=filter_config.num_partitions if filter_config.partition_key else None)
+    try:
+        start = time.perf_counter()
+        pdf_names = [f"document_{index:06d}" for index in range(documents)]
+        total = documents * chunks
+        for offset in range(0, total, batch_size):
+            rows = range(offset, min(offset + batch_size, total))
+            names = [pdf_names[row // chunks] for row in rows]
+            columns = {
+                "pdf_name": names,
+                "chunk_number": [row % chunks for row in rows],
+                "vector": synthetic_corpus(len(rows), dim, seed=offset),
+            }
+            if filter_config.uses_doc_id:
+                columns[FilterConfig.DOC_ID] = [FilterConfig.document_id(name) for name in names]
+            backend.insert(colname, columns)
+        build_seconds = time.perf_counter() - start
+
+        rng = random.Random(0)
+        targets = [rng.choice(pdf_names) for _ in range(queries)]
+        vectors = synthetic_corpus(queries, dim, seed=1)
+        param = index_config.search_param()
+        output_fields = ["pdf_name", "chunk_number"]
+        # Warm-up: loads the collection
+        backend.search(colname, [vectors[0]], k, filter_config.document_filter(targets[0]), output_fields, param)
+
+        search = latencies(
+            lambda i: backend.search(colname, [vectors[i]], k, filter_config.document_filter(targets[i]),
+                                     output_fields, param),
+            list(range(queries))
+        )
+        unfiltered = latencies(
+            lambda i: backend.search(colname, [vectors[i]], k, None, output_fields, param),
+            list(range(queries))
+        )
+        exists = latencies(
+            lambda i: backend.query(colname, {**filter_config.document_filter(targets[i]), "chunk_number": 0},
+                                    output_fields=["pdf_name"], limit=1),
+            list(range(queries))
+        )
+        return {
+            **filter_config.to_dict(),
+            'documents': documents,
+            'rows': total,
+            'build_s': build_seconds,
+            'search_p50_ms': search['p50_ms'],
+            'search_p95_ms': search['p95_ms'],
+            'unfiltered_p50_ms': unfiltered['p50_ms'],
+            'exists_p50_ms': exists['p50_ms'],
+            'exists_p95_ms': exists['p95_ms'],
+        }
+    finally:
+        backend.drop_collection(colname)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', default=None, help='Milvus URI or Milvus Lite file, defaults to the embedded store')
+    parser.add_argument('--config-file', default=None, help='JSON list of FilterConfig arguments')
+    parser.add_argument('--documents', type=int, nargs='+', default=[100, 1000, 5000], help='Corpus sizes, in documents')
+    parser.add_argument('--chunks', type=int, default=20, help='Chunks per document')
+    parser.add_argument('--dim', type=int, default=256, help='Dimension of the synthetic vectors')
+    parser.add_argument('--index-type', default='FLAT', help='Vector index type of the collections')
+    parser.add_argument('--queries', type=int, default=100, help='Searches and existence checks timed per run')
+    parser.add_argument('--k', type=int, default=6, help='Number of chunks retrieved per search')
+    parser.add_argument('--output', default=None, help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    if args.uri:
+        from scripts.rag.milvus_backend import MilvusBackend
+        backend = MilvusBackend(uri=args.uri)
+    else:
+        backend = EmbeddedBackend(tempfile.mkdtemp(prefix='filter_benchmark_'))
+
+    configs = DEFAULT_CONFIGS
+    if args.config_file:
+        with open(args.config_file, encoding='utf-8') as f:
+            configs = json.load(f)
+
+    index_config = IndexConfig(index_type=args.index_type)
+    results = []
+    for config in configs:
+        filter_config = FilterConfig(**config)
+        name = (f"partition_key={filter_config.partition_key} " if filter_config.partition_key else '') + \
+            f"index={filter_config.scalar_index}"
+        for documents in args.documents:
+            try:
+                result = benchmark_filter(backend, filter_config, index_config, documents, args.chunks, args.dim,
+                                          args.queries, args.k)
+            except Exception as e:
+                # e.g. partition keys on Milvus Lite
+                print(f"{name:<36} {documents:>7} documents failed: {type(e).__name__}")
+                results.append({**filter_config.to_dict(), 'documents': documents, 'error': str(e)})
+                break
+            results.append(result)
+            print(f"{name:<36} {documents:>7} documents search p50={result['search_p50_ms']:7.2f}ms "
+                  f"p95={result['search_p95_ms']:7.2f}ms exists p50={result['exists_p50_ms']:7.2f}ms "
+                  f"(unfiltered p50={result['unfiltered_p50_ms']:7.2f}ms)")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'chunks': args.chunks, 'dim': args.dim, 'index_type': args.index_type, 'results': results},
+                      f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
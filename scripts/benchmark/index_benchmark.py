@@ -0,0 +1,166 @@
+"""
+Recall/latency benchmark of vector index configurations.
+
+Every configuration is built on the same corpus in a scratch collection and compared with exact
+(brute-force) search. The benchmark reports recall@k, p50/p99 single-query latency, build time and
+the memory of the loaded segments.
+
+Usage, from the repository root:
+    python -m scripts.benchmark.index_benchmark --configs FLAT IVF_FLAT HNSW IVF_SQ8 IVF_PQ
+    python -m scripts.benchmark.index_benchmark --config-file configs.json --corpus vectors.npy --output results.json
+
+`--config-file` holds a list of IndexConfig arguments, e.g.
+    [{"index_type": "HNSW", "metric_type": "COSINE", "build_params": {"M": 32}, "search_params": {"ef": 128}}]
+By default the benchmark connects to VDB_HOST:VDB_PORT, `--uri` points it to another server or a Milvus Lite file.
+"""
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+from pymilvus import connections, utility, Collection, CollectionSchema, FieldSchema, DataType
+from dotenv import load_dotenv, find_dotenv
+
+from scripts.rag.index_config import IndexConfig
+
+load_dotenv(find_dotenv())
+
+
+def synthetic_corpus(n: int, dim: int, n_clusters: int = 64, seed: int = 0) -> np.ndarray:
+    """
+    Generates clustered unit vectors, closer to real embeddings than uniform noise.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, n)
+    vectors = centers[labels] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def exact_top_k(corpus: np.ndarray, queries: np.ndarray, k: int, metric: str) -> np.ndarray:
+    """
+    Returns the ids of the exact k nearest neighbours of each query.
+    """
+    if metric == 'L2':
+        scores = -(np.sum(corpus ** 2, axis=1)[None, :] - 2 * queries @ corpus.T)
+    elif metric == 'COSINE':
+        normed = corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+        scores = (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ normed.T
+    else:
+        scores = queries @ corpus.T
+    top = np.argpartition(-scores, k, axis=1)[:, :k]
+    return np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+
+
+def benchmark_config(config: IndexConfig, corpus: np.ndarray, queries: np.ndarray, truth: np.ndarray,
+                     k: int, batch_size: int = 1000) -> dict:
+    """
+    Builds one index configuration on the corpus and measures recall, latency and memory.
+    """
+    colname = f"bench_{config.index_type.lower()}_{config.metric_type.lower()}_{int(time.time())}"
+    schema = CollectionSchema(fields=[
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="vector", dtype=DataType.FLOAT_VECTOR, dim=corpus.shape[1]),
+    ])
+    collection = Collection(colname, schema)
+    try:
+        start = time.perf_counter()
+        for offset in range(0, len(corpus), batch_size):
+            part = corpus[offset:offset + batch_size]
+            collection.insert([list(range(offset, offset + len(part))), part])
+        collection.flush()
+        collection.create_index(field_name="vector", index_params=config.index_params())
+        utility.wait_for_index_building_complete(colname)
+        collection.load()
+        build_seconds = time.perf_counter() - start
+
+        latencies, hits = [], 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            result = collection.search(data=[query], anns_field="vector", param=config.search_param(), limit=k)
+            latencies.append(time.perf_counter() - start)
+            hits += len(set(result[0].ids) & set(expected.tolist()))
+
+        try:
+            memory = sum(segment.mem_size for segment in utility.get_query_segment_info(colname))
+        except Exception:
+            memory = None
+        latencies_ms = np.array(latencies) * 1000
+        return {
+            'index_type': config.index_type,
+            'metric_type': config.metric_type,
+            'build_params': config.build_params,
+            'search_params': config.search_params,
+            f'recall@{k}': hits / (len(queries) * k),
+            'p50_ms': float(np.percentile(latencies_ms, 50)),
+            'p99_ms': float(np.percentile(latencies_ms, 99)),
+            'build_s': build_seconds,
+            'memory_bytes': memory,
+        }
+    finally:
+        collection.release()
+        utility.drop_collection(colname)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', default=None, help='Milvus URI or Milvus Lite file, defaults to VDB_HOST:VDB_PORT')
+    parser.add_argument('--configs', nargs='*', default=['FLAT', 'IVF_FLAT', 'HNSW'], help='Index types with preset params')
+    parser.add_argument('--config-file', default=None, help='JSON list of IndexConfig arguments')
+    parser.add_argument('--metric', default='L2', help='Metric used with --configs')
+    parser.add_argument('--corpus', default=None, help='Recorded corpus as a .npy float32 matrix')
+    parser.add_argument('--queries', default=None, help='Recorded queries as a .npy float32 matrix')
+    parser.add_argument('--n', type=int, default=20000, help='Size of the synthetic corpus')
+    parser.add_argument('--dim', type=int, default=4096, help='Dimension of the synthetic corpus')
+    parser.add_argument('--n-queries', type=int, default=200, help='Number of synthetic queries')
+    parser.add_argument('--k', type=int, default=6, help='Number of neighbours retrieved per query')
+    parser.add_argument('--output', default=None, help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    if args.uri:
+        connections.connect(uri=args.uri)
+    else:
+        connections.connect(host=os.getenv('VDB_HOST'), port=os.getenv('VDB_PORT'))
+
+    if args.corpus:
+        corpus = np.load(args.corpus).astype(np.float32)
+        queries = np.load(args.queries).astype(np.float32) if args.queries else \
+            corpus[np.random.default_rng(1).choice(len(corpus), args.n_queries, replace=False)]
+    else:
+        # Queries are held-out points drawn from the same clusters as the corpus
+        data = synthetic_corpus(args.n + args.n_queries, args.dim)
+        corpus, queries = data[:args.n], data[args.n:]
+        if args.queries:
+            queries = np.load(args.queries).astype(np.float32)
+
+    if args.config_file:
+        with open(args.config_file, encoding='utf-8') as f:
+            configs = [IndexConfig(**spec) for spec in json.load(f)]
+    else:
+        configs = [IndexConfig(index_type=name, metric_type=args.metric) for name in args.configs]
+
+    truths = {}
+    results = []
+    for config in configs:
+        if config.metric_type not in truths:
+            truths[config.metric_type] = exact_top_k(corpus, queries, args.k, config.metric_type)
+        try:
+            result = benchmark_config(config, corpus, queries, truths[config.metric_type], args.k)
+        except Exception as e:
+            # e.g. an index type the server does not support, keep benchmarking the others
+            print(f"{config.index_type:<10} {config.metric_type:<7} failed: {e}")
+            results.append({'index_type': config.index_type, 'metric_type': config.metric_type, 'error': str(e)})
+            continue
+        results.append(result)
+        memory = f"{result['memory_bytes'] / 2 ** 20:.1f}MB" if result['memory_bytes'] is not None else 'n/a'
+        print(f"{config.index_type:<10} {config.metric_type:<7} recall@{args.k}={result[f'recall@{args.k}']:.3f} "
+              f"p50={result['p50_ms']:.2f}ms p99={result['p99_ms']:.2f}ms build={result['build_s']:.1f}s memory={memory}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'corpus_size': len(corpus), 'dim': int(corpus.shape[1]), 'k': args.k, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
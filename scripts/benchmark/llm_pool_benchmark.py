@@ -0,0 +1,132 @@
+"""
+Offline benchmark of the Ollama host pool against fake local Ollama servers.
+
+Each scenario starts `--hosts` fake servers, one of them `--slow-factor` times slower than the
+others, and sends `--requests` generations from `--clients` concurrent clients through an
+`OllamaPool`. It reports the throughput, the p50/p95 latency, the generations routed to each host,
+the peak concurrency each host saw (never above `--max-concurrency`), the preloads and the
+generations rejected by admission control:
+- balanced:   every host is up
+- host_down:  one more host refuses connections, its generations fail over to the others
+- overloaded: a queue of `--max-queue` generations waiting at most `--queue-timeout` seconds,
+              the generations beyond are rejected
+
+Usage, from the repository root:
+    python -m scripts.benchmark.llm_pool_benchmark --hosts 3 --clients 16 --output pool.json
+"""
+import json
+import time
+import socket
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts.logger.exceptions import LlmOverloadedError
+from scripts.benchmark.pipeline_benchmark import FakeOllamaServer, percentiles
+
+SCENARIOS = ('balanced', 'host_down', 'overloaded')
+
+
+def closed_port() -> int:
+    """
+    Returns a local port nothing listens on.
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_scenario(scenario: str, args) -> dict:
+    """
+    Runs the generations of one scenario through a new pool.
+    """
+    from scripts.rag.ollama_pool import OllamaPool
+
+    servers = [
+        FakeOllamaServer(token_rate=args.token_rate / (args.slow_factor if index == 0 else 1),
+                         response_tokens=args.response_tokens)
+        for index in range(args.hosts)
+    ]
+    hosts = [f'127.0.0.1:{server.port}' for server in servers]
+    if scenario == 'host_down':
+        hosts.insert(0, f'127.0.0.1:{closed_port()}')
+    overloaded = scenario == 'overloaded'
+    pool = OllamaPool(hosts, max_concurrency=args.max_concurrency,
+                      max_queue=args.max_queue if overloaded else args.requests,
+                      queue_timeout=args.queue_timeout if overloaded else 600.0,
+                      keep_alive=args.keep_alive, preload=False)
+    preloaded = pool.preload(args.model)
+    llm = pool.llm(args.model)
+
+    def generate(index: int):
+        start = time.perf_counter()
+        try:
+            llm.invoke(f'Question {index}: what was the revenue growth?')
+        except LlmOverloadedError:
+            return None
+        return time.perf_counter() - start
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.clients) as executor:
+            seconds = list(executor.map(generate, range(args.requests)))
+        elapsed = time.perf_counter() - start
+        completed = [value for value in seconds if value is not None]
+        return {
+            'scenario': scenario,
+            'completed': len(completed),
+            'rejected': len(seconds) - len(completed),
+            'throughput_rps': len(completed) / elapsed,
+            **(percentiles(completed, 'latency') if completed else {}),
+            'preloaded': sum(preloaded.values()),
+            'hosts': [
+                {**{key: value for key, value in host.stats().items() if key != 'latency'},
+                 'p50_ms': host.latency.percentile(0.5) * 1000,
+                 'peak_active': server.peak_active if server else None,
+                 'keep_alive': server.keep_alive if server else None}
+                for host, server in zip(pool.hosts, ([None] if scenario == 'host_down' else []) + servers)
+            ],
+        }
+    finally:
+        for server in servers:
+            server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=SCENARIOS, help='Scenarios to run')
+    parser.add_argument('--hosts', type=int, default=3, help='Fake Ollama hosts up')
+    parser.add_argument('--slow-factor', type=float, default=3.0, help='How much slower the first host generates')
+    parser.add_argument('--clients', type=int, default=16, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=96, help='Generations per scenario')
+    parser.add_argument('--max-concurrency', type=int, default=2, help='Generations per host at once')
+    parser.add_argument('--max-queue', type=int, default=4, help='Queue length of the overloaded scenario')
+    parser.add_argument('--queue-timeout', type=float, default=0.5, help='Queue timeout of the overloaded scenario')
+    parser.add_argument('--token-rate', type=float, default=400.0, help='Tokens per second of the fast hosts')
+    parser.add_argument('--response-tokens', type=int, default=32, help='Tokens per answer')
+    parser.add_argument('--keep-alive', default='-1', help="keep_alive sent to Ollama, e.g. -1 or '30m'")
+    parser.add_argument('--model', default='llama3.1:70b', help='Model name sent to the fake Ollama')
+    parser.add_argument('--output', default=None, help='Write the results to this JSON file')
+    args = parser.parse_args()
+    args.keep_alive = int(args.keep_alive) if args.keep_alive.lstrip('-').isdigit() else args.keep_alive
+    logging.disable(logging.WARNING)
+
+    results = []
+    for scenario in args.scenarios:
+        result = run_scenario(scenario, args)
+        results.append(result)
+        print(f"{scenario:<11} completed={result['completed']:>4} rejected={result['rejected']:>4} "
+              f"throughput={result['throughput_rps']:6.1f}/s p50={result.get('latency_p50_ms', 0):7.1f}ms "
+              f"p95={result.get('latency_p95_ms', 0):7.1f}ms preloaded={result['preloaded']}")
+        for host in result['hosts']:
+            print(f"    {host['url']:<24} requests={host['requests']:>4} errors={host['errors']:>3} "
+                  f"peak={host['peak_active']} p50={host['p50_ms']:7.1f}ms")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'config': {key: value for key, value in vars(args).items() if key != 'output'},
+                       'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
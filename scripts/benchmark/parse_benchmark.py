@@ -0,0 +1,158 @@
+"""
+Throughput benchmark of local PDF extraction, and of the parse policy's choices.
+
+The benchmark writes `--files` synthetic PDFs of `--pages` pages, a `--table-share` of them made
+of financial tables and the others of prose, and extracts them with the LocalPDFParser in the
+calling process and split into page ranges across a process pool. It reports pages and files
+per second, and how many files the 'auto' ParsePolicy sends to LlamaParse, which should be the
+table files.
+
+Usage, from the repository root:
+    python -m scripts.benchmark.parse_benchmark --files 20 --pages 60 --output results.json
+    python -m scripts.benchmark.parse_benchmark --directory _static
+
+`--directory` extracts the PDFs of a directory instead of synthetic ones.
+"""
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+from scripts.data_processing.local_parser import LocalPDFParser
+from scripts.data_processing.parse_policy import ParsePolicy
+
+
+def pdf_string(text: str) -> str:
+    return '(' + text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') + ')'
+
+
+def write_text_pdf(path: str, pages: list):
+    """
+    Writes a PDF whose pages hold lines of text in Helvetica.
+
+    Args:
+        path (str): The path of the file.
+        pages (list): The lines of each page.
+    """
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>', None, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    kids = []
+    for lines in pages:
+        content = 'BT /F1 9 Tf 11 TL 40 800 Td ' + ' '.join(f'{pdf_string(line)} Tj T*' for line in lines) + ' ET'
+        data = content.encode('latin-1', 'replace')
+        objects.append(b'<< /Length %d >>\nstream\n' % len(data) + data + b'\nendstream')
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents %d 0 R '
+                       b'/Resources << /Font << /F1 3 0 R >> >> >>' % len(objects))
+        kids.append(len(objects))
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (' '.join(f'{kid} 0 R' for kid in kids).encode(), len(kids))
+
+    output = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref = len(output)
+    output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    output += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    output += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    with open(path, 'wb') as f:
+        f.write(output)
+
+
+def synthetic_pdfs(directory: str, files: int, pages: int, table_share: float, seed: int = 0) -> dict:
+    """
+    Writes synthetic filings, prose or tables of figures, 60 lines per page.
+
+    Returns:
+        dict: Whether each file, by name, is a table file.
+    """
+    rng = random.Random(seed)
+    words = ("revenue income margin capital liquidity risk exposure credit loan deposit interest rate "
+             "segment quarter fiscal year growth decline reserve provision asset liability equity").split()
+    tables = {}
+    for index in range(files):
+        table = index < round(files * table_share)
+        file_pages = []
+        for _ in range(pages):
+            if table:
+                lines = [f"{rng.choice(words).capitalize()} {rng.choice(words)} " +
+                         ' '.join(f'{rng.randint(1, 99999):,}' for _ in range(4)) + f' {rng.randint(-20, 40)}%'
+                         for _ in range(60)]
+            else:
+                lines = [' '.join(rng.choice(words) for _ in range(14)).capitalize() + f' was {rng.randint(1, 99)}%.'
+                         for _ in range(60)]
+            file_pages.append(lines)
+        name = f"{'table' if table else 'prose'}_{index:04d}.pdf"
+        write_text_pdf(os.path.join(directory, name), file_pages)
+        tables[name] = table
+    return tables
+
+
+def measure(name: str, parser: LocalPDFParser, paths: list) -> tuple:
+    """
+    Extracts every file once.
+
+    Returns:
+        tuple: The throughput of the run, and the extracted pages of each file.
+    """
+    start = time.perf_counter()
+    extracted = [parser.extract(path) for path in paths]
+    seconds = time.perf_counter() - start
+    pages = sum(len(file_pages) for file_pages in extracted)
+    print(f"{name:<12} {pages / seconds:9.1f} pages/s {len(paths) / seconds:7.2f} files/s ({seconds:.2f}s)")
+    return {'name': name, 'seconds': seconds, 'pages_per_s': pages / seconds, 'files_per_s': len(paths) / seconds}, extracted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--directory', default=None, help='Directory of PDFs to extract instead of synthetic ones')
+    parser.add_argument('--files', type=int, default=20, help='Number of synthetic PDFs')
+    parser.add_argument('--pages', type=int, default=60, help='Pages per synthetic PDF')
+    parser.add_argument('--table-share', type=float, default=0.25, help='Share of synthetic PDFs made of tables')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes, defaults to the CPU count')
+    parser.add_argument('--pages-per-task', type=int, default=8, help='Pages extracted per task of the pool')
+    parser.add_argument('--output', default=None, help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    workdir = None
+    tables = {}
+    if args.directory:
+        directory = args.directory
+    else:
+        directory = workdir = tempfile.mkdtemp(prefix='parse_benchmark_')
+        tables = synthetic_pdfs(directory, args.files, args.pages, args.table_share)
+    names = sorted(name for name in os.listdir(directory) if name.lower().endswith('.pdf'))
+    paths = [os.path.join(directory, name) for name in names]
+
+    try:
+        results = []
+        result, _ = measure('in-process', LocalPDFParser(workers=1), paths)
+        results.append(result)
+        pool_parser = LocalPDFParser(pages_per_task=args.pages_per_task, workers=args.workers)
+        # Starts the worker processes before timing
+        pool_parser.pool.submit(os.getpid).result()
+        result, extracted = measure(f'pool x{pool_parser.workers}', pool_parser, paths)
+        results.append(result)
+
+        policy = ParsePolicy(mode='auto')
+        choices = {name: policy.choose(name, '\n'.join(file_pages), len(file_pages))
+                   for name, file_pages in zip(names, extracted)}
+        sent = sorted(name for name, choice in choices.items() if choice == ParsePolicy.LLAMAPARSE)
+        print(f"auto policy sends {len(sent)}/{len(names)} files to LlamaParse")
+        policy_result = {'llamaparse_files': sent}
+        if tables:
+            policy_result['misrouted'] = sorted(name for name in names if (name in sent) != tables[name])
+            print(f"misrouted: {len(policy_result['misrouted'])}")
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'files': len(paths), 'results': results, 'policy': policy_result}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
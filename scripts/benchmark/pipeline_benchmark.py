@@ -0,0 +1,430 @@
+"""
+Offline end-to-end benchmark of the ingestion and query paths.
+
+SimpleRAG runs against local stand-ins of its external services, so results are reproducible
+and need no GPU, Ollama or LlamaParse:
+- a stub embedding server returning deterministic unit vectors derived from each text,
+- a fake Ollama endpoint streaming a fixed answer at a configurable token rate,
+- the parser fed from pre-extracted text through the parse cache.
+
+For every corpus size, in a fresh process, the benchmark measures `insert_VDB` throughput,
+`query_VDB` and retrieval latency percentiles, and resident memory. Results are written as JSON,
+and `--compare` checks them against a previous run, exiting with status 1 on a regression.
+
+Usage, from the repository root:
+    python -m scripts.benchmark.pipeline_benchmark --sizes 10 50 100 --output results.json
+    python -m scripts.benchmark.pipeline_benchmark --corpus cache/parsed --compare baseline.json
+    python -m scripts.benchmark.pipeline_benchmark --uri /tmp/bench.db --token-rate 30
+
+`--corpus` is a directory of parsed markdown or text files, e.g. the parse cache. Without it, a
+synthetic corpus of markdown filings is generated. Collections are stored by the EmbeddedBackend
+in a temporary directory, or on Milvus with `--uri`.
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+from scripts.benchmark.chunker_benchmark import synthetic_corpus, load_corpus
+
+# Metrics compared by `--compare`, and whether higher values are better
+COMPARED = {
+    'insert_chunks_per_s': True,
+    'query_p50_ms': False,
+    'query_p95_ms': False,
+    'retrieve_p50_ms': False,
+    'retrieve_p95_ms': False,
+    'peak_rss_mb': False,
+}
+
+
+class StubEmbeddingServer:
+    """
+    HTTP server speaking the NVEmbed protocol, returning deterministic unit vectors seeded by each text.
+    """
+
+    def __init__(self, dim: int = 4096, latency: float = 0.0):
+        """
+        Args:
+            dim (int): The dimension of the vectors.
+            latency (float): Seconds added to every request, to mimic the model.
+        """
+        self.dim = dim
+        self.latency = latency
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                texts = body['input']
+                if isinstance(texts, list):
+                    vectors = [server.vector(text) for text in texts]
+                else:
+                    vectors = server.vector(texts)
+                data = json.dumps(vectors).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.port = self.httpd.server_port
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def vector(self, text: str) -> list:
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return np.round(vector / np.linalg.norm(vector), 6).tolist()
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+class FakeOllamaServer:
+    """
+    HTTP server speaking the Ollama generate protocol, streaming a fixed answer at a set token rate.
+    A request without prompt loads the model, as Ollama does, and is counted in `preloads`.
+    """
+
+    def __init__(self, token_rate: float = 200.0, response_tokens: int = 32, first_token_latency: float = 0.0):
+        """
+        Args:
+            token_rate (float): Tokens streamed per second.
+            response_tokens (int): Tokens in every answer.
+            first_token_latency (float): Seconds before the first token, to mimic prompt processing.
+        """
+        self.token_rate = token_rate
+        self.response_tokens = response_tokens
+        self.first_token_latency = first_token_latency
+        self.requests = 0
+        self.preloads = 0
+        self.active = 0
+        self.peak_active = 0
+        self.keep_alive = None
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # The streamed response ends when the connection closes
+            protocol_version = 'HTTP/1.0'
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                server.keep_alive = body.get('keep_alive')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.end_headers()
+                if not body.get('prompt'):
+                    with server._lock:
+                        server.preloads += 1
+                    self.wfile.write(json.dumps({'model': body.get('model'), 'response': '', 'done': True}).encode('utf-8'))
+                    return
+                with server._lock:
+                    server.requests += 1
+                    server.active += 1
+                    server.peak_active = max(server.peak_active, server.active)
+                try:
+                    time.sleep(server.first_token_latency)
+                    for token in range(server.response_tokens):
+                        time.sleep(1 / server.token_rate)
+                        chunk = {'model': body.get('model'), 'response': f'token{token} ', 'done': False}
+                        self.wfile.write(json.dumps(chunk).encode('utf-8') + b'\n')
+                        self.wfile.flush()
+                    done = {'model': body.get('model'), 'response': '', 'done': True,
+                            'prompt_eval_count': len(body.get('prompt', '').split()),
+                            'eval_count': server.response_tokens}
+                    self.wfile.write(json.dumps(done).encode('utf-8') + b'\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stopped the generation
+                    pass
+                finally:
+                    with server._lock:
+                        server.active -= 1
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.port = self.httpd.server_port
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+def rss_mb() -> float:
+    """
+    Returns the current resident memory of the process, in MB (Linux only, 0 elsewhere).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        return 0.0
+
+
+def peak_rss_mb() -> float:
+    """
+    Returns the peak resident memory of the process, in MB.
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def percentiles(seconds: list, prefix: str) -> dict:
+    milliseconds = np.array(seconds) * 1000
+    return {f'{prefix}_p{q}_ms': float(np.percentile(milliseconds, q)) for q in (50, 95, 99)}
+
+
+def make_queries(corpus: list, pdf_names: list, n: int, seed: int = 0) -> list:
+    """
+    Picks `n` queries, each a sentence of one of the documents, asked on that document.
+    """
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n):
+        index = rng.randrange(len(corpus))
+        sentences = [s.strip() for s in corpus[index].replace('\n', ' ').split('.') if len(s.split()) > 5]
+        queries.append((rng.choice(sentences) if sentences else corpus[index][:200], pdf_names[index]))
+    return queries
+
+
+def offline_environment(workdir: str, embedding_port: int, ollama_port: int, uri: str = None) -> dict:
+    """
+    Returns the environment pointing SimpleRAG to the stand-in servers, with its caches and
+    embedded store under `workdir`. Module-level settings are read at import, so it must be
+    applied before importing SimpleRAG.
+    """
+    environment = {
+        'EMBEDDING_HOST': '127.0.0.1',
+        'EMBEDDING_PORT': str(embedding_port),
+        'EMBEDDING_CACHE': '0',
+        'OLLAMA_HOST': '127.0.0.1',
+        'OLLAMA_PORT': str(ollama_port),
+        'OLLAMA_HOSTS': f'127.0.0.1:{ollama_port}',
+        'PARSE_CACHE_DIR': os.path.join(workdir, 'parsed'),
+        'SPARSE_INDEX_DIR': os.path.join(workdir, 'sparse'),
+        'VDB_PATH': os.path.join(workdir, 'vdb'),
+        'VDB_BACKEND': 'milvus' if uri else 'embedded',
+        'METRICS_LOG': '0',
+        'LLAMAPARSER_API_KEY': os.getenv('LLAMAPARSER_API_KEY', 'llx-offline-benchmark'),
+    }
+    if uri:
+        environment['VDB_URI'] = uri
+    return environment
+
+
+def seed_documents(rag, corpus: list, document_path: str) -> list:
+    """
+    Writes placeholder PDFs whose parsed text is already in the parse cache, so they are never sent to LlamaParse.
+
+    Returns:
+        list: The names of the documents, in corpus order.
+    """
+    os.makedirs(document_path, exist_ok=True)
+    pdf_names = []
+    for index, text in enumerate(corpus):
+        pdf_name = f'document_{index:05d}'
+        file_path = os.path.join(document_path, pdf_name + '.pdf')
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        file_hash = rag.parse_cache.file_hash(file_path)
+        rag.parse_cache.put(rag.parse_cache.make_key(file_hash, rag.parser_settings), text, file_hash)
+        pdf_names.append(pdf_name)
+    return pdf_names
+
+
+def run_size(corpus: list, config: dict) -> dict:
+    """
+    Ingests a corpus and queries it, in a process of its own so memory is measured per corpus size.
+
+    Args:
+        corpus (list): The pre-extracted text of each document.
+        config (dict): The command-line arguments and the ports of the stand-in servers.
+
+    Returns:
+        dict: The measurements of this corpus size.
+    """
+    workdir = tempfile.mkdtemp(prefix='pipeline_benchmark_')
+    os.environ.update(offline_environment(workdir, config['embedding_port'], config['ollama_port'], config['uri']))
+    if not config['verbose']:
+        logging.disable(logging.INFO)
+    from scripts.main import SimpleRAG
+
+    rag = SimpleRAG(config['model'], retrieval_mode=config['retrieval_mode'])
+    colname = f"bench_pipeline_{len(corpus)}"
+    if rag.is_collection_exists(colname):
+        rag.drop_collection(colname)
+    rag.create_collection(colname)
+
+    document_path = os.path.join(workdir, 'documents')
+    pdf_names = seed_documents(rag, corpus, document_path)
+
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    rag.insert_VDB(colname, document_path, batch_size=config['batch_size'])
+    insert_seconds = time.perf_counter() - start
+    chunks = rag.metrics.counter('rag_chunks_total', op='inserted')
+    rss_after_insert = rss_mb()
+
+    queries = make_queries(corpus, pdf_names, config['queries'])
+    # Warm-up: loads the collection and the query path
+    rag.query_VDB(colname, *queries[0])
+    retrieve_seconds, query_seconds = [], []
+    for user_query, pdf_name in queries:
+        start = time.perf_counter()
+        rag.query_service.retrieve(colname, user_query, pdf_name)
+        retrieve_seconds.append(time.perf_counter() - start)
+    for index, (user_query, pdf_name) in enumerate(queries):
+        # A distinct query per call, so answers are not served from the answer cache
+        start = time.perf_counter()
+        rag.query_VDB(colname, f'{user_query} ({index})', pdf_name)
+        query_seconds.append(time.perf_counter() - start)
+
+    stages = {stage: {name: value for name, value in summary.items() if name != 'sum'}
+              for stage, summary in rag.metrics.stage_summary().items()}
+    rag.drop_collection(colname)
+    megabytes = sum(len(text.encode('utf-8')) for text in corpus) / 2 ** 20
+    return {
+        'documents': len(corpus),
+        'megabytes': megabytes,
+        'chunks': int(chunks),
+        'insert_s': insert_seconds,
+        'insert_chunks_per_s': chunks / insert_seconds if insert_seconds > 0 else 0.0,
+        'insert_mb_per_s': megabytes / insert_seconds if insert_seconds > 0 else 0.0,
+        **percentiles(retrieve_seconds, 'retrieve'),
+        **percentiles(query_seconds, 'query'),
+        'rss_before_insert_mb': rss_before,
+        'rss_after_insert_mb': rss_after_insert,
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': stages,
+    }
+
+
+def compare(results: list, baseline: dict, tolerance: float) -> list:
+    """
+    Compares results with a previous run, size by size.
+
+    Args:
+        results (list): The results of this run.
+        baseline (dict): The JSON output of a previous run.
+        tolerance (float): The relative change accepted before a metric counts as a regression.
+
+    Returns:
+        list: The regressions, as (documents, metric, previous, current) tuples.
+    """
+    previous = {result['documents']: result for result in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        before = previous.get(result['documents'])
+        if before is None:
+            continue
+        for metric, higher_is_better in COMPARED.items():
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            print(f"{result['documents']:>6} documents {metric:<22} {old:10.2f} -> {new:10.2f} "
+                  f"({change:+.1%}){'  REGRESSION' if regressed else ''}")
+            if regressed:
+                regressions.append((result['documents'], metric, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 100], help='Corpus sizes, in documents')
+    parser.add_argument('--corpus', default=None, help='Directory of parsed .md or .txt documents')
+    parser.add_argument('--pages', type=int, default=10, help='Sections per synthetic document')
+    parser.add_argument('--queries', type=int, default=50, help='Queries timed per corpus size')
+    parser.add_argument('--batch-size', type=int, default=64, help='Chunks embedded and inserted per request')
+    parser.add_argument('--dim', type=int, default=4096, help='Dimension of the stub embeddings')
+    parser.add_argument('--embed-latency', type=float, default=0.0, help='Seconds added to every embedding request')
+    parser.add_argument('--token-rate', type=float, default=200.0, help='Tokens per second of the fake Ollama')
+    parser.add_argument('--response-tokens', type=int, default=32, help='Tokens in every fake answer')
+    parser.add_argument('--first-token-latency', type=float, default=0.0, help='Seconds before the first token')
+    parser.add_argument('--model', default='phi3:latest', help='Model name sent to the fake Ollama')
+    parser.add_argument('--retrieval-mode', default='dense', help="'dense' or 'hybrid'")
+    parser.add_argument('--uri', default=None, help='Milvus URI or Milvus Lite file, defaults to the embedded store')
+    parser.add_argument('--output', default=None, help='Write the results to this JSON file')
+    parser.add_argument('--compare', default=None, help='JSON results of a previous run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Relative change counted as a regression')
+    parser.add_argument('--verbose', action='store_true', help='Keep the pipeline logs')
+    args = parser.parse_args()
+
+    if args.corpus:
+        documents = load_corpus(args.corpus)
+        # Larger sizes cycle through the recorded documents
+        corpus = [documents[index % len(documents)] for index in range(max(args.sizes))]
+    else:
+        corpus = synthetic_corpus(max(args.sizes), args.pages)
+
+    embedding = StubEmbeddingServer(dim=args.dim, latency=args.embed_latency)
+    ollama = FakeOllamaServer(args.token_rate, args.response_tokens, args.first_token_latency)
+    config = {**vars(args), 'embedding_port': embedding.port, 'ollama_port': ollama.port}
+
+    results = []
+    try:
+        for size in args.sizes:
+            # A fresh process per size: no state carried over, and a peak memory of its own
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                result = pool.submit(run_size, corpus[:size], config).result()
+            results.append(result)
+            print(f"{size:>6} documents {result['chunks']:>7} chunks "
+                  f"insert={result['insert_chunks_per_s']:8.1f} chunks/s "
+                  f"retrieve p50={result['retrieve_p50_ms']:.1f}ms p95={result['retrieve_p95_ms']:.1f}ms "
+                  f"query p50={result['query_p50_ms']:.1f}ms p95={result['query_p95_ms']:.1f}ms "
+                  f"peak_rss={result['peak_rss_mb']:.0f}MB")
+    finally:
+        embedding.close()
+        ollama.close()
+
+    output = {
+        'config': {name: value for name, value in vars(args).items() if name not in ('output', 'compare')},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count()},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions beyond {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Latency benchmark of concurrent document-filtered searches, with and without the SearchBatcher.
+
+A scratch collection holds `--chunks` random chunks for each of `--documents` documents. For every
+number of `--searched-documents`, `--concurrency` clients send `--requests` searches, each on one
+of that many documents, either one `search_batch` call per search in a worker thread (unbatched,
+as `QueryService.aretrieve` without a batcher) or through a SearchBatcher. The benchmark reports
+the throughput and the p50/p95/p99 latency of each, and the mean number of searches per request.
+
+Usage, from the repository root:
+    python -m scripts.benchmark.search_batch_benchmark --concurrency 32 --output results.json
+    python -m scripts.benchmark.search_batch_benchmark --uri /tmp/bench.db --search-latency 0
+
+Collections are stored by the EmbeddedBackend in a temporary directory, with `--search-latency`
+seconds added to every search request to mimic the round trip to a Milvus server, or on Milvus with `--uri`.
+"""
+import os
+import json
+import time
+import random
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+
+import numpy as np
+
+from scripts.benchmark.pipeline_benchmark import percentiles
+
+COLLECTION = 'bench_search_batch'
+
+
+class SlowBackend:
+    """
+    Delegates to a vector backend, adding a delay to every search request.
+    """
+
+    def __init__(self, backend, latency: float):
+        self.backend = backend
+        self.latency = latency
+        self.searches = 0
+
+    def search(self, *args, **kwargs):
+        self.searches += 1
+        time.sleep(self.latency)
+        return self.backend.search(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+
+async def run(search, queries: list, concurrency: int) -> tuple:
+    """
+    Sends the queries from `concurrency` concurrent clients.
+
+    Returns:
+        tuple: The latency of each search, and the elapsed seconds.
+    """
+    remaining = iter(queries)
+    seconds = []
+
+    async def client():
+        for vector, pdf_name in remaining:
+            start = time.perf_counter()
+            await search(vector, pdf_name)
+            seconds.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return seconds, time.perf_counter() - start
+
+
+def measure(vdb, backend: SlowBackend, name: str, queries: list, args) -> dict:
+    from scripts.rag.search_batcher import SearchBatcher
+
+    if name == 'unbatched':
+        async def search(vector, pdf_name):
+            return (await asyncio.to_thread(vdb.search_batch, COLLECTION, [vector], [pdf_name], args.k))[0]
+    else:
+        batcher = SearchBatcher(vdb, batch_window=args.batch_window, max_concurrency=args.max_concurrency)
+
+        async def search(vector, pdf_name):
+            return await batcher.search(COLLECTION, vector, pdf_name, args.k)
+
+    backend.searches = 0
+    seconds, elapsed = asyncio.run(run(search, queries, args.concurrency))
+    return {
+        'mode': name,
+        'searches_per_s': len(queries) / elapsed,
+        **percentiles(seconds, 'latency'),
+        'searches_per_request': len(queries) / max(backend.searches, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=64, help='Documents of the collection')
+    parser.add_argument('--chunks', type=int, default=32, help='Chunks per document')
+    parser.add_argument('--searched-documents', type=int, nargs='+', default=[1, 8, 64],
+                        help='Numbers of distinct documents the searches are spread over')
+    parser.add_argument('--concurrency', type=int, default=32, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=512, help='Searches sent per run')
+    parser.add_argument('--k', type=int, default=6, help='Chunks returned per search')
+    parser.add_argument('--batch-window', type=float, default=0.005, help='Seconds searches wait to be batched')
+    parser.add_argument('--max-concurrency', type=int, default=16, help='Batched requests in flight')
+    parser.add_argument('--search-latency', type=float, default=0.005,
+                        help='Seconds added to every search request of the embedded store')
+    parser.add_argument('--uri', default=None, help='Milvus URI or Milvus Lite file, instead of the embedded store')
+    parser.add_argument('--output', default=None, help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='search_batch_benchmark_')
+    os.environ.update({'VDB_BACKEND': 'milvus' if args.uri else 'embedded', 'VDB_PATH': os.path.join(workdir, 'vdb'),
+                       'SPARSE_INDEX': '0', 'METRICS_LOG': '0'})
+    if args.uri:
+        os.environ['VDB_URI'] = args.uri
+    logging.disable(logging.INFO)
+    from scripts.rag.VDB_Common import MilvusDB
+    from scripts.model.asyncEmbedModel import AsyncNVEmbed
+
+    vdb = MilvusDB()
+    backend = SlowBackend(vdb.backend, 0.0 if args.uri else args.search_latency)
+    MilvusDB._backend = backend
+    rng = np.random.default_rng(0)
+    results = []
+    try:
+        vdb.create_collection(COLLECTION)
+        pdf_names = [f'document_{index:05d}' for index in range(args.documents)]
+        for pdf_name in pdf_names:
+            vdb.insert_collection(COLLECTION, {
+                'pdf_name': [pdf_name] * args.chunks,
+                'chunk_number': list(range(args.chunks)),
+                MilvusDB.TEXT: [f'{pdf_name} chunk {number}' for number in range(args.chunks)],
+                'chunk_hash': [''] * args.chunks,
+                'doc_hash': [''] * args.chunks,
+                'doc_version': [1] * args.chunks,
+                MilvusDB.VECTOR: rng.standard_normal((args.chunks, AsyncNVEmbed.DIM)).astype(np.float32),
+            })
+
+        for searched in args.searched_documents:
+            picker = random.Random(searched)
+            queries = [(rng.standard_normal(AsyncNVEmbed.DIM).astype(np.float32).tolist(),
+                        picker.choice(pdf_names[:searched])) for _ in range(args.requests)]
+            for name in ('unbatched', 'batched'):
+                result = {'searched_documents': searched, **measure(vdb, backend, name, queries, args)}
+                results.append(result)
+                print(f"{searched:>4} documents {name:<10} {result['searches_per_s']:8.1f} searches/s "
+                      f"p50={result['latency_p50_ms']:7.1f}ms p99={result['latency_p99_ms']:7.1f}ms "
+                      f"{result['searches_per_request']:5.1f} searches/request")
+    finally:
+        vdb.drop_collection(COLLECTION)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'config': {key: value for key, value in vars(args).items() if key != 'output'},
+                       'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
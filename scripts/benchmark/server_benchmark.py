@@ -0,0 +1,162 @@
+"""
+Load benchmark of the query server against the offline stand-ins of the pipeline benchmark.
+
+A QueryServer is started on a prepared collection, and `--clients` concurrent HTTP clients send
+`--requests` distinct streamed queries, so none is served from the answer cache. The benchmark
+reports throughput, the p50/p95/p99 latency and time to first token of the answered queries, the
+queries shed with a 503, and the mean number of searches per batched vector search.
+
+Usage, from the repository root:
+    python -m scripts.benchmark.server_benchmark --clients 32 --requests 256 --output server.json
+    python -m scripts.benchmark.server_benchmark --clients 64 --max-concurrency 8 --max-pending 16
+
+The fake Ollama streams `--response-tokens` tokens at `--token-rate` tokens per second and is
+shared by all generations, with the `--llm-concurrency` slots of one Ollama host.
+"""
+import os
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+
+import aiohttp
+from aiohttp import web
+
+from scripts.benchmark.chunker_benchmark import synthetic_corpus
+from scripts.benchmark.pipeline_benchmark import (
+    StubEmbeddingServer, FakeOllamaServer, offline_environment, seed_documents, make_queries, percentiles
+)
+
+COLLECTION = 'bench_server'
+
+
+async def query(session: aiohttp.ClientSession, url: str, user_query: str, pdf_name: str) -> dict:
+    """
+    Sends one streamed query.
+
+    Returns:
+        dict: The HTTP status, the latency and the time to the first token, in seconds.
+    """
+    start = time.perf_counter()
+    first_token = None
+    payload = {'collection': COLLECTION, 'query': user_query, 'pdf_name': pdf_name, 'stream': True}
+    async with session.post(f'{url}/query', json=payload) as response:
+        if response.status != 200:
+            await response.read()
+            return {'status': response.status}
+        async for line in response.content:
+            if first_token is None and b'"token"' in line:
+                first_token = time.perf_counter() - start
+    return {'status': 200, 'seconds': time.perf_counter() - start, 'first_token': first_token}
+
+
+async def load(url: str, queries: list, clients: int) -> tuple:
+    """
+    Sends the queries from `clients` concurrent clients.
+
+    Returns:
+        tuple: The result of each query, and the elapsed seconds.
+    """
+    remaining = iter(enumerate(queries))
+    results = []
+
+    async def client(session: aiohttp.ClientSession):
+        for index, (user_query, pdf_name) in remaining:
+            # A distinct query per request, so answers are not served from the answer cache
+            results.append(await query(session, url, f'{user_query} ({index})', pdf_name))
+
+    start = time.perf_counter()
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=600)) as session:
+        await asyncio.gather(*(client(session) for _ in range(clients)))
+    return results, time.perf_counter() - start
+
+
+async def serve_and_load(args, rag, queries: list) -> dict:
+    from scripts.server import QueryServer
+
+    server = QueryServer(rag, collections=[COLLECTION], max_concurrency=args.max_concurrency,
+                         max_pending=args.max_pending, max_llm_backlog=args.max_llm_backlog,
+                         batch_window=args.batch_window)
+    await asyncio.to_thread(server.load)
+    runner = web.AppRunner(server.app())
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    try:
+        results, elapsed = await load(url, queries, args.clients)
+    finally:
+        await runner.cleanup()
+
+    answered = [result for result in results if result['status'] == 200]
+    batch_sizes = rag.metrics.histogram('rag_search_batch_size')
+    return {
+        'clients': args.clients,
+        'requests': len(results),
+        'answered': len(answered),
+        'shed': sum(1 for result in results if result['status'] == 503),
+        'errors': sum(1 for result in results if result['status'] not in (200, 503)),
+        'throughput_qps': len(answered) / elapsed,
+        **(percentiles([result['seconds'] for result in answered], 'latency') if answered else {}),
+        **(percentiles([result['first_token'] for result in answered if result['first_token'] is not None],
+                       'first_token') if answered else {}),
+        'search_batches': batch_sizes.count if batch_sizes else 0,
+        'mean_search_batch': batch_sizes.summary()['mean'] if batch_sizes else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=32, help='Concurrent HTTP clients')
+    parser.add_argument('--requests', type=int, default=256, help='Queries sent')
+    parser.add_argument('--documents', type=int, default=4, help='Documents of the prepared collection')
+    parser.add_argument('--max-concurrency', type=int, default=16, help='Queries answered at once by the server')
+    parser.add_argument('--max-pending', type=int, default=64, help='Queries waiting before new ones are shed')
+    parser.add_argument('--max-llm-backlog', type=int, default=32, help='LLM backlog from which queries are shed')
+    parser.add_argument('--batch-window', type=float, default=0.005, help='Seconds searches wait to be batched')
+    parser.add_argument('--llm-concurrency', type=int, default=8, help='Generations the fake Ollama host runs at once')
+    parser.add_argument('--token-rate', type=float, default=200.0, help='Tokens per second of the fake Ollama')
+    parser.add_argument('--response-tokens', type=int, default=16, help='Tokens per answer')
+    parser.add_argument('--model', default='phi3:latest', help='Model name sent to the fake Ollama')
+    parser.add_argument('--output', default=None, help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='server_benchmark_')
+    embedding = StubEmbeddingServer()
+    ollama = FakeOllamaServer(token_rate=args.token_rate, response_tokens=args.response_tokens)
+    try:
+        os.environ.update(offline_environment(workdir, embedding.port, ollama.port))
+        os.environ['OLLAMA_MAX_CONCURRENCY'] = str(args.llm_concurrency)
+        logging.disable(logging.INFO)
+        from scripts.main import SimpleRAG
+
+        rag = SimpleRAG(args.model)
+        rag.create_collection(COLLECTION)
+        corpus = synthetic_corpus(args.documents, 2)
+        document_path = os.path.join(workdir, 'documents')
+        pdf_names = seed_documents(rag, corpus, document_path)
+        rag.insert_VDB(COLLECTION, document_path)
+
+        result = asyncio.run(serve_and_load(args, rag, make_queries(corpus, pdf_names, args.requests)))
+        print(f"{result['answered']}/{result['requests']} answered, {result['shed']} shed, {result['errors']} errors, "
+              f"{result['throughput_qps']:.1f} queries/s")
+        if result['answered']:
+            print(f"latency p50={result['latency_p50_ms']:.0f}ms p95={result['latency_p95_ms']:.0f}ms "
+                  f"first token p50={result['first_token_p50_ms']:.0f}ms")
+        print(f"{result['search_batches']} batched searches, {result['mean_search_batch']:.1f} searches per batch")
+    finally:
+        embedding.close()
+        ollama.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'config': {key: value for key, value in vars(args).items() if key != 'output'},
+                       'result': result}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
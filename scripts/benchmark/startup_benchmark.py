@@ -0,0 +1,169 @@
+"""
+Startup-time benchmark of SimpleRAG processes.
+
+Short-lived workers pay for imports and client initialization on every start. Each scenario runs
+in fresh interpreter processes against the offline stand-ins of the pipeline benchmark, and reports
+the time to import SimpleRAG, to construct it, and to complete the first call, along with the
+heavy libraries the process ended up importing:
+- import:       `import scripts.main`
+- construct:    import, then `SimpleRAG(model)`
+- first_query:  construct, then one `query_VDB` on a prepared collection
+- first_insert: construct, then `insert_VDB` of a small corpus into a new collection
+
+Usage, from the repository root:
+    python -m scripts.benchmark.startup_benchmark --repeat 10 --output startup.json
+    python -m scripts.benchmark.startup_benchmark --scenarios first_query --importtime
+
+`--importtime` also prints the slowest imports of a bare `import scripts.main`, from `python -X importtime`.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+from scripts.benchmark.chunker_benchmark import synthetic_corpus
+from scripts.benchmark.pipeline_benchmark import (
+    StubEmbeddingServer, FakeOllamaServer, offline_environment, seed_documents
+)
+
+SCENARIOS = ('import', 'construct', 'first_query', 'first_insert')
+# Libraries whose import dominates startup, reported when a scenario loads them
+HEAVY_MODULES = ('langchain', 'langchain_community', 'langchain_core', 'langchain_milvus',
+                 'langchain_text_splitters', 'llama_index', 'llama_parse', 'nltk', 'pymilvus', 'httpx')
+COLLECTION = 'bench_startup'
+
+
+def child(scenario: str, config: dict) -> dict:
+    """
+    Runs one scenario in the current, fresh, process.
+
+    Returns:
+        dict: The duration of each phase, in seconds, and the heavy modules imported.
+    """
+    os.environ.update(config['environment'])
+    logging.disable(logging.INFO)
+    timings = {}
+    start = time.perf_counter()
+    from scripts.main import SimpleRAG
+    timings['import_s'] = time.perf_counter() - start
+
+    if scenario != 'import':
+        start = time.perf_counter()
+        rag = SimpleRAG(config['model'])
+        timings['construct_s'] = time.perf_counter() - start
+
+    if scenario == 'setup':
+        rag.create_collection(COLLECTION)
+        seed_documents(rag, synthetic_corpus(config['documents'], 2), config['document_path'])
+        rag.insert_VDB(COLLECTION, config['document_path'])
+    elif scenario == 'first_query':
+        start = time.perf_counter()
+        rag.query_VDB(COLLECTION, 'What was the revenue growth?', 'document_00000')
+        timings['first_call_s'] = time.perf_counter() - start
+    elif scenario == 'first_insert':
+        colname = f'{COLLECTION}_{os.getpid()}'
+        start = time.perf_counter()
+        rag.create_collection(colname)
+        rag.insert_VDB(colname, config['document_path'])
+        timings['first_call_s'] = time.perf_counter() - start
+        rag.drop_collection(colname)
+
+    timings['modules'] = [name for name in HEAVY_MODULES if name in sys.modules]
+    return timings
+
+
+def run_child(scenario: str, config: dict) -> dict:
+    """
+    Runs a scenario in a new interpreter and times the whole process.
+    """
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-m', 'scripts.benchmark.startup_benchmark', '--child', scenario, '--config', json.dumps(config)],
+        capture_output=True, text=True, check=True
+    )
+    process_seconds = time.perf_counter() - start
+    # The result is the last line, after anything the libraries print
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['process_s'] = process_seconds
+    return result
+
+
+def slowest_imports(environment: dict, top: int = 15) -> list:
+    """
+    Returns the slowest imports of `import scripts.main`, by cumulative time, from `python -X importtime`.
+    """
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import scripts.main'],
+        capture_output=True, text=True, env={**os.environ, **environment}
+    )
+    imports = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        imports.append((name, int(cumulative) / 1e6))
+    return sorted(imports, key=lambda entry: -entry[1])[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=SCENARIOS, help='Scenarios to run')
+    parser.add_argument('--repeat', type=int, default=5, help='Processes started per scenario')
+    parser.add_argument('--documents', type=int, default=3, help='Documents of the prepared and inserted corpus')
+    parser.add_argument('--model', default='phi3:latest', help='Model name sent to the fake Ollama')
+    parser.add_argument('--importtime', action='store_true', help='Print the slowest imports of scripts.main')
+    parser.add_argument('--output', default=None, help='Write the results to this JSON file')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--config', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args.child, json.loads(args.config))))
+        return
+
+    workdir = tempfile.mkdtemp(prefix='startup_benchmark_')
+    embedding = StubEmbeddingServer()
+    ollama = FakeOllamaServer(token_rate=1000, response_tokens=8)
+    config = {
+        'environment': offline_environment(workdir, embedding.port, ollama.port),
+        'model': args.model,
+        'documents': args.documents,
+        'document_path': os.path.join(workdir, 'documents'),
+    }
+    results = {}
+    try:
+        run_child('setup', config)
+        for scenario in args.scenarios:
+            runs = [run_child(scenario, config) for _ in range(args.repeat)]
+            phases = [name for name in ('import_s', 'construct_s', 'first_call_s', 'process_s') if name in runs[0]]
+            results[scenario] = {
+                **{phase: {'p50': float(np.percentile([run[phase] for run in runs], 50)),
+                           'max': float(max(run[phase] for run in runs))} for phase in phases},
+                'modules': runs[0]['modules'],
+            }
+            print(f"{scenario:<13} " + ' '.join(
+                f"{phase[:-2]}={results[scenario][phase]['p50'] * 1000:7.0f}ms" for phase in phases
+            ) + f"  imports: {', '.join(runs[0]['modules']) or '-'}")
+        if args.importtime:
+            print('Slowest imports of scripts.main:')
+            for name, seconds in slowest_imports(config['environment']):
+                print(f"  {seconds * 1000:7.0f}ms  {name}")
+    finally:
+        embedding.close()
+        ollama.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'repeat': args.repeat, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,10 @@
-from langchain_text_splitters import NLTKTextSplitter
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Callable, List, Optional, Tuple
+
+from scripts.data_processing.token_counter import count_tokens
 
 class TextSplitter:
     """
@@ -15,6 +21,8 @@ class TextSplitter:
             chunk_overlap (int): The number of overlapping characters between consecutive chunks.
         """
         super().__init__()
+        # Imported here so the FastChunker does not load LangChain and NLTK
+        from langchain_text_splitters import NLTKTextSplitter
         self.text_splitter = NLTKTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap
@@ -32,3 +40,226 @@ class TextSplitter:
         """
         chunks = self.text_splitter.split_text(text)
         return chunks
+
+
+class FastChunker:
+    """
+    A high-throughput chunker sizing chunks in tokens.
+
+    Text is cut into units at markdown structure (headings, blank lines, list items, table rows) and
+    at sentence ends with a single compiled regular expression, then consecutive units are packed into
+    chunks of at most `chunk_tokens` tokens, overlapping by up to `overlap_tokens`. A heading always
+    starts a new chunk. Chunks are returned as (start, end) offsets into the original text.
+    """
+
+    # Every alternative starts with one of [.!?\n], which keeps the regex scan fast.
+    # A newline ends a unit before a blank line, heading, list item or table row; punctuation ends a
+    # sentence (with its closing quotes, captured) when the next one starts with a capital or a digit.
+    BOUNDARY = re.compile(
+        r'[.!?\n](?:'
+        r'(?<=\n)(?:[ \t]*\n\s*|(?=[ \t]*(?:#{1,6}\s|[-*+]\s|\d+[.)]\s|\|)))'
+        r'|(?<!\n)([\'")\]]*)\s+(?=[\'"(\[]?[A-Z0-9])'
+        r')'
+    )
+    HEADING = re.compile(r'#{1,6}\s')
+    WORD = re.compile(r'\S+')
+    # First guess of the number of characters per token when a unit without spaces is cut
+    CHARS_PER_TOKEN: int = 4
+
+    def __init__(self,
+                 chunk_tokens: int = 128,
+                 overlap_tokens: int = 64,
+                 token_counter: Optional[Callable[[str], int]] = None):
+        """
+        Initializes the FastChunker with specified chunk size and overlap.
+
+        Parameters:
+            chunk_tokens (int): The maximum number of tokens of each chunk.
+            overlap_tokens (int): The maximum number of tokens shared by consecutive chunks.
+            token_counter (Optional[Callable[[str], int]]): Counts the tokens of a text, e.g. with the
+                tokenizer of the embedding model. Defaults to `token_counter.count_tokens`, which the
+                ContextPacker uses too.
+        """
+        if overlap_tokens >= chunk_tokens:
+            raise ValueError(f'overlap_tokens ({overlap_tokens}) must be smaller than chunk_tokens ({chunk_tokens})')
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.token_counter = token_counter
+
+    def _weight(self, text: str, start: int, end: int) -> int:
+        return (self.token_counter or count_tokens)(text[start:end])
+
+    def count_tokens(self, text: str, start: int = 0, end: Optional[int] = None) -> int:
+        """
+        Counts the tokens of text[start:end].
+        """
+        return self._weight(text, start, len(text) if end is None else end)
+
+    def _units(self, text: str) -> List[Tuple[int, int, float, bool]]:
+        """
+        Cuts a text into units.
+
+        Returns:
+            List[Tuple[int, int, int, bool]]: The start, end, token count and heading flag of each unit,
+                                              units longer than a chunk being cut into smaller ones.
+        """
+        units = []
+        start = 0
+        for match in [*FastChunker.BOUNDARY.finditer(text), None]:
+            if match is None:
+                end = len(text)
+            elif match.group(1) is None:
+                end = match.start()
+            else:
+                # The sentence keeps its punctuation and closing quotes
+                end = match.end(1)
+            # Leading and trailing whitespace stays outside the unit
+            while start < end and text[start].isspace():
+                start += 1
+            stop = end
+            while stop > start and text[stop - 1].isspace():
+                stop -= 1
+            if stop > start:
+                tokens = self._weight(text, start, stop)
+                heading = text[start] == '#' and FastChunker.HEADING.match(text, start) is not None
+                if tokens <= self.chunk_tokens:
+                    units.append((start, stop, tokens, heading))
+                else:
+                    units.extend(self._cut(text, start, stop, heading))
+            start = match.end() if match else len(text)
+        return units
+
+    def _cut(self, text: str, start: int, end: int, heading: bool) -> List[Tuple[int, int, int, bool]]:
+        # A unit longer than a chunk, e.g. a table dumped without punctuation, is cut every few words
+        positions = [match.start() for match in FastChunker.WORD.finditer(text, start, end)]
+        step = max(1, self.chunk_tokens)
+        pieces = []
+        first = 0
+        while first < len(positions):
+            last = min(first + step, len(positions))
+            piece_end = positions[last] if last < len(positions) else end
+            while piece_end > positions[first] and text[piece_end - 1].isspace():
+                piece_end -= 1
+            tokens = self._weight(text, positions[first], piece_end)
+            if tokens > self.chunk_tokens and last - first > 1:
+                # Denser than guessed, e.g. numbers split into many tokens by the tokenizer
+                step = max(1, min(last - first - 1, (last - first) * self.chunk_tokens // tokens))
+                continue
+            if tokens > self.chunk_tokens:
+                # A single word longer than a chunk, e.g. CJK text without spaces, is cut by characters
+                pieces.extend(self._cut_characters(text, positions[first], piece_end, heading and first == 0))
+            else:
+                pieces.append((positions[first], piece_end, tokens, heading and first == 0))
+            first = last
+        return pieces
+
+    def _cut_characters(self, text: str, start: int, end: int, heading: bool) -> List[Tuple[int, int, int, bool]]:
+        size = self.chunk_tokens * FastChunker.CHARS_PER_TOKEN
+        pieces = []
+        while start < end:
+            stop = min(start + size, end)
+            tokens = self._weight(text, start, stop)
+            if tokens > self.chunk_tokens and stop - start > 1:
+                size = max(1, min(stop - start - 1, (stop - start) * self.chunk_tokens // tokens))
+                continue
+            pieces.append((start, stop, tokens, heading and not pieces))
+            start = stop
+        return pieces
+
+    def split_offsets(self, text: str) -> List[Tuple[int, int]]:
+        """
+        Splits the provided document into chunks.
+
+        Parameters:
+            text (str): The document to be split into chunks.
+
+        Returns:
+            List[Tuple[int, int]]: The (start, end) offsets of each chunk in the text.
+        """
+        units = self._units(text)
+        chunks = []
+        first = 0
+        while first < len(units):
+            tokens = units[first][2]
+            last = first + 1
+            while last < len(units) and not units[last][3] and tokens + units[last][2] <= self.chunk_tokens:
+                tokens += units[last][2]
+                last += 1
+            # The whitespace between units may add tokens to the sum of theirs
+            while last - first > 1 and self._weight(text, units[first][0], units[last - 1][1]) > self.chunk_tokens:
+                last -= 1
+            chunks.append((units[first][0], units[last - 1][1]))
+            if last == len(units) or units[last][3]:
+                # No overlap across the end of a section
+                first = last
+                continue
+            # The next chunk starts with the trailing units of this one, up to overlap_tokens
+            next_first, overlap = last, 0
+            while next_first - 1 > first and overlap + units[next_first - 1][2] <= self.overlap_tokens:
+                next_first -= 1
+                overlap += units[next_first][2]
+            first = next_first
+        return chunks
+
+    def split_text(self, text: str) -> List[str]:
+        """
+        Splits the provided document into chunks.
+
+        Parameters:
+            text (str): The document to be split into chunks.
+
+        Returns:
+            list: A list of text chunks.
+        """
+        return [text[start:end] for start, end in self.split_offsets(text)]
+
+    def split_many(self, texts: List[str], workers: Optional[int] = None) -> List[List[Tuple[int, int]]]:
+        """
+        Splits many documents in parallel processes.
+
+        Parameters:
+            texts (List[str]): The documents to be split into chunks.
+            workers (Optional[int]): The number of processes, defaults to the CPU count.
+
+        Returns:
+            List[List[Tuple[int, int]]]: The chunk offsets of each document, in input order.
+        """
+        if self.token_counter is not None:
+            # A custom counter may not be picklable, split in this process
+            return [self.split_offsets(text) for text in texts]
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(
+                chunk_offsets, texts, repeat(self.chunk_tokens), repeat(self.overlap_tokens),
+                chunksize=max(1, len(texts) // (4 * workers))
+            ))
+
+
+# FastChunker instances cached per (chunk_tokens, overlap_tokens), one set per worker process
+_chunkers = {}
+
+
+def chunk_offsets(text: str, chunk_tokens: int = 128, overlap_tokens: int = 64) -> List[Tuple[int, int]]:
+    """
+    Splits a document with a FastChunker cached in the current process.
+    Defined at module level so it can be submitted to a process pool.
+
+    Parameters:
+        text (str): The document to be split into chunks.
+        chunk_tokens (int): The maximum number of tokens of each chunk.
+        overlap_tokens (int): The maximum number of tokens shared by consecutive chunks.
+
+    Returns:
+        List[Tuple[int, int]]: The (start, end) offsets of each chunk in the text.
+    """
+    key = (chunk_tokens, overlap_tokens)
+    if key not in _chunkers:
+        _chunkers[key] = FastChunker(chunk_tokens=chunk_tokens, overlap_tokens=overlap_tokens)
+    return _chunkers[key].split_offsets(text)
+
+
+def chunk_document(text: str, chunk_tokens: int = 128, overlap_tokens: int = 64) -> List[str]:
+    """
+    Like `chunk_offsets`, returning the text of each chunk.
+    """
+    return [text[start:end] for start, end in chunk_offsets(text, chunk_tokens, overlap_tokens)]
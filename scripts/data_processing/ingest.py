@@ -0,0 +1,391 @@
+import os
+import time
+import queue
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from scripts.data_processing.chunker import chunk_document
+from scripts.logger.logger import Log
+from scripts.logger.metrics import Metrics
+
+
+def chunk_hash(text: str) -> str:
+    """
+    Returns the SHA-256 of a chunk's text, used to detect changed chunks.
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _timed_chunk_document(text: str, chunk_tokens: int, overlap_tokens: int) -> tuple:
+    """
+    Runs `chunk_document` in a worker process and returns the chunks with the seconds it took,
+    so the split stage is timed without the time spent queued for a worker.
+    """
+    start = time.perf_counter()
+    chunks = chunk_document(text, chunk_tokens, overlap_tokens)
+    return chunks, time.perf_counter() - start
+
+
+def prefetch(iterable: Iterable, size: int = 1) -> Iterator:
+    """
+    Consumes an iterable in a background thread, keeping at most `size` items ready ahead of the caller.
+    Used to parse the next document while the current one is being chunked and embedded.
+
+    Args:
+        iterable (Iterable): The iterable to consume, e.g. `PDFParser.iter_directory(...)`.
+        size (int): The maximum number of items buffered ahead.
+
+    Yields:
+        The items of the iterable, in order. Errors raised by the iterable are re-raised here.
+    """
+    buffer = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        buffer.put((item, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            buffer.put((done, None))
+        except Exception as e:
+            buffer.put((done, e))
+
+    producer = threading.Thread(target=produce, name='prefetch', daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        # Unblocks the producer if the caller stops early
+        stop.set()
+
+
+class BatchIngestor:
+    """
+    BatchIngestor class to embed text chunks in batches and write them to the vector database.
+    Each batch is embedded with a single request and inserted with a single columnar insert,
+    while the insert of batch N runs in the background as batch N+1 is being embedded.
+    """
+
+    def __init__(self, embedder, vdb, batch_size: int = 64):
+        """
+        Initializes the BatchIngestor.
+
+        Args:
+            embedder: An object exposing `embed_documents(texts)` (e.g. NVEmbed).
+            vdb: An object exposing `insert_collection(colname, data)` (e.g. MilvusDB).
+            batch_size (int): The number of chunks embedded and inserted together.
+        """
+        if batch_size < 1:
+            raise ValueError(f'batch_size must be a positive integer, got {batch_size}')
+        self.logger = Log(f'{os.path.basename(__file__)}').getlog()
+        self.embedder = embedder
+        self.vdb = vdb
+        self.batch_size = batch_size
+
+    def _build_batch(self,
+                     pdf_name: str,
+                     chunk_numbers: List[int],
+                     chunks: List[str],
+                     doc_hash: Optional[str] = None,
+                     doc_version: Optional[int] = None) -> Dict[str, list]:
+        """
+        Embeds a batch of chunks and builds the columnar data expected by `insert_collection`.
+
+        Args:
+            pdf_name (str): The name of the PDF document the chunks belong to.
+            chunk_numbers (List[int]): The chunk number of each chunk in the batch.
+            chunks (List[str]): The chunk texts of the batch.
+            doc_hash (Optional[str]): The SHA-256 of the source file, for incremental collections.
+            doc_version (Optional[int]): The revision number of the document, for incremental collections.
+
+        Returns:
+            Dict[str, list]: Column lists keyed by field name.
+        """
+        vectors = self.embedder.embed_documents(chunks)
+        if len(vectors) != len(chunks):
+            raise ValueError(f'Embedding server returned {len(vectors)} vectors for {len(chunks)} chunks')
+        data = {
+            'pdf_name': [pdf_name] * len(chunks),
+            'chunk_number': list(chunk_numbers),
+            self.vdb.TEXT: chunks,
+            self.vdb.VECTOR: vectors
+        }
+        if doc_hash is not None:
+            data['chunk_hash'] = [chunk_hash(chunk) for chunk in chunks]
+            data['doc_hash'] = [doc_hash] * len(chunks)
+            data['doc_version'] = [doc_version] * len(chunks)
+        return data
+
+    def ingest(self,
+               colname: str,
+               pdf_name: str,
+               chunks: List[str],
+               chunk_numbers: Optional[List[int]] = None,
+               doc_hash: Optional[str] = None,
+               doc_version: Optional[int] = None) -> List[int]:
+        """
+        Embeds and inserts chunks of a document.
+
+        Args:
+            colname (str): The name of the collection to insert data into.
+            pdf_name (str): The name of the PDF document the chunks belong to.
+            chunks (List[str]): The chunk texts, in document order.
+            chunk_numbers (Optional[List[int]]): The chunk number of each chunk, 0..n-1 if None.
+            doc_hash (Optional[str]): The SHA-256 of the source file, for incremental collections.
+            doc_version (Optional[int]): The revision number of the document, for incremental collections.
+
+        Returns:
+            List[int]: The primary keys of the inserted chunks.
+        """
+        if chunk_numbers is None:
+            chunk_numbers = list(range(len(chunks)))
+        start_time = time.time()
+        pks = []
+        # A single writer keeps at most one insert in flight, so memory stays bounded to two batches.
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            pending = None
+            for start in range(0, len(chunks), self.batch_size):
+                end = start + self.batch_size
+                data = self._build_batch(pdf_name, chunk_numbers[start:end], chunks[start:end], doc_hash, doc_version)
+                if pending is not None:
+                    pks.extend(pending.result())
+                pending = writer.submit(self.vdb.insert_collection, colname, data)
+            if pending is not None:
+                pks.extend(pending.result())
+
+        seconds = time.time() - start_time
+        rate = len(chunks) / seconds if seconds > 0 else 0.0
+        self.logger.info(f'Inserted {len(chunks)} chunks of {pdf_name} in {seconds:.2f}s ({rate:.1f} chunks/s)')
+        return pks
+
+    def sync(self, colname: str, pdf_name: str, chunks: List[str], doc_hash: Optional[str] = None) -> Dict[str, object]:
+        """
+        Brings the stored chunks of a document in line with its current chunks. Stored chunks are matched
+        by their hash, so unchanged chunks moved by an insertion or deletion earlier in the file are kept
+        and only renumbered. Only new or changed chunks are embedded and inserted, and stale chunks are
+        deleted by primary key. Collections without chunk hashes get a full insert, replacing the rows
+        left by an interrupted insert.
+
+        The first chunk is the commit marker of a document: `check_existing_file` and `existing_files`
+        only look at it. It is rewritten on every revision, with the latest file hash and version,
+        and written last, so a document interrupted by a failure or a crash is synced again by the next run.
+
+        Args:
+            colname (str): The name of the collection.
+            pdf_name (str): The name of the PDF document.
+            chunks (List[str]): The current chunk texts, in document order.
+            doc_hash (Optional[str]): The SHA-256 of the source file, defaults to the hash of the text.
+
+        Returns:
+            dict: The document 'version', the primary keys 'inserted' and 'deleted', and the number of chunks
+                  'kept', of which 'moved' were renumbered.
+        """
+        existing = self.vdb.get_file_chunks(colname, pdf_name)
+        if not self.vdb.supports_incremental(colname):
+            stale = [row[self.vdb.ID_KEY] for row in existing]
+            inserted = self._write(colname, pdf_name, chunks, list(range(len(chunks))), stale)
+            return {'version': None, 'inserted': inserted, 'deleted': stale, 'kept': 0, 'moved': 0}
+
+        if doc_hash is None:
+            doc_hash = chunk_hash('\n'.join(chunks))
+        hashes = [chunk_hash(chunk) for chunk in chunks]
+        version = max((row['doc_version'] or 0 for row in existing), default=0) + 1
+
+        # Chunk number of each kept row, by primary key. The first chunk is always rewritten.
+        kept = {}
+        at_position = {(row['chunk_number'], row['chunk_hash']): row[self.vdb.ID_KEY] for row in existing}
+        for number in range(1, len(chunks)):
+            pk = at_position.get((number, hashes[number]))
+            if pk is not None:
+                kept[pk] = number
+        # Other rows are matched by hash alone, each at most once, so duplicate chunks keep one row each
+        free = {}
+        for row in existing:
+            if row[self.vdb.ID_KEY] not in kept:
+                free.setdefault(row['chunk_hash'], []).append(row[self.vdb.ID_KEY])
+        placed = set(kept.values())
+        moved = {}
+        for number in range(1, len(chunks)):
+            if number not in placed and free.get(hashes[number]):
+                moved[free[hashes[number]].pop(0)] = number
+                placed.add(number)
+        stale = [pk for pks in free.values() for pk in pks]
+        numbers = [number for number in range(len(chunks)) if number not in placed]
+
+        inserted = self._write(colname, pdf_name, chunks, numbers, stale, doc_hash, version, moved)
+        self.logger.info(
+            f'Synced {pdf_name} to version {version}: {len(inserted)} chunks inserted, '
+            f'{len(stale)} deleted, {len(kept) + len(moved)} unchanged of which {len(moved)} moved'
+        )
+        return {'version': version, 'inserted': inserted, 'deleted': stale, 'kept': len(kept) + len(moved),
+                'moved': len(moved)}
+
+    def _write(self,
+               colname: str,
+               pdf_name: str,
+               chunks: List[str],
+               numbers: List[int],
+               stale: list,
+               doc_hash: Optional[str] = None,
+               doc_version: Optional[int] = None,
+               moved: Optional[Dict[int, int]] = None) -> List[int]:
+        """
+        Inserts the chunks of a document with the given numbers, renumbers its moved rows and deletes
+        its stale rows, the first chunk last. Inserting before deleting keeps the document searchable
+        while it is synced.
+
+        Returns:
+            List[int]: The primary keys of the inserted chunks.
+        """
+        rest = [number for number in numbers if number != 0]
+        inserted = self.ingest(colname, pdf_name, [chunks[number] for number in rest], rest, doc_hash, doc_version) \
+            if rest else []
+        if moved:
+            self.vdb.renumber_chunks(colname, moved)
+        if stale:
+            self.vdb.delete_chunks(colname, stale)
+        if 0 in numbers:
+            inserted += self.ingest(colname, pdf_name, [chunks[0]], [0], doc_hash, doc_version)
+        return inserted
+
+
+class ConcurrentIngestor:
+    """
+    ConcurrentIngestor class to ingest many documents at once.
+    Splitting (CPU-bound) runs in a process pool, while embedding and inserting (I/O-bound)
+    run in a bounded thread pool. The number of documents in flight is capped, so memory
+    stays flat however many documents are fed in, and a failing document never aborts the run.
+    """
+
+    def __init__(self,
+                 embedder,
+                 vdb,
+                 batch_size: int = 64,
+                 io_workers: int = 4,
+                 split_workers: Optional[int] = None,
+                 max_inflight: Optional[int] = None):
+        """
+        Initializes the ConcurrentIngestor.
+
+        Args:
+            embedder: An object exposing `embed_documents(texts)` (e.g. NVEmbed).
+            vdb: An object exposing the insert, lookup and delete methods of MilvusDB.
+            batch_size (int): The number of chunks embedded and inserted together.
+            io_workers (int): The number of documents embedded and inserted concurrently.
+            split_workers (Optional[int]): The number of splitting processes, defaults to the CPU count.
+            max_inflight (Optional[int]): The maximum number of documents held in memory at once,
+                                          defaults to twice the number of I/O workers.
+        """
+        self.logger = Log(f'{os.path.basename(__file__)}').getlog()
+        self.vdb = vdb
+        self.batch_ingestor = BatchIngestor(embedder, vdb, batch_size=batch_size)
+        self.io_workers = io_workers
+        self.split_workers = split_workers or os.cpu_count() or 1
+        self.max_inflight = max_inflight or 2 * io_workers
+
+    def ingest_documents(self,
+                         colname: str,
+                         documents: Iterable[dict],
+                         chunk_tokens: int = 128,
+                         overlap_tokens: int = 64,
+                         skip_existing: bool = True) -> Dict[str, object]:
+        """
+        Splits, embeds and inserts documents concurrently.
+
+        Args:
+            colname (str): The name of the collection to insert data into.
+            documents (Iterable[dict]): Records with 'pdf_name', 'pdf_text' and optionally 'pdf_hash' keys,
+                                        as yielded by `PDFParser.iter_directory`. Consumed lazily.
+            chunk_tokens (int): The maximum number of tokens of each chunk.
+            overlap_tokens (int): The maximum number of tokens shared by consecutive chunks.
+            skip_existing (bool): Whether to skip documents already in the collection. Disable it when
+                                  the documents were already filtered before parsing.
+
+        Returns:
+            dict: The names of 'inserted' and 'skipped' documents, the error message of each 'failed'
+                  document, and the total number of 'chunks' inserted. Unchanged chunks of revised
+                  documents are not re-inserted and not counted.
+        """
+        summary = {'inserted': [], 'skipped': [], 'failed': {}, 'chunks': 0}
+        lock = threading.Lock()
+        # Backpressure: a slot is taken before a document is split and released once it is inserted.
+        slots = threading.BoundedSemaphore(self.max_inflight)
+        start_time = time.time()
+
+        def fail(pdf_name, error):
+            self.logger.error(f'Failed to ingest {pdf_name}: {error!r}')
+            with lock:
+                summary['failed'][pdf_name] = repr(error)
+
+        def embed_and_insert(pdf_name, doc_hash, chunks):
+            try:
+                result = self.batch_ingestor.sync(colname, pdf_name, chunks, doc_hash)
+                with lock:
+                    summary['inserted'].append(pdf_name)
+                    summary['chunks'] += len(result['inserted'])
+            except Exception as e:
+                fail(pdf_name, e)
+            finally:
+                slots.release()
+
+        def on_split(pdf_name, doc_hash, future):
+            try:
+                chunks, seconds = future.result()
+                Metrics.shared().observe(Metrics.STAGE_SECONDS, seconds, stage='split')
+                io_pool.submit(embed_and_insert, pdf_name, doc_hash, chunks)
+            except Exception as e:
+                fail(pdf_name, e)
+                slots.release()
+
+        with ProcessPoolExecutor(max_workers=self.split_workers) as split_pool, \
+                ThreadPoolExecutor(max_workers=self.io_workers) as io_pool:
+            for document in documents:
+                pdf_name = os.path.splitext(document['pdf_name'])[0]
+                doc_hash = document.get('pdf_hash')
+                try:
+                    if skip_existing and self.vdb.check_existing_file(colname=colname, pdf_name=pdf_name,
+                                                                      doc_hash=doc_hash):
+                        summary['skipped'].append(pdf_name)
+                        continue
+                except Exception as e:
+                    fail(pdf_name, e)
+                    continue
+
+                slots.acquire()
+                self.logger.info(f'Inserting file: {pdf_name}')
+                try:
+                    future = split_pool.submit(
+                        _timed_chunk_document, document['pdf_text'], chunk_tokens, overlap_tokens
+                    )
+                except Exception as e:
+                    fail(pdf_name, e)
+                    slots.release()
+                    continue
+                future.add_done_callback(lambda f, name=pdf_name, h=doc_hash: on_split(name, h, f))
+
+            # Wait for every in-flight document to release its slot before the pools shut down.
+            for _ in range(self.max_inflight):
+                slots.acquire()
+
+        seconds = time.time() - start_time
+        rate = summary['chunks'] / seconds if seconds > 0 else 0.0
+        self.logger.info(
+            f"Ingested {len(summary['inserted'])} files ({summary['chunks']} chunks) in {seconds:.2f}s "
+            f"({rate:.1f} chunks/s), skipped {len(summary['skipped'])}, failed {len(summary['failed'])}"
+        )
+        return summary
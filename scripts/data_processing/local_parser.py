@@ -0,0 +1,100 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from dotenv import load_dotenv, find_dotenv
+load_dotenv(find_dotenv())
+
+
+def extract_pages(file_path: str, start: int, stop: int, mode: str = 'plain') -> List[str]:
+    """
+    Extracts the text of a range of pages of a PDF file. Runs in the worker processes of `LocalPDFParser`.
+
+    Args:
+        file_path (str): Path to the PDF file.
+        start (int): The first page, from 0.
+        stop (int): The page after the last one.
+        mode (str): 'plain', or 'layout' to keep the columns of tables aligned.
+
+    Returns:
+        List[str]: The text of each page.
+    """
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    return [reader.pages[index].extract_text(extraction_mode=mode) or '' for index in range(start, stop)]
+
+
+class LocalPDFParser:
+    """
+    Extracts the text layer of PDF files locally with pypdf, without network access.
+
+    Files of more than `pages_per_task` pages are split into page ranges extracted in parallel by a
+    process pool, shared by every instance and created on the first large file. The text has no
+    markdown structure and scanned pages have none, see `ParsePolicy` to send such files to LlamaParse.
+    """
+
+    # Worker processes, shared by every instance and created on first use
+    _pool: Optional[ProcessPoolExecutor] = None
+    _pool_lock = threading.Lock()
+
+    def __init__(self, pages_per_task: int = None, workers: int = None, mode: str = None):
+        """
+        Args:
+            pages_per_task (int): The pages extracted per task, defaults to PARSE_PAGES_PER_TASK or 8.
+                Files with no more pages are extracted in the calling process.
+            workers (int): The number of worker processes, defaults to PARSE_WORKERS or the CPU count.
+            mode (str): The pypdf extraction mode, 'plain' or 'layout', defaults to PARSE_LOCAL_MODE or 'plain'.
+        """
+        self.pages_per_task = pages_per_task or int(os.getenv('PARSE_PAGES_PER_TASK', '8'))
+        self.workers = workers or int(os.getenv('PARSE_WORKERS', '0')) or os.cpu_count() or 1
+        self.mode = mode or os.getenv('PARSE_LOCAL_MODE', 'plain')
+        if self.mode not in ('plain', 'layout'):
+            raise ValueError(f"Unsupported extraction mode '{self.mode}', choose one of: plain, layout")
+
+    @property
+    def settings(self) -> dict:
+        """
+        The settings that change the extracted text, part of the parse cache key.
+        """
+        import pypdf
+        return {'parser': 'pypdf', 'version': pypdf.__version__, 'mode': self.mode}
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        """
+        The worker processes extracting page ranges, created on first use.
+        """
+        if LocalPDFParser._pool is None:
+            with LocalPDFParser._pool_lock:
+                if LocalPDFParser._pool is None:
+                    LocalPDFParser._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return LocalPDFParser._pool
+
+    @staticmethod
+    def page_count(file_path: str) -> int:
+        """
+        Returns:
+            int: The number of pages of a PDF file.
+        """
+        from pypdf import PdfReader
+        return len(PdfReader(file_path).pages)
+
+    def extract(self, file_path: str) -> List[str]:
+        """
+        Extracts the text of every page of a PDF file.
+
+        Args:
+            file_path (str): Path to the PDF file.
+
+        Returns:
+            List[str]: The text of each page, in page order.
+        """
+        pages = self.page_count(file_path)
+        if pages <= self.pages_per_task or self.workers == 1:
+            return extract_pages(file_path, 0, pages, self.mode)
+        futures = [
+            self.pool.submit(extract_pages, file_path, start, min(start + self.pages_per_task, pages), self.mode)
+            for start in range(0, pages, self.pages_per_task)
+        ]
+        return [page for future in futures for page in future.result()]
@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import atexit
+import hashlib
+import threading
+from typing import Optional
+
+from dotenv import load_dotenv, find_dotenv
+load_dotenv(find_dotenv())
+
+
+class ParseCache:
+    """
+    On-disk cache of parsed documents.
+
+    Entries are keyed by the SHA-256 of the file content and the parser settings, so a file is
+    parsed again only when its content or the way it is parsed changes. Content hashes are
+    memoized by path, size and modification time, so unchanged files are not re-read either.
+
+    The memoized hashes and the entries written for each content hash are kept in an index file,
+    written by `flush` at most every FLUSH_INTERVAL seconds while files are hashed, and at exit.
+    `prune` forgets the files that no longer exist and deletes the entries of the contents no file has anymore.
+    """
+
+    # Default location of the cache, next to the log directory
+    DEFAULT_DIR: str = os.getenv(
+        'PARSE_CACHE_DIR',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../cache/parsed")
+    )
+    INDEX_FILE: str = "index.json"
+    # Seconds between two writes of the index while files are hashed
+    FLUSH_INTERVAL: float = float(os.getenv('PARSE_CACHE_FLUSH_INTERVAL', '5'))
+
+    def __init__(self, cache_dir: str = None):
+        """
+        Initializes the ParseCache and creates its directory if needed.
+
+        Args:
+            cache_dir (str): Directory holding the cached markdown files.
+        """
+        self.cache_dir = cache_dir or ParseCache.DEFAULT_DIR
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(self.cache_dir, ParseCache.INDEX_FILE)
+        try:
+            with open(self._index_path, encoding="utf-8") as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            index = {}
+        # Indexes written before entries were tracked only hold the memoized hashes
+        if 'files' not in index:
+            index = {'files': index, 'entries': {}}
+        # Memoized hash of each file by path, and keys of the entries written for each content hash
+        self._index = index['files']
+        self._entries = {content_hash: set(keys) for content_hash, keys in index['entries'].items()}
+        self._dirty = False
+        self._flushed_at = time.monotonic()
+        atexit.register(self.flush)
+
+    def file_hash(self, file_path: str) -> str:
+        """
+        Returns the SHA-256 of a file's content, reusing the memoized value if the file is unchanged.
+
+        Args:
+            file_path (str): Path to the file.
+
+        Returns:
+            str: The hex digest of the file content.
+        """
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._index.get(path)
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['sha256']
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        sha256 = digest.hexdigest()
+        with self._lock:
+            self._index[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+            self._dirty = True
+            if time.monotonic() - self._flushed_at >= ParseCache.FLUSH_INTERVAL:
+                self._flush_locked()
+        return sha256
+
+    def flush(self):
+        """
+        Writes the index if it changed since it was last written.
+        """
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._dirty:
+            self._write_atomic(self._index_path, json.dumps({
+                'files': self._index,
+                'entries': {content_hash: sorted(keys) for content_hash, keys in self._entries.items()}
+            }))
+            self._dirty = False
+        self._flushed_at = time.monotonic()
+
+    def prune(self) -> int:
+        """
+        Forgets the memoized hashes of the files that no longer exist, and deletes the cached entries
+        of the contents that no remaining file has, e.g. the previous revisions of revised files.
+
+        Returns:
+            int: The number of entries deleted.
+        """
+        with self._lock:
+            for path in [path for path in self._index if not os.path.exists(path)]:
+                del self._index[path]
+            referenced = {entry['sha256'] for entry in self._index.values()}
+            stale = [content_hash for content_hash in self._entries if content_hash not in referenced]
+            keys = [key for content_hash in stale for key in self._entries.pop(content_hash)]
+            self._dirty = True
+            self._flush_locked()
+        for key in keys:
+            try:
+                os.remove(self._entry_path(key))
+            except FileNotFoundError:
+                pass
+        return len(keys)
+
+    @staticmethod
+    def make_key(content_hash: str, settings: dict) -> str:
+        """
+        Builds the cache key of a parsed document.
+
+        Args:
+            content_hash (str): The SHA-256 of the file content.
+            settings (dict): The parser settings affecting the output.
+
+        Returns:
+            str: The hex digest identifying the parsed output.
+        """
+        payload = content_hash + json.dumps(settings, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".md")
+
+    @staticmethod
+    def _write_atomic(path: str, text: str):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the cached markdown of a parsed document.
+
+        Args:
+            key (str): A key built with `make_key`.
+
+        Returns:
+            Optional[str]: The cached text, or None if the document was never parsed with these settings.
+        """
+        try:
+            with open(self._entry_path(key), encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, text: str, content_hash: Optional[str] = None):
+        """
+        Stores the markdown of a parsed document.
+
+        Args:
+            key (str): A key built with `make_key`.
+            text (str): The parsed text.
+            content_hash (Optional[str]): The SHA-256 of the file content the key was built from. The
+                                          entry is deleted by `prune` once no file has this content.
+        """
+        self._write_atomic(self._entry_path(key), text)
+        if content_hash is not None:
+            with self._lock:
+                self._entries.setdefault(content_hash, set()).add(key)
+                self._dirty = True
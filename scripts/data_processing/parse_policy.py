@@ -0,0 +1,129 @@
+import os
+import re
+from fnmatch import fnmatch
+from typing import Iterable, List
+
+from dotenv import load_dotenv, find_dotenv
+load_dotenv(find_dotenv())
+
+
+class ParsePolicy:
+    """
+    Chooses, per file, whether a PDF is extracted locally or parsed by LlamaParse.
+
+    - 'llamaparse': every file is sent to LlamaParse.
+    - 'local': every file is extracted locally, see `LocalPDFParser`.
+    - 'auto': every file is extracted locally, and sent to LlamaParse when its text layer is
+      table-heavy (more than `table_threshold` of its lines are rows of figures), which LlamaParse
+      renders as markdown tables, or nearly empty (less than `min_chars_per_page` characters per
+      page), as scanned pages are.
+
+    Files whose name matches a pattern of `llamaparse_files` or `local_files` are always parsed that
+    way. Without a LlamaParse API key, every file is extracted locally.
+    """
+
+    LOCAL: str = 'local'
+    LLAMAPARSE: str = 'llamaparse'
+    MODES: tuple = ('llamaparse', 'local', 'auto')
+    # A figure of a table cell: 1,234.5 (12.3) -4% $56
+    FIGURE = re.compile(r'^[(\-+$€£¥]*\d[\d,.]*[%)]*$')
+
+    def __init__(self,
+                 mode: str = 'llamaparse',
+                 llamaparse_available: bool = True,
+                 table_threshold: float = 0.2,
+                 min_chars_per_page: int = 50,
+                 llamaparse_files: Iterable[str] = (),
+                 local_files: Iterable[str] = ()):
+        """
+        Args:
+            mode (str): 'llamaparse', 'local' or 'auto'.
+            llamaparse_available (bool): Whether LlamaParse can be used, i.e. an API key is set.
+            table_threshold (float): The share of table rows above which 'auto' uses LlamaParse.
+            min_chars_per_page (int): The characters per page below which 'auto' uses LlamaParse.
+            llamaparse_files (Iterable[str]): Glob patterns of the file names always sent to LlamaParse.
+            local_files (Iterable[str]): Glob patterns of the file names always extracted locally.
+        """
+        if mode not in ParsePolicy.MODES:
+            raise ValueError(f"Unsupported parse mode '{mode}', choose one of: {', '.join(ParsePolicy.MODES)}")
+        self.mode = mode
+        self.llamaparse_available = llamaparse_available
+        self.table_threshold = table_threshold
+        self.min_chars_per_page = min_chars_per_page
+        self.llamaparse_files = list(llamaparse_files)
+        self.local_files = list(local_files)
+
+    @classmethod
+    def from_env(cls, llamaparse_available: bool) -> 'ParsePolicy':
+        """
+        Builds the policy from PARSE_BACKEND, PARSE_TABLE_THRESHOLD, PARSE_MIN_CHARS_PER_PAGE and the
+        comma-separated patterns of PARSE_LLAMAPARSE_FILES and PARSE_LOCAL_FILES.
+        """
+        def patterns(name: str) -> List[str]:
+            return [pattern.strip() for pattern in os.getenv(name, '').split(',') if pattern.strip()]
+
+        return cls(
+            mode=os.getenv('PARSE_BACKEND', 'llamaparse'),
+            llamaparse_available=llamaparse_available,
+            table_threshold=float(os.getenv('PARSE_TABLE_THRESHOLD', '0.2')),
+            min_chars_per_page=int(os.getenv('PARSE_MIN_CHARS_PER_PAGE', '50')),
+            llamaparse_files=patterns('PARSE_LLAMAPARSE_FILES'),
+            local_files=patterns('PARSE_LOCAL_FILES'),
+        )
+
+    def candidates(self, file_name: str) -> List[str]:
+        """
+        Returns the backends a file may be parsed with, LlamaParse first. With both, the file is
+        extracted locally and `choose` decides.
+
+        Args:
+            file_name (str): The name of the PDF file.
+
+        Returns:
+            List[str]: ['llamaparse'], ['local'] or ['llamaparse', 'local'].
+        """
+        if self.llamaparse_available and any(fnmatch(file_name, pattern) for pattern in self.llamaparse_files):
+            return [ParsePolicy.LLAMAPARSE]
+        if not self.llamaparse_available or self.mode == 'local' \
+                or any(fnmatch(file_name, pattern) for pattern in self.local_files):
+            return [ParsePolicy.LOCAL]
+        if self.mode == 'llamaparse':
+            return [ParsePolicy.LLAMAPARSE]
+        return [ParsePolicy.LLAMAPARSE, ParsePolicy.LOCAL]
+
+    def choose(self, file_name: str, text: str, pages: int = 1) -> str:
+        """
+        Chooses between the locally extracted text of a file and LlamaParse.
+
+        Args:
+            file_name (str): The name of the PDF file.
+            text (str): The locally extracted text.
+            pages (int): The number of pages of the file.
+
+        Returns:
+            str: 'llamaparse' for table-heavy or scanned files, 'local' otherwise.
+        """
+        if ParsePolicy.LLAMAPARSE not in self.candidates(file_name):
+            return ParsePolicy.LOCAL
+        if len(text.strip()) < self.min_chars_per_page * pages:
+            return ParsePolicy.LLAMAPARSE
+        if self.table_score(text) > self.table_threshold:
+            return ParsePolicy.LLAMAPARSE
+        return ParsePolicy.LOCAL
+
+    @staticmethod
+    def table_score(text: str) -> float:
+        """
+        Returns:
+            float: The share of the non-empty lines that look like table rows: at least three
+                   figures, and figures for at least a third of the tokens.
+        """
+        lines = [line.split() for line in text.splitlines() if line.strip()]
+        if not lines:
+            return 0.0
+        rows = 0
+        for tokens in lines:
+            figures = sum(1 for token in tokens if ParsePolicy.FIGURE.match(token))
+            if figures >= 3 and figures * 3 >= len(tokens):
+                rows += 1
+        return rows / len(lines)
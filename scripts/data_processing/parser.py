@@ -1,67 +1,189 @@
 import os
 import time
+import threading
 
-from llama_parse import LlamaParse
-from llama_index.core import SimpleDirectoryReader
 from scripts.logger.logger import Log
-from collections import defaultdict
+from scripts.logger.metrics import Metrics
+from scripts.data_processing.parseCache import ParseCache
+from scripts.data_processing.local_parser import LocalPDFParser
+from scripts.data_processing.parse_policy import ParsePolicy
+from typing import Callable, Iterator, List, Optional
 from dotenv import load_dotenv, find_dotenv
 load_dotenv(find_dotenv())
 
 
 class PDFParser:
     """
-    PDFParser class to handle parsing of PDF files using LlamaParse.
+    PDFParser class to handle parsing of PDF files using LlamaParse, or locally with pypdf.
     It can process individual PDF files or load all PDF files in a directory.
+
+    A `ParsePolicy`, configured by PARSE_BACKEND ('llamaparse', 'local' or 'auto'), chooses the
+    parser of each file. Without LLAMAPARSER_API_KEY, every file is extracted locally.
     """
 
     # API key for the LlamaParse service
     parser_api_key = os.getenv('LLAMAPARSER_API_KEY')
+    # LlamaParse client, shared by every instance and created on the first cache miss
+    _llama_parse = None
+    _llama_parse_lock = threading.Lock()
 
     def __init__(self):
         """
-        Initializes the PDFParser with a logger and an instance of LlamaParse.
+        Initializes the PDFParser with a logger, the parse cache, the local parser and the parse
+        policy. The LlamaParse client is only created when a file is not in the cache.
         """
         super().__init__()
         # Set up logger
         self.logger = Log(f'{os.path.basename(__file__)}').getlog()
 
-        # Initialize the LlamaParse data_processing with the API key and options
-        self.parser = LlamaParse(
-            api_key=self.parser_api_key,
-            result_type="markdown",
-            verbose=True
-        )
+        # Settings that change the parsed output, part of the parse cache key
+        self.parser_settings = {'parser': 'llamaparse', 'result_type': 'markdown'}
+        self.parse_cache = ParseCache()
+        self.local_parser = LocalPDFParser()
+        self.parse_policy = ParsePolicy.from_env(llamaparse_available=bool(self.parser_api_key))
+
+    @property
+    def parser(self):
+        """
+        The LlamaParse client, imported and created on first use.
+        """
+        if PDFParser._llama_parse is None:
+            with PDFParser._llama_parse_lock:
+                if PDFParser._llama_parse is None:
+                    from llama_parse import LlamaParse
+                    # Initialize the LlamaParse data_processing with the API key and options
+                    PDFParser._llama_parse = LlamaParse(
+                        api_key=self.parser_api_key,
+                        result_type="markdown",
+                        verbose=True
+                    )
+        return PDFParser._llama_parse
+
+    def _cache_key(self, file_hash: str, backend: str) -> str:
+        settings = self.parser_settings if backend == ParsePolicy.LLAMAPARSE else self.local_parser.settings
+        return self.parse_cache.make_key(file_hash, settings)
+
+    def parse_file(self, file_path: str, file_hash: Optional[str] = None) -> str:
+        """
+        Parses a single PDF file, serving the result from the parse cache when the file is unchanged.
+        The parse policy chooses between LlamaParse and local extraction.
+
+        Args:
+            file_path (str): Path to the PDF file.
+            file_hash (Optional[str]): The SHA-256 of the file content, computed if not given.
+
+        Returns:
+            str: The parsed text of all pages, joined with newlines.
+        """
+        file_name = os.path.basename(file_path)
+        file_hash = file_hash or self.parse_cache.file_hash(file_path)
+        candidates = self.parse_policy.candidates(file_name)
+        metrics = Metrics.shared()
+        for backend in candidates:
+            text = self.parse_cache.get(self._cache_key(file_hash, backend))
+            # A local result is only reused if the policy would still keep it
+            if text is not None and (backend == candidates[0] or self.parse_policy.choose(file_name, text) == backend):
+                metrics.inc('rag_cache_hits_total', cache='parse')
+                self.logger.info(f'Loaded parsed file from cache: {file_name}')
+                return text
+        metrics.inc('rag_cache_misses_total', cache='parse')
+
+        backend = ParsePolicy.LLAMAPARSE
+        if ParsePolicy.LOCAL in candidates:
+            with metrics.span('parse', backend=ParsePolicy.LOCAL):
+                pages = self.local_parser.extract(file_path)
+            text = '\n'.join(pages)
+            backend = self.parse_policy.choose(file_name, text, len(pages)) if len(candidates) > 1 else ParsePolicy.LOCAL
+            if backend == ParsePolicy.LLAMAPARSE:
+                self.logger.info(f'{file_name} is table-heavy or scanned, parsing it with LlamaParse')
+
+        if backend == ParsePolicy.LLAMAPARSE:
+            from llama_index.core import SimpleDirectoryReader
+            file_extractor = {".pdf": self.parser}
+            with metrics.span('parse', backend=ParsePolicy.LLAMAPARSE):
+                pages = SimpleDirectoryReader(input_files=[file_path], file_extractor=file_extractor).load_data()
+            text = '\n'.join(doc.text for doc in pages)
+        metrics.inc('rag_parsed_pages_total', len(pages), backend=backend)
+        self.parse_cache.put(self._cache_key(file_hash, backend), text, file_hash)
+        return text
+
+    @staticmethod
+    def list_files(directory_path: str, limit: Optional[int] = None) -> List[str]:
+        """
+        Lists the PDF files in the specified directory, in name order.
+
+        Args:
+            directory_path (str): Path to the directory containing PDF files.
+            limit (Optional[int]): The maximum number of files to list, all files if None.
 
-    def load_directory(self, directory_path: str, limit: int):
+        Returns:
+            List[str]: The PDF file names.
+        """
+        return sorted(f for f in os.listdir(directory_path) if f.lower().endswith('.pdf'))[:limit]
+
+    def iter_directory(self,
+                       directory_path: str,
+                       limit: Optional[int] = None,
+                       skip: Optional[Callable[[str, str], bool]] = None,
+                       on_error: Optional[Callable[[str, Exception], None]] = None) -> Iterator[dict]:
+        """
+        Lazily parses the PDF files in the specified directory, one file at a time, so only the
+        document being processed is held in memory.
+
+        Args:
+            directory_path (str): Path to the directory containing PDF files.
+            limit (Optional[int]): The maximum number of files to load, all files if None.
+            skip (Optional[Callable[[str, str], bool]]): Called with each file name and the SHA-256
+                of its content before parsing, files for which it returns True are not parsed.
+            on_error (Optional[Callable[[str, Exception], None]]): Called with the file name and the
+                error when a file fails to parse, the file is then skipped. Errors are raised if None.
+
+        Yields:
+            dict: {'pdf_name': file name, 'pdf_text': parsed text, 'pdf_hash': SHA-256 of the file}
+                  for each parsed file.
+        """
+        try:
+            for file_name in self.list_files(directory_path, limit):
+                file_path = os.path.join(directory_path, file_name)
+                try:
+                    file_hash = self.parse_cache.file_hash(file_path)
+                    if skip is not None and skip(file_name, file_hash):
+                        continue
+                    pdf_text = self.parse_file(file_path, file_hash)
+                except Exception as e:
+                    if on_error is None:
+                        raise
+                    self.logger.error(f'Failed to parse {file_name}: {e!r}')
+                    on_error(file_name, e)
+                    continue
+                yield {'pdf_name': file_name, 'pdf_text': pdf_text, 'pdf_hash': file_hash}
+            # The parsed outputs of deleted files and of previous revisions are no longer needed
+            pruned = self.parse_cache.prune()
+            if pruned:
+                self.logger.info(f'Pruned {pruned} stale entries from the parse cache')
+        finally:
+            self.parse_cache.flush()
+
+    def load_directory(self,
+                       directory_path: str,
+                       limit: Optional[int] = None,
+                       skip: Optional[Callable[[str, str], bool]] = None):
         """
         Loads and parses all PDF files in the specified directory.
 
         Args:
             directory_path (str): Path to the directory containing PDF files.
+            limit (Optional[int]): The maximum number of files to load, all files if None.
+            skip (Optional[Callable[[str, str], bool]]): Called with each file name and the SHA-256
+                of its content before parsing, files for which it returns True are not parsed.
 
         Returns:
             Parsed data from all PDF files in the directory.
         """
         self.logger.info(f'Loading all PDF files in directory, path: {directory_path}')
         current_time = time.time()
-        file_extractor = {".pdf": self.parser}
-        documents = SimpleDirectoryReader(directory_path, file_extractor=file_extractor, num_files_limit=limit).load_data()
-        grouped_documents = defaultdict(list)
-        for doc in documents:
-            filename = doc.metadata['file_name']  # Assuming the metadata contains the filename
-            grouped_documents[filename].append(doc)
-
-        all_docs = []
-        for key, values in grouped_documents.items():
-            result_dict = {'pdf_name': key, 'pdf_text': None}
-            texts = []
-            for value in values:
-                texts.append(value.text)
-            result_dict['pdf_text'] = '\n'.join(texts)
-            all_docs.append(result_dict)
+        all_docs = list(self.iter_directory(directory_path, limit=limit, skip=skip))
         end_time = time.time()
         seconds = end_time - current_time
         self.logger.info(f'It takes: {seconds}s to process files in path: {directory_path}')
         return all_docs
-
@@ -0,0 +1,30 @@
+import re
+
+# tiktoken encoding, loaded on first use, False if it is not available
+_encoding = None
+# Characters outside ASCII, e.g. CJK, which tokenizers split into about one token each
+_NON_ASCII = re.compile(r'[^\x00-\x7f]')
+
+
+def count_tokens(text: str) -> int:
+    """
+    Counts the tokens of a text with tiktoken's cl100k_base encoding. If the encoding is not available,
+    estimates four ASCII characters per token and one token per other character.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The number of tokens.
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    other = len(_NON_ASCII.findall(text))
+    return (len(text) - other + 3) // 4 + other
@@ -5,7 +5,7 @@ class VDBException(Exception):
 
 class MissingDBInfoError(VDBException):
     """Exception raised when database information is missing."""
-    def __init__(self, message="Environment variables VDB_HOST and VDB_PORT must be set."):
+    def __init__(self, message="Environment variables VDB_HOST and VDB_PORT (or VDB_URI) must be set, or VDB_BACKEND=embedded."):
         super().__init__(message)
 
 class CollectionNotFoundError(VDBException):
@@ -24,6 +24,26 @@ class ModelNotFoundError(VDBException):
         )
         super().__init__(message)
 
+class CodecNotFittedError(VDBException):
+    """Exception raised when vectors are stored or searched in a PCA-reduced collection whose projection is not fitted."""
+    def __init__(self, collection_name: str, dim: int):
+        message = (
+            f"The PCA projection of collection '{collection_name}' is not fitted. "
+            f"Call fit_codec('{collection_name}', vectors) with a sample of at least {dim} embeddings before inserting."
+        )
+        super().__init__(message)
+
+class LlmOverloadedError(Exception):
+    """Exception raised when the Ollama hosts cannot admit a generation: the wait queue is full or the wait timed out."""
+    def __init__(self, reason: str, queue_depth: int):
+        self.reason = reason
+        self.queue_depth = queue_depth
+        message = (
+            f"No Ollama host could take the generation ({reason}, {queue_depth} generations waiting). "
+            "Retry later or add hosts to OLLAMA_HOSTS."
+        )
+        super().__init__(message)
+
 class SimpleRagWarning():
 
     WarningModel = '70b'
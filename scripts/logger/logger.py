@@ -29,8 +29,10 @@ class Log:
         fh.setFormatter(formatter)
         ch.setFormatter(formatter)
 
-        self.logger.addHandler(fh)
-        self.logger.addHandler(ch)
+        # Loggers are shared per name, only attach handlers the first time
+        if not self.logger.handlers:
+            self.logger.addHandler(fh)
+            self.logger.addHandler(ch)
 
         fh.close()
         ch.close()
@@ -39,4 +41,20 @@ class Log:
         return self.logger
 
     def getpath(self):
-        return self.log_path
\ No newline at end of file
+        return self.log_path
+
+    def export(self, metrics):
+        """
+        Exporter of a `Metrics` registry: logs the latency of each stage, slowest first, and the counters.
+
+        Args:
+            metrics (Metrics): The registry to export.
+        """
+        for stage, summary in metrics.stage_summary().items():
+            self.logger.info(
+                f"stage={stage} count={summary['count']} total={summary['sum']:.3f}s "
+                f"p50={summary['p50'] * 1000:.1f}ms p95={summary['p95'] * 1000:.1f}ms p99={summary['p99'] * 1000:.1f}ms"
+            )
+        snapshot = metrics.snapshot()
+        for name, value in sorted({**snapshot['counters'], **snapshot['gauges']}.items()):
+            self.logger.info(f"{name} {value:g}")
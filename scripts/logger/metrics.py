@@ -0,0 +1,406 @@
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Optional, Tuple
+
+from scripts.logger.logger import Log
+
+from dotenv import load_dotenv, find_dotenv
+load_dotenv(find_dotenv())
+
+
+class Histogram:
+    """
+    Latency distribution of one metric: count and sum of all observations, and percentiles over
+    the most recent `max_samples` of them.
+    """
+
+    QUANTILES: tuple = (0.5, 0.95, 0.99)
+
+    def __init__(self, max_samples: int = 10000):
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=max_samples)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+
+    @staticmethod
+    def _nearest_rank(ordered: list, q: float) -> float:
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+    def percentile(self, q: float) -> float:
+        """
+        Returns:
+            float: The q-quantile of the recent samples, by nearest rank, 0 if there are none.
+        """
+        return self._nearest_rank(sorted(self.samples), q)
+
+    def summary(self) -> Dict[str, float]:
+        """
+        Returns:
+            Dict[str, float]: count, sum, mean, p50, p95 and p99.
+        """
+        ordered = sorted(self.samples)
+        summary = {'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count if self.count else 0.0}
+        for q in Histogram.QUANTILES:
+            summary[f'p{int(q * 100)}'] = self._nearest_rank(ordered, q)
+        return summary
+
+
+class Metrics:
+    """
+    Registry of the pipeline's counters, gauges and latency histograms, shared by all components.
+
+    Stages (parse, split, embed, insert, retrieve, prompt, generate) are timed with `span`, whose
+    durations are recorded in the `rag_stage_seconds` histogram labelled by stage. Metrics are exported
+    in the Prometheus text format by `to_prometheus`, by the HTTP endpoint of `serve` or to a file,
+    and to any exporter object with an `export(metrics)` method, such as `Log`.
+
+    Stages listed in METRICS_PROFILE (comma-separated, or 'all') are profiled with cProfile, or with
+    pyinstrument if METRICS_PROFILER=pyinstrument, and their profiles written to METRICS_PROFILE_DIR.
+
+    The shared registry logs its metrics on `export` through a `Log`, set METRICS_LOG=0 to disable it.
+    METRICS_FILE adds a Prometheus text file exporter, and METRICS_PORT starts the HTTP endpoint.
+    """
+
+    _shared: Optional['Metrics'] = None
+    _shared_lock = threading.Lock()
+
+    STAGE_SECONDS: str = 'rag_stage_seconds'
+    # Default directory of the stage profiles
+    DEFAULT_PROFILE_DIR: str = os.getenv(
+        'METRICS_PROFILE_DIR',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../log/profiles")
+    )
+
+    def __init__(self,
+                 max_samples: int = 10000,
+                 profile_stages: Optional[Iterable[str]] = None,
+                 profiler: str = 'cprofile',
+                 profile_dir: str = None):
+        """
+        Args:
+            max_samples (int): The number of recent observations kept per histogram for percentiles.
+            profile_stages (Optional[Iterable[str]]): The stages to profile, 'all' for every stage.
+            profiler (str): 'cprofile' or 'pyinstrument'.
+            profile_dir (str): The directory the profiles are written to.
+        """
+        self.max_samples = max_samples
+        self.profile_stages = set(profile_stages or [])
+        self.profiler = profiler
+        self.profile_dir = profile_dir or Metrics.DEFAULT_PROFILE_DIR
+        self.counters: Dict[Tuple[str, tuple], float] = {}
+        self.gauges: Dict[Tuple[str, tuple], float] = {}
+        self.histograms: Dict[Tuple[str, tuple], Histogram] = {}
+        self.exporters: list = []
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls) -> 'Metrics':
+        """
+        Returns the process-wide registry, configured from the METRICS_* environment variables.
+        """
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    stages = [stage.strip() for stage in os.getenv('METRICS_PROFILE', '').split(',') if stage.strip()]
+                    metrics = cls(profile_stages=stages, profiler=os.getenv('METRICS_PROFILER', 'cprofile'))
+                    if os.getenv('METRICS_LOG', '1') != '0':
+                        metrics.add_exporter(Log('metrics'))
+                    if os.getenv('METRICS_FILE'):
+                        metrics.add_exporter(PrometheusFileExporter(os.getenv('METRICS_FILE')))
+                    if os.getenv('METRICS_PORT'):
+                        metrics.serve(int(os.getenv('METRICS_PORT')))
+                    cls._shared = metrics
+        return cls._shared
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> Tuple[str, tuple]:
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+        Adds to a counter.
+
+        Args:
+            name (str): The name of the counter, e.g. 'rag_chunks_total'.
+            value (float): The increment.
+            **labels: The labels of the series, e.g. cache='answer'.
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """
+        Sets a gauge, a value that goes up and down such as a queue depth.
+
+        Args:
+            name (str): The name of the gauge, e.g. 'rag_llm_queue_depth'.
+            value (float): The current value.
+            **labels: The labels of the series.
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self.gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        Records an observation in a histogram.
+
+        Args:
+            name (str): The name of the histogram, e.g. 'rag_stage_seconds'.
+            value (float): The observed value.
+            **labels: The labels of the series.
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.max_samples)
+            histogram.observe(value)
+
+    def counter(self, name: str, **labels) -> float:
+        """
+        Returns:
+            float: The value of a counter, 0 if it was never incremented.
+        """
+        with self._lock:
+            return self.counters.get(self._key(name, labels), 0)
+
+    def gauge(self, name: str, **labels) -> float:
+        """
+        Returns:
+            float: The value of a gauge, 0 if it was never set.
+        """
+        with self._lock:
+            return self.gauges.get(self._key(name, labels), 0)
+
+    def histogram(self, name: str, **labels) -> Optional[Histogram]:
+        """
+        Returns:
+            Optional[Histogram]: The histogram of a series, None if it has no observations.
+        """
+        with self._lock:
+            return self.histograms.get(self._key(name, labels))
+
+    @contextmanager
+    def span(self, stage: str, **labels):
+        """
+        Times a stage of the pipeline, profiling it if it is listed in `profile_stages`.
+
+        Args:
+            stage (str): The name of the stage, e.g. 'embed'.
+            **labels: Extra labels of the series.
+
+        Example:
+            with metrics.span('retrieve'):
+                docs = retriever.invoke(query)
+        """
+        profiler = self._start_profile(stage)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(Metrics.STAGE_SECONDS, time.perf_counter() - start, stage=stage, **labels)
+            if profiler is not None:
+                self._stop_profile(stage, profiler)
+
+    def timed(self, stage: str):
+        """
+        Decorator timing every call of a function as a stage.
+        """
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _start_profile(self, stage: str):
+        if stage not in self.profile_stages and 'all' not in self.profile_stages:
+            return None
+        if self.profiler == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                raise ImportError("METRICS_PROFILER=pyinstrument needs the pyinstrument package: pip install pyinstrument")
+            # Async mode is disabled, so spans of concurrent tasks can be profiled
+            profiler = Profiler(async_mode='disabled')
+            profiler.start()
+            return profiler
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active on this thread, e.g. a concurrent or enclosing span
+            return None
+        return profiler
+
+    def _stop_profile(self, stage: str, profiler):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"{stage}_{time.strftime('%Y%m%d-%H%M%S')}_{time.time_ns() % 10 ** 9}")
+        if self.profiler == 'pyinstrument':
+            profiler.stop()
+            with open(path + '.html', 'w', encoding='utf-8') as f:
+                f.write(profiler.output_html())
+        else:
+            profiler.disable()
+            profiler.dump_stats(path + '.prof')
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+            dict: The counters, gauges and histogram summaries, keyed by name and labels.
+        """
+        with self._lock:
+            return {
+                'counters': {self._format(name, labels): value for (name, labels), value in self.counters.items()},
+                'gauges': {self._format(name, labels): value for (name, labels), value in self.gauges.items()},
+                'histograms': {
+                    self._format(name, labels): histogram.summary()
+                    for (name, labels), histogram in self.histograms.items()
+                },
+            }
+
+    def stage_summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns:
+            Dict[str, Dict[str, float]]: The latency summary of each stage, slowest total first.
+        """
+        with self._lock:
+            stages = {
+                self._format(dict(labels)['stage'], tuple(label for label in labels if label[0] != 'stage')):
+                    histogram.summary()
+                for (name, labels), histogram in self.histograms.items() if name == Metrics.STAGE_SECONDS
+            }
+        return dict(sorted(stages.items(), key=lambda item: -item[1]['sum']))
+
+    @staticmethod
+    def _format(name: str, labels: tuple) -> str:
+        if not labels:
+            return name
+        return name + '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+    def to_prometheus(self) -> str:
+        """
+        Renders the metrics in the Prometheus text exposition format. Counters and gauges are exported
+        as such, histograms as summaries with their 0.5, 0.95 and 0.99 quantiles.
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            summaries = [(key, histogram.summary()) for key, histogram in histograms]
+
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f'# TYPE {name} counter')
+                typed.add(name)
+            lines.append(f'{self._format(name, labels)} {value}')
+        for (name, labels), value in gauges:
+            if name not in typed:
+                lines.append(f'# TYPE {name} gauge')
+                typed.add(name)
+            lines.append(f'{self._format(name, labels)} {value}')
+        for (name, labels), summary in summaries:
+            if name not in typed:
+                lines.append(f'# TYPE {name} summary')
+                typed.add(name)
+            for q in Histogram.QUANTILES:
+                lines.append(f"{self._format(name, labels + (('quantile', str(q)),))} {summary[f'p{int(q * 100)}']}")
+            lines.append(f"{self._format(name + '_sum', labels)} {summary['sum']}")
+            lines.append(f"{self._format(name + '_count', labels)} {summary['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str):
+        """
+        Writes the metrics to a file in the Prometheus text format, e.g. for the node exporter's
+        textfile collector. The file is replaced atomically.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def serve(self, port: int, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+        """
+        Serves the metrics in the Prometheus text format on http://host:port/metrics, from a
+        daemon thread. Only one endpoint is started per registry.
+
+        Returns:
+            ThreadingHTTPServer: The running server.
+        """
+        with self._lock:
+            if self._server is not None:
+                return self._server
+            metrics = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] != '/metrics':
+                        self.send_error(404)
+                        return
+                    body = metrics.to_prometheus().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self._server = ThreadingHTTPServer((host, port), Handler)
+            threading.Thread(target=self._server.serve_forever, name='MetricsServer', daemon=True).start()
+            return self._server
+
+    def add_exporter(self, exporter):
+        """
+        Registers an exporter, an object with an `export(metrics)` method called by `export`.
+        """
+        with self._lock:
+            self.exporters.append(exporter)
+
+    def export(self):
+        """
+        Sends the metrics to every registered exporter.
+        """
+        for exporter in list(self.exporters):
+            exporter.export(self)
+
+    def reset(self):
+        """
+        Clears all counters, gauges and histograms.
+        """
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+
+class PrometheusFileExporter:
+    """
+    Exporter writing the metrics to a file in the Prometheus text format.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, metrics: Metrics):
+        metrics.write_prometheus(self.path)
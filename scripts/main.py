@@ -1,71 +1,219 @@
+import os
+import sys
 import time
+from typing import AsyncIterator, Iterator, List, Optional
 
-from rag.VDB_Common import *
-from rag.Prompts import FinancialExpertPrompt
-from data_processing.parser import PDFParser
-from data_processing.chunker import TextSplitter
-from model.embedModel import NVEmbed
-from logger.exceptions import MissingDBInfoError, CollectionNotFoundError, SimpleRagWarning
+if __name__ == '__main__':
+    # Run as a script from scripts/: the modules are imported from the repository root, as `scripts.*`,
+    # so they are loaded once whoever imports them
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from scripts.rag.VDB_Common import MilvusDB
+from scripts.rag.Prompts import FinancialExpertPrompt
+from scripts.rag.index_config import IndexConfig
+from scripts.rag.vector_codec import VectorCodec
+from scripts.rag.filter_config import FilterConfig
+from scripts.rag.models import validate_model
+from scripts.data_processing.parser import PDFParser
+from scripts.logger.logger import Log
+from scripts.logger.metrics import Metrics
+from scripts.logger.exceptions import MissingDBInfoError, CollectionNotFoundError, SimpleRagWarning
 
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.output_parsers import StrOutputParser
-from rag.llm import Llm
 import warnings
 
 class SimpleRAG(
     MilvusDB,
     PDFParser,
-    NVEmbed,
     FinancialExpertPrompt,
     SimpleRagWarning
 ):
+    """
+    Retrieval-augmented generation over PDF documents. The embedding model, the vector store, the
+    PDF parser and the language model client are process-wide and created on first use, and the
+    ingestion stack is only imported by the insert methods, so query-only processes start quickly.
+    """
 
-    def __init__(self, model: str) -> None:
+    def __init__(self, model: str, retrieval_mode: str = None) -> None:
         """
         Initialize the SimpleRAG instance.
 
         Args:
             model (str): The name of the language model to be used.
+            retrieval_mode (str): 'dense' for vector search only, or 'hybrid' to fuse it with BM25 search.
+                                  Defaults to RETRIEVAL_MODE or 'dense'.
+
+        Raises:
+            ModelNotFoundError: The model is not served. The client itself is only created on the first query.
         """
+        validate_model(model)
         super().__init__()
         self.logger = Log(f'{os.path.basename(__file__)}').getlog()
         self.model = model
-        self.llm = Llm(model=self.model)
+        self.retrieval_mode = retrieval_mode
         self.QA_CHAIN_PROMPT = self.get_prompt_template()
+        self._query_service = None
+        # Stage timings and counters, shared with the parser, embedder, vector database and query service
+        self.metrics = Metrics.shared()
+
+    @property
+    def llm(self):
+        """
+        The language model, shared by every SimpleRAG of the process and routed across the Ollama hosts.
+        """
+        from scripts.rag.ollama_pool import OllamaPool
+        return OllamaPool.shared().llm(self.model)
+
+    @property
+    def query_service(self):
+        """
+        The query service, created on the first query.
+        """
+        if self._query_service is None:
+            from scripts.rag.query_service import QueryService
+            self._query_service = QueryService(
+                vdb=self,
+                llm=self.llm,
+                prompt=self.QA_CHAIN_PROMPT,
+                model=self.model,
+                prompt_version=self.PROMPT_VERSION,
+                retrieval_mode=self.retrieval_mode
+            )
+        return self._query_service
+
+    def _invalidate_answers(self, colname: str, pdf_name: Optional[str] = None):
+        """
+        Forget the cached answers of a collection or a document. Answers are only cached in memory
+        once the query service exists, so ingestion-only processes do not create it.
+        """
+        if self._query_service is None:
+            return
+        if pdf_name is None:
+            self._query_service.invalidate(colname)
+        else:
+            self._query_service.invalidate_document(colname, pdf_name)
 
-    def insert_VDB(self, colname: str, document_path: str):
+    def _existing_file_filter(self, colname: str, document_path: str, limit: int = None):
+        """
+        Build a filter telling whether a PDF file is already stored in the collection, from its current content.
+        All files of the directory are looked up at once with a bulk existence query.
+
+        Args:
+            colname (str): The name of the collection in the vector database.
+            document_path (str): The path to the directory containing PDF documents.
+            limit (int): The maximum number of PDF files to load, all files if None.
+
+        Returns:
+            Callable[[str, str], bool]: Takes a PDF file name and its SHA-256, returns True if it is already inserted.
+        """
+        file_hashes = {
+            os.path.splitext(file_name)[0]: self.parse_cache.file_hash(os.path.join(document_path, file_name))
+            for file_name in self.list_files(document_path, limit)
+        }
+        self.parse_cache.flush()
+        existing = self.existing_files(colname, file_hashes.keys(), doc_hashes=file_hashes)
+        if existing:
+            self.logger.info(f'{len(existing)} files are already exist in our vector database')
+        return lambda file_name, file_hash: os.path.splitext(file_name)[0] in existing
+
+    def insert_VDB(self, colname: str, document_path: str, batch_size: int = 64, limit: int = None):
         """
         Insert documents from a specified directory into the vector database.
+        Documents are parsed one at a time while the previous one is being chunked and embedded.
+        Revised documents are re-ingested incrementally: only new or changed chunks are embedded.
 
         Args:
             colname (str): The name of the collection in the vector database.
             document_path (str): The path to the directory containing PDF documents.
+            batch_size (int): The number of chunks embedded and inserted per request.
+            limit (int): The maximum number of PDF files to load, all files if None.
         """
         if not self.is_collection_exists(colname):
             raise CollectionNotFoundError(colname)
+        from scripts.data_processing.chunker import FastChunker
+        from scripts.data_processing.ingest import BatchIngestor, prefetch
 
-        documents = self.load_directory(document_path, limit=3)
-        text_splitter = TextSplitter(chunk_size=500, chunk_overlap=250)
+        # Existing files are skipped before they are parsed
+        documents = prefetch(
+            self.iter_directory(
+                document_path, limit=limit, skip=self._existing_file_filter(colname, document_path, limit)
+            )
+        )
+        chunker = FastChunker(chunk_tokens=128, overlap_tokens=64)
+        ingestor = BatchIngestor(embedder=self.embed_model, vdb=self, batch_size=batch_size)
+        start_time = time.time()
+        total_chunks = 0
 
         for document in documents:
-            pdf_name = document['pdf_name'].replace('.pdf', '')
+            pdf_name = os.path.splitext(document['pdf_name'])[0]
             pdf_text = document['pdf_text']
-            if self.check_existing_file(colname=colname, pdf_name=pdf_name):
-                continue
 
             self.logger.info(f'Inserting file: {pdf_name}')
-            chunks = text_splitter.split_text(pdf_text)
-            for i, chunk in enumerate(chunks):
-                chunk_vector = self.embed_documents([chunk])
-                data = [
-                    [pdf_name], # pdf_name
-                    [i], # chunk_number
-                    [chunk], # chunk_text
-                    chunk_vector # chunk_vector
-                ]
-                self.insert_collection(colname, data)
+            with self.metrics.span('split'):
+                chunks = chunker.split_text(pdf_text)
+            result = ingestor.sync(colname, pdf_name, chunks, doc_hash=document['pdf_hash'])
+            total_chunks += len(result['inserted'])
+            if result['inserted'] or result['deleted']:
+                # Answers generated from the previous revision are stale
+                self._invalidate_answers(colname, pdf_name)
             self.logger.info(f'Inserted file - {pdf_name}')
 
+        seconds = time.time() - start_time
+        rate = total_chunks / seconds if seconds > 0 else 0.0
+        self.logger.info(f'Inserted {total_chunks} chunks in {seconds:.2f}s ({rate:.1f} chunks/s)')
+
+    def insert_VDB_concurrent(self,
+                              colname: str,
+                              document_path: str,
+                              batch_size: int = 64,
+                              io_workers: int = 4,
+                              split_workers: int = None,
+                              max_inflight: int = None,
+                              limit: int = None):
+        """
+        Insert documents from a specified directory into the vector database, processing many
+        documents at once. Documents that fail are logged and reported instead of aborting the run.
+
+        Args:
+            colname (str): The name of the collection in the vector database.
+            document_path (str): The path to the directory containing PDF documents.
+            batch_size (int): The number of chunks embedded and inserted per request.
+            io_workers (int): The number of documents embedded and inserted concurrently.
+            split_workers (int): The number of processes splitting documents, defaults to the CPU count.
+            max_inflight (int): The maximum number of documents held in memory at once.
+            limit (int): The maximum number of PDF files to load, all files if None.
+
+        Returns:
+            dict: The 'inserted', 'skipped' and 'failed' documents, and the number of 'chunks' inserted.
+        """
+        if not self.is_collection_exists(colname):
+            raise CollectionNotFoundError(colname)
+        from scripts.data_processing.ingest import ConcurrentIngestor, prefetch
+
+        parse_failures = {}
+        documents = prefetch(
+            self.iter_directory(
+                document_path,
+                limit=limit,
+                skip=self._existing_file_filter(colname, document_path, limit),
+                on_error=lambda file_name, e: parse_failures.__setitem__(os.path.splitext(file_name)[0], repr(e))
+            )
+        )
+        ingestor = ConcurrentIngestor(
+            embedder=self.embed_model,
+            vdb=self,
+            batch_size=batch_size,
+            io_workers=io_workers,
+            split_workers=split_workers,
+            max_inflight=max_inflight
+        )
+        summary = ingestor.ingest_documents(
+            colname, documents, chunk_tokens=128, overlap_tokens=64, skip_existing=False
+        )
+        summary['failed'].update(parse_failures)
+        for pdf_name in summary['inserted']:
+            self._invalidate_answers(colname, pdf_name)
+        return summary
+
     @staticmethod
     def format_docs(docs):
         """
@@ -79,14 +227,45 @@ class SimpleRAG(
         """
         return "\n\n".join(doc.page_content for doc in docs)
 
-    def query_VDB(self, colname: str, user_query: str, pdf_name: str):
+    def _format_context(self, results) -> str:
+        """
+        Pack the retrieved chunks of a query into its context, warning if nothing was retrieved.
+
+        Args:
+            results (List): The retrieved document objects.
+
+        Returns:
+            str: The context passed to the language model.
+        """
+        if results == []:
+            warnings.warn(
+                self.WarningQueryResult
+            )
+            self.logger.info(f'It does not access information from the vector database; '
+                             f'therefore, the response relies solely on the LLM.')
+        formatted_context = self.query_service.build_context(results)
+        self.logger.info('Relevant chunks have been retrieved')
+        return formatted_context
+
+    def _start_generation(self) -> float:
+        self.logger.info('Generating response from llm...')
+        if self.WarningModel in self.model:
+            warnings.warn(
+                self._warningModelMsg(self.model)
+            )
+        return time.time()
+
+    def query_VDB(self, colname: str, user_query: str, pdf_name: str, k: int = 6):
         """
         Query the vector database with a user query and retrieve relevant information.
+        The vector store and the RAG chain are kept warm by the query service across calls, and
+        answers to repeated questions are served from the answer cache.
 
         Args:
             colname (str): The name of the collection in the vector database.
             user_query (str): The user's query string.
             pdf_name (str): The name of the PDF document to query.
+            k (int): The number of relevant chunks to retrieve.
 
         Returns:
             str: The response generated by the language model based on the retrieved context.
@@ -94,47 +273,176 @@ class SimpleRAG(
         if not self.is_collection_exists(colname):
             raise CollectionNotFoundError(colname)
 
-        milvusWlangchain = MilvusWLangChain(colname=colname, pdf_name=pdf_name)
+        reply, vector, doc_version = self.query_service.lookup(colname, user_query, pdf_name, k=k)
+        if reply is not None:
+            self.logger.info('Response served from the answer cache')
+            return reply
 
         self.logger.info('Retrieving relavant chunks from vector database...')
-        retriever = milvusWlangchain.get_retriever(relavant_chunk_size=6)
-        results = retriever.invoke(
-            user_query
-        )
-        if results == []:
+        results = self.query_service.retrieve(colname, user_query, pdf_name, k=k, vector=vector)
+        formatted_context = self._format_context(results)
+
+        start_time = self._start_generation()
+        reply = self.query_service.generate(formatted_context, user_query)
+        end_time = time.time()
+        seconds = end_time - start_time
+        self.logger.info(f'It takes: {seconds}s to generate response from {self.model}')
+        self.query_service.remember(colname, user_query, pdf_name, reply, vector, k=k, doc_version=doc_version)
+        return reply
+
+    def query_VDB_stream(self, colname: str, user_query: str, pdf_name: str, k: int = 6) -> Iterator[str]:
+        """
+        Query the vector database like `query_VDB`, yielding the response token by token as the language
+        model produces it. The time to the first token is logged along with the total time. A cached
+        answer is yielded at once.
+
+        Args:
+            colname (str): The name of the collection in the vector database.
+            user_query (str): The user's query string.
+            pdf_name (str): The name of the PDF document to query.
+            k (int): The number of relevant chunks to retrieve.
+
+        Yields:
+            str: The tokens of the response.
+        """
+        if not self.is_collection_exists(colname):
+            raise CollectionNotFoundError(colname)
+
+        reply, vector, doc_version = self.query_service.lookup(colname, user_query, pdf_name, k=k)
+        if reply is not None:
+            self.logger.info('Response served from the answer cache')
+            yield reply
+            return
+
+        self.logger.info('Retrieving relavant chunks from vector database...')
+        results = self.query_service.retrieve(colname, user_query, pdf_name, k=k, vector=vector)
+        formatted_context = self._format_context(results)
+
+        start_time = self._start_generation()
+        first_token_seconds = None
+        tokens = []
+        for token in self.query_service.stream(formatted_context, user_query):
+            if first_token_seconds is None:
+                first_token_seconds = time.time() - start_time
+                self.logger.info(f'It takes: {first_token_seconds}s to get the first token from {self.model}')
+            tokens.append(token)
+            yield token
+        seconds = time.time() - start_time
+        self.logger.info(f'It takes: {seconds}s to generate response from {self.model} '
+                         f'(first token after {first_token_seconds}s)')
+        self.query_service.remember(colname, user_query, pdf_name, ''.join(tokens), vector, k=k,
+                                     doc_version=doc_version)
+
+    async def aquery_VDB_stream(self, colname: str, user_query: str, pdf_name: str,
+                                k: int = 6) -> AsyncIterator[str]:
+        """
+        Asynchronous variant of `query_VDB_stream`, retrieving and generating without blocking the event loop.
+
+        Args:
+            colname (str): The name of the collection in the vector database.
+            user_query (str): The user's query string.
+            pdf_name (str): The name of the PDF document to query.
+            k (int): The number of relevant chunks to retrieve.
+
+        Yields:
+            str: The tokens of the response.
+        """
+        if not self.is_collection_exists(colname):
+            raise CollectionNotFoundError(colname)
+
+        reply, vector, doc_version = await self.query_service.alookup(colname, user_query, pdf_name, k=k)
+        if reply is not None:
+            self.logger.info('Response served from the answer cache')
+            yield reply
+            return
+
+        self.logger.info('Retrieving relavant chunks from vector database...')
+        results = await self.query_service.aretrieve(colname, user_query, pdf_name, k=k, vector=vector)
+        formatted_context = self._format_context(results)
+
+        start_time = self._start_generation()
+        first_token_seconds = None
+        tokens = []
+        async for token in self.query_service.astream(formatted_context, user_query):
+            if first_token_seconds is None:
+                first_token_seconds = time.time() - start_time
+                self.logger.info(f'It takes: {first_token_seconds}s to get the first token from {self.model}')
+            tokens.append(token)
+            yield token
+        seconds = time.time() - start_time
+        self.logger.info(f'It takes: {seconds}s to generate response from {self.model} '
+                         f'(first token after {first_token_seconds}s)')
+        self.query_service.remember(colname, user_query, pdf_name, ''.join(tokens), vector, k=k,
+                                     doc_version=doc_version)
+
+    def query_batch(self,
+                    colname: str,
+                    user_queries: List[str],
+                    pdf_names,
+                    k: int = 6,
+                    max_concurrency: int = 4,
+                    return_exceptions: bool = False):
+        """
+        Answer many queries in one pass: the queries are embedded in one batched call, the queries on
+        the same document are searched together, and the answers are generated with a bounded number
+        of concurrent requests to the language model.
+
+        Args:
+            colname (str): The name of the collection in the vector database.
+            user_queries (List[str]): The user queries.
+            pdf_names (str | List[str]): The PDF document searched by each query, or one document for all.
+            k (int): The number of relevant chunks to retrieve per query.
+            max_concurrency (int): The maximum number of concurrent generations.
+            return_exceptions (bool): Return the exception of a failed generation in place of its answer
+                                      instead of raising it.
+
+        Returns:
+            list: The responses in the order of the queries.
+        """
+        if not self.is_collection_exists(colname):
+            raise CollectionNotFoundError(colname)
+        if isinstance(pdf_names, str):
+            pdf_names = [pdf_names] * len(user_queries)
+        if len(pdf_names) != len(user_queries):
+            raise ValueError(f'Got {len(pdf_names)} pdf names for {len(user_queries)} queries')
+        if not user_queries:
+            return []
+
+        start_time = time.time()
+        self.logger.info(f'Retrieving relavant chunks of {len(user_queries)} queries from vector database...')
+        results = self.query_service.retrieve_batch(colname, user_queries, pdf_names, k=k)
+        empty = sum(1 for docs in results if not docs)
+        if empty:
             warnings.warn(
                 self.WarningQueryResult
             )
-            self.logger.info(f'It does not access information from the vector database; '
-                             f'therefore, the response relies solely on the LLM.')
-        formatted_context = self.format_docs(results)
-        self.logger.info('Relevant chunks have been retrieved')
+            self.logger.info(f'{empty} queries do not access information from the vector database; '
+                             f'therefore, their responses rely solely on the LLM.')
+        contexts = [self.query_service.build_context(docs) for docs in results]
+        retrieve_seconds = time.time() - start_time
 
-        start_time = time.time()
-        self.logger.info('Generating response from llm...')
+        self.logger.info('Generating responses from llm...')
         if self.WarningModel in self.model:
             warnings.warn(
                 self._warningModelMsg(self.model)
             )
-
-        rag_chain = (
-                {"context": RunnablePassthrough(), "input": RunnablePassthrough()}
-                | self.QA_CHAIN_PROMPT
-                | self.llm
-                | StrOutputParser()
+        replies = self.query_service.generate_batch(
+            contexts, user_queries, max_concurrency=max_concurrency, return_exceptions=return_exceptions
         )
-        rag_chain_input = {"context": formatted_context, "input": user_query}
-        reply = rag_chain.invoke(rag_chain_input)
-        end_time = time.time()
-        seconds = end_time - start_time
-        self.logger.info(f'It takes: {seconds}s to generate response from {self.model}')
-        return reply
+        seconds = time.time() - start_time
+        self.logger.info(f'Answered {len(user_queries)} queries in {seconds:.2f}s '
+                         f'({retrieve_seconds:.2f}s retrieving, {len(user_queries) / seconds:.1f} queries/s)')
+        return replies
 
     def run(self,
             colname: str,
             document_path: str,
             user_query: str,
-            pdf_name: str):
+            pdf_name: str,
+            index_config: IndexConfig = None,
+            codec: VectorCodec = None,
+            filter_config: FilterConfig = None,
+            stream: bool = False):
         """
         Execute the complete workflow: create collection if needed, insert documents, and process a user query.
 
@@ -143,13 +451,22 @@ class SimpleRAG(
             document_path (str): The path to the directory containing PDF documents.
             user_query (str): The user's query string.
             pdf_name (str): The name of the PDF document to query.
+            index_config (IndexConfig): The vector index of the collection if it has to be created,
+                                        defaults to IVF_FLAT with L2.
+            codec (VectorCodec): The vector type and dimension reduction of the collection if it has to be
+                                 created, defaults to full-precision float32 vectors. A PCA codec must be
+                                 fitted on a sample of embeddings first, see `VectorCodec.fit`.
+            filter_config (FilterConfig): The partition key and scalar index of the document filter if the
+                                          collection has to be created, defaults to an INVERTED index on pdf_name.
+            stream (bool): Print the reply token by token as it is generated.
         """
 
         ############################### -- Create VDB -- ###############################
         self.logger.info("1. Start creating our vector database...")
         if not self.is_collection_exists(colname):
             self.logger.info(f'{colname} is not exist in our database, creating...')
-            self.create_collection(colname)
+            self.create_collection(colname, index_config=index_config, codec=codec, filter_config=filter_config)
+            self._invalidate_answers(colname)
         else:
             self.logger.info(f'{colname} existed in our database, proceed to next operation')
 
@@ -159,11 +476,26 @@ class SimpleRAG(
 
         ############################### -- Search VDB and Reply from LLM -- ###############################
         self.logger.info('3. Start querying our VDB, and getting reply from LLM')
-        reply = self.query_VDB(colname, user_query, pdf_name)
+        if stream:
+            tokens = []
+            for token in self.query_VDB_stream(colname, user_query, pdf_name):
+                print(token, end='', flush=True)
+                tokens.append(token)
+            print()
+            reply = ''.join(tokens)
+        else:
+            reply = self.query_VDB(colname, user_query, pdf_name)
         self.logger.info(
             f'Reply from {self.model} successfully generated: \n'
             f'{reply}'
         )
+        self.report_metrics()
+
+    def report_metrics(self):
+        """
+        Export the stage timings and counters collected so far, to the log and to METRICS_FILE if set.
+        """
+        self.metrics.export()
 
 
 
@@ -0,0 +1,221 @@
+import asyncio
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+import httpx
+from langchain_core.embeddings import Embeddings
+
+from scripts.model.embedModel import NVEmbed
+from scripts.model.embedCache import EmbeddingCache
+from scripts.logger.logger import Log
+from scripts.logger.metrics import Metrics
+
+
+class AsyncNVEmbed(NVEmbed, Embeddings):
+    """
+    Asynchronous NVEmbed client implementing the LangChain Embeddings interface.
+
+    All requests run on a private event loop thread through a pooled `httpx.AsyncClient`, with
+    timeouts, retry with exponential backoff and a cap on concurrent requests. `embed_query` calls
+    arriving within `batch_window` seconds of each other, from any thread or event loop, are
+    coalesced into a micro-batch: repeated queries are embedded once, and the batch is sent as a
+    single request if the server accepts lists of queries (QUERY_BATCH), else as concurrent
+    single-query requests.
+    """
+
+    _shared: Optional['AsyncNVEmbed'] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self,
+                 cache: Optional[EmbeddingCache] = None,
+                 host: Optional[str] = None,
+                 timeout: float = float(os.getenv('EMBEDDING_TIMEOUT', '60')),
+                 max_retries: int = 3,
+                 backoff: float = 0.5,
+                 max_concurrency: int = 8,
+                 max_connections: int = 16,
+                 batch_window: float = 0.005,
+                 max_batch_size: int = 64) -> None:
+        """
+        Args:
+            cache (Optional[EmbeddingCache]): Cache consulted before calling the server.
+            host (Optional[str]): Base URL of the embedding server, defaults to EMBEDDING_HOST:EMBEDDING_PORT.
+            timeout (float): Seconds to wait for the server before giving up on a request.
+            max_retries (int): Retries on connection errors and retryable status codes.
+            backoff (float): Base delay of the exponential backoff between retries, in seconds.
+            max_concurrency (int): The maximum number of requests in flight to the server.
+            max_connections (int): The size of the HTTP connection pool.
+            batch_window (float): Seconds to wait for more queries before sending a micro-batch.
+            max_batch_size (int): The maximum number of queries in a micro-batch.
+        """
+        super().__init__(cache=cache, host=host, timeout=timeout, max_retries=max_retries, backoff=backoff)
+        self.logger = Log(f'{os.path.basename(__file__)}').getlog()
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.retries = 0
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='AsyncNVEmbed', daemon=True)
+        self._thread.start()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._pending: List[tuple] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    @classmethod
+    def shared(cls) -> 'AsyncNVEmbed':
+        """
+        Returns the process-wide client, created on first use so importing does not start its event loop.
+
+        Returns:
+            AsyncNVEmbed: The shared client instance.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def _submit(self, coro):
+        """
+        Schedules a coroutine on the client's event loop.
+
+        Returns:
+            concurrent.futures.Future: The future of the coroutine's result.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def _run(self, coro) -> Any:
+        return self._submit(coro).result()
+
+    async def _arun(self, coro) -> Any:
+        return await asyncio.wrap_future(self._submit(coro))
+
+    def _ensure_client(self) -> httpx.AsyncClient:
+        # Created lazily on the loop thread, which owns the connection pool
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                ),
+                verify=False
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def _apost(self, data: Dict[str, Any]) -> Any:
+        """
+        Posts to the embedding server, retrying with exponential backoff.
+        """
+        client = self._ensure_client()
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = await client.post(self.EMBEDDING_API, json=data)
+                except httpx.TransportError as e:
+                    if attempt == self.max_retries:
+                        raise
+                    error = repr(e)
+                else:
+                    if response.status_code not in self.RETRY_STATUSES or attempt == self.max_retries:
+                        response.raise_for_status()
+                        return response.json()
+                    error = f'status code {response.status_code}'
+                self.retries += 1
+                Metrics.shared().inc('rag_http_retries_total', service='embedding')
+                delay = self.backoff * 2 ** attempt
+                self.logger.warning(f'Embedding request failed ({error}), retrying in {delay:.2f}s')
+                await asyncio.sleep(delay)
+
+    async def _aembed_query_coalesced(self, text: str) -> List[float]:
+        """
+        Queues a query for the next micro-batch and waits for its vector.
+        """
+        future = self._loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(self.batch_window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            self._loop.create_task(self._send_query_batch(batch))
+
+    async def _send_query_batch(self, batch: List[tuple]):
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        if NVEmbed.QUERY_BATCH:
+            try:
+                vectors = await self._apost({'input': texts, 'type': 'query'})
+                if len(vectors) != len(texts):
+                    raise ValueError(f'Embedding server returned {len(vectors)} vectors for {len(texts)} queries')
+            except Exception as e:
+                vectors = [e] * len(texts)
+        else:
+            vectors = await asyncio.gather(
+                *(self._apost({'input': text, 'type': 'query'}) for text in texts), return_exceptions=True
+            )
+        results = dict(zip(texts, vectors))
+        for text, future in batch:
+            if future.done():
+                continue
+            if isinstance(results[text], BaseException):
+                future.set_exception(results[text])
+            else:
+                future.set_result(results[text])
+
+    async def _aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        return list(await asyncio.gather(*(self._aembed_query_coalesced(text) for text in texts)))
+
+    async def _aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self._apost({'input': texts, 'type': 'documents'})
+
+    async def _aembed_cached(self, texts: List[str], embed_type: str, afetch) -> List[List[float]]:
+        if self.cache is None:
+            return await self._afetch(afetch, texts, embed_type)
+        keys, found, missing = self._cache_lookup(texts, embed_type)
+        vectors = await self._afetch(afetch, list(missing.values()), embed_type) if missing else []
+        return self._cache_fill(keys, found, missing, vectors)
+
+    async def _afetch(self, afetch, texts: List[str], embed_type: str) -> List[List[float]]:
+        """
+        Asynchronous variant of `_fetch`.
+        """
+        metrics = Metrics.shared()
+        metrics.inc('rag_embedded_texts_total', len(texts), type=embed_type)
+        with metrics.span('embed'):
+            return await self._arun(afetch(texts))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_cached(texts, 'documents', lambda missing: self._run(self._aembed_documents(missing)))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_cached([text], 'query', lambda missing: self._run(self._aembed_queries(missing)))[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_cached(texts, 'query', lambda missing: self._run(self._aembed_queries(missing)))
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self._aembed_cached(texts, 'documents', self._aembed_documents)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self._aembed_cached([text], 'query', self._aembed_queries))[0]
+
+    def close(self):
+        """
+        Closes the connection pool and stops the event loop thread.
+        """
+        if self._client is not None:
+            self._run(self._client.aclose())
+            self._client = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
@@ -0,0 +1,272 @@
+import os
+import time
+import atexit
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+from dotenv import load_dotenv, find_dotenv
+load_dotenv(find_dotenv())
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed cache of embedding vectors.
+
+    Vectors are keyed by a hash of the text, the embedding type and the model, stored as float32
+    blobs in a local SQLite database and fronted by an in-memory LRU of float32 arrays. When the
+    database grows past `max_bytes`, the least recently used vectors are evicted. Lookups, from memory
+    or from the database, only record their access time in memory; the times are written by `flush`
+    at most every FLUSH_INTERVAL seconds, before an eviction and at exit.
+    """
+
+    # Default location of the database, next to the log directory
+    DEFAULT_PATH: str = os.getenv(
+        'EMBEDDING_CACHE_PATH',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../cache/embeddings.sqlite")
+    )
+    DEFAULT_MAX_BYTES: int = int(os.getenv('EMBEDDING_CACHE_MAX_MB', '2048')) * 1024 * 1024
+    # Vectors kept in memory, 16KB each for 4096 dimensions
+    DEFAULT_MEMORY_ITEMS: int = int(os.getenv('EMBEDDING_CACHE_MEMORY_ITEMS', '4096'))
+    # Seconds between two writes of the access times while vectors are looked up
+    FLUSH_INTERVAL: float = float(os.getenv('EMBEDDING_CACHE_FLUSH_INTERVAL', '30'))
+
+    _shared: Optional['EmbeddingCache'] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path: str = None, max_bytes: int = None, memory_items: int = None):
+        """
+        Initializes the EmbeddingCache and creates the database if needed.
+
+        Args:
+            path (str): Path of the SQLite database, ':memory:' keeps the cache in memory only.
+            max_bytes (int): The maximum size of the stored vectors before eviction.
+            memory_items (int): The number of vectors kept in the in-memory LRU.
+        """
+        self.path = path or EmbeddingCache.DEFAULT_PATH
+        self.max_bytes = max_bytes or EmbeddingCache.DEFAULT_MAX_BYTES
+        self.memory_items = EmbeddingCache.DEFAULT_MEMORY_ITEMS if memory_items is None else memory_items
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._memory: OrderedDict = OrderedDict()
+        # Access times not yet written to the database, by key
+        self._accessed: Dict[str, float] = {}
+        self._flushed_at = time.monotonic()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings ('
+            'key TEXT PRIMARY KEY, vector BLOB NOT NULL, nbytes INTEGER NOT NULL, accessed REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)')
+        self._conn.commit()
+        self._size = self._conn.execute('SELECT COALESCE(SUM(nbytes), 0) FROM embeddings').fetchone()[0]
+        atexit.register(self.flush)
+
+    @classmethod
+    def shared(cls) -> 'EmbeddingCache':
+        """
+        Returns the process-wide cache stored at the default path.
+
+        Returns:
+            EmbeddingCache: The shared cache instance.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    @staticmethod
+    def make_key(text: str, embed_type: str, model: str) -> str:
+        """
+        Builds the content-addressed key of an embedding.
+
+        Args:
+            text (str): The embedded text.
+            embed_type (str): The embedding type, e.g. 'query' or 'documents'.
+            model (str): The name of the embedding model.
+
+        Returns:
+            str: The hex digest identifying the embedding.
+        """
+        digest = hashlib.sha256()
+        for part in (model, embed_type, text):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _remember(self, key: str, vector: array):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        """
+        Looks up several embeddings at once.
+
+        Args:
+            keys (Sequence[str]): Keys built with `make_key`.
+
+        Returns:
+            Dict[str, List[float]]: The cached vectors, keyed by the keys that were found.
+        """
+        found = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                else:
+                    missing.append(key)
+
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(missing), 500):
+                part = missing[start:start + 500]
+                placeholders = ','.join('?' * len(part))
+                rows = self._conn.execute(
+                    f'SELECT key, vector FROM embeddings WHERE key IN ({placeholders})', part
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array('f', blob)
+                    found[key] = vector
+                    self._remember(key, vector)
+
+            now = time.time()
+            self._accessed.update((key, now) for key in found)
+            if time.monotonic() - self._flushed_at >= EmbeddingCache.FLUSH_INTERVAL:
+                self._flush_locked()
+
+            n_unique = len(set(keys))
+            self.hits += len(found)
+            self.misses += n_unique - len(found)
+        return {key: vector.tolist() for key, vector in found.items()}
+
+    def get(self, key: str) -> Optional[List[float]]:
+        """
+        Looks up a single embedding.
+
+        Args:
+            key (str): A key built with `make_key`.
+
+        Returns:
+            Optional[List[float]]: The cached vector, or None on a miss.
+        """
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items: Dict[str, List[float]]):
+        """
+        Stores several embeddings and evicts the least recently used ones if the cache is full.
+
+        Args:
+            items (Dict[str, List[float]]): Vectors keyed by keys built with `make_key`.
+        """
+        now = time.time()
+        vectors = {key: array('f', vector) for key, vector in items.items()}
+        rows = []
+        for key, vector in vectors.items():
+            blob = vector.tobytes()
+            rows.append((key, blob, len(blob), now))
+        with self._lock:
+            for key, vector in vectors.items():
+                self._remember(key, vector)
+                self._accessed.pop(key, None)
+            existing = 0
+            for start in range(0, len(rows), 500):
+                part = [row[0] for row in rows[start:start + 500]]
+                placeholders = ','.join('?' * len(part))
+                existing += self._conn.execute(
+                    f'SELECT COALESCE(SUM(nbytes), 0) FROM embeddings WHERE key IN ({placeholders})', part
+                ).fetchone()[0]
+            self._conn.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)', rows)
+            self._size += sum(row[2] for row in rows) - existing
+            if self._size > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def put(self, key: str, vector: List[float]):
+        """
+        Stores a single embedding.
+
+        Args:
+            key (str): A key built with `make_key`.
+            vector (List[float]): The embedding vector.
+        """
+        self.put_many({key: vector})
+
+    def flush(self):
+        """
+        Writes the access times recorded since the last flush.
+        """
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._accessed:
+            self._conn.executemany(
+                'UPDATE embeddings SET accessed = ? WHERE key = ?',
+                [(accessed, key) for key, accessed in self._accessed.items()]
+            )
+            self._conn.commit()
+            self._accessed.clear()
+        self._flushed_at = time.monotonic()
+
+    def _evict(self):
+        """
+        Deletes the least recently used vectors until the cache is back to 90% of `max_bytes`.
+        Must be called with the lock held.
+        """
+        # Eviction goes by the latest access times
+        self._flush_locked()
+        target = int(self.max_bytes * 0.9)
+        # The cursor is consumed lazily, so only the evicted prefix of the table is read
+        rows = self._conn.execute('SELECT key, nbytes FROM embeddings ORDER BY accessed')
+        evicted = []
+        for key, nbytes in rows:
+            if self._size <= target:
+                break
+            evicted.append((key,))
+            self._size -= nbytes
+            self._memory.pop(key, None)
+        self._conn.executemany('DELETE FROM embeddings WHERE key = ?', evicted)
+        self.evictions += len(evicted)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the hit/miss counters and the current size of the cache.
+
+        Returns:
+            Dict[str, float]: hits, misses, hit_rate, evictions, bytes and entries.
+        """
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'bytes': self._size,
+                'entries': entries,
+            }
+
+    def clear(self):
+        """
+        Removes every cached embedding and resets the counters.
+        """
+        with self._lock:
+            self._memory.clear()
+            self._accessed.clear()
+            self._conn.execute('DELETE FROM embeddings')
+            self._conn.commit()
+            self._size = 0
+            self.hits = self.misses = self.evictions = 0
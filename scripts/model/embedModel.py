@@ -9,30 +9,185 @@ import os
 from typing import Any, Dict, List, Optional
 import requests
 import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from scripts.model.embedCache import EmbeddingCache
+from scripts.logger.metrics import Metrics
 from dotenv import load_dotenv, find_dotenv
 load_dotenv(find_dotenv())
 
+class CountingRetry(Retry):
+    """
+    urllib3 retry policy counting every retry in the shared metrics.
+    """
+
+    def increment(self, *args, **kwargs):
+        # Raises once the retries are exhausted, so only actual retries are counted
+        retry = super().increment(*args, **kwargs)
+        Metrics.shared().inc('rag_http_retries_total', service='embedding')
+        return retry
+
+
 class NVEmbed:
 
-    host: str = "http://" + os.getenv('EMBEDDING_HOST') + ":" + os.getenv('EMBEDDING_PORT')
+    host: str = "http://" + str(os.getenv('EMBEDDING_HOST')) + ":" + str(os.getenv('EMBEDDING_PORT'))
     sub: str = "/api/NVEmbed"
     DIM = 4096
+    # Name of the served model, part of the embedding cache key
+    MODEL: str = os.getenv('EMBEDDING_MODEL', 'NV-Embed-v2')
+    # Status codes worth retrying: rate limiting and transient server errors
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    # The server embeds one query string per request, as `embed_query` sends it. Set EMBEDDING_QUERY_BATCH=1
+    # for a server also accepting a list of queries and returning one vector per query, as for documents.
+    QUERY_BATCH: bool = os.getenv('EMBEDDING_QUERY_BATCH', '0') == '1'
 
-    def __init__(self) -> None:
+    def __init__(self,
+                 cache: Optional[EmbeddingCache] = None,
+                 host: Optional[str] = None,
+                 timeout: float = float(os.getenv('EMBEDDING_TIMEOUT', '60')),
+                 max_retries: int = 3,
+                 backoff: float = 0.5,
+                 pool_size: int = 10) -> None:
+        """
+        Args:
+            cache (Optional[EmbeddingCache]): Cache consulted before calling the server. Defaults to
+                the shared on-disk cache, set EMBEDDING_CACHE=0 to disable caching.
+            host (Optional[str]): Base URL of the embedding server, defaults to EMBEDDING_HOST:EMBEDDING_PORT.
+            timeout (float): Seconds to wait for the server before giving up on a request.
+            max_retries (int): Retries on connection errors and retryable status codes.
+            backoff (float): Base delay of the exponential backoff between retries, in seconds.
+            pool_size (int): The number of keep-alive connections kept to the server.
+        """
         super().__init__()
-        self.EMBEDDING_API = NVEmbed.host + NVEmbed.sub
+        self.EMBEDDING_API = (host or NVEmbed.host) + NVEmbed.sub
+        if cache is None and os.getenv('EMBEDDING_CACHE', '1') != '0':
+            cache = EmbeddingCache.shared()
+        self.cache = cache
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        # A session keeps connections alive across calls instead of opening one per request
+        self.session = requests.Session()
+        self.session.verify = False
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=CountingRetry(
+                total=max_retries,
+                backoff_factor=backoff,
+                status_forcelist=self.RETRY_STATUSES,
+                allowed_methods=frozenset(['POST'])
+            )
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def check_connection(self) -> None:
+        """
+        Sends a probe query to the embedding server.
+
+        Raises:
+            ConnectionError: If the server does not answer with status 200.
+        """
         data = {'input': 'test', 'type': 'query'}
-        response = requests.post(self.EMBEDDING_API, json=data, verify=False)
+        response = self.session.post(self.EMBEDDING_API, json=data, timeout=self.timeout)
         if response.status_code != 200:
             raise ConnectionError(
                 'Request failed with status code {}. Please contact the server admin.'.format(response.status_code))
 
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        data = {'input': texts, 'type': 'documents'}
-        response = requests.post(self.EMBEDDING_API, json=data, verify=False)
+    def _post(self, data: Dict[str, Any]) -> Any:
+        response = self.session.post(self.EMBEDDING_API, json=data, timeout=self.timeout)
+        response.raise_for_status()
         return response.json()
 
+    def _cache_lookup(self, texts: List[str], embed_type: str):
+        """
+        Splits texts into the ones served by the cache and the ones still to embed.
+
+        Args:
+            texts (List[str]): The texts to embed.
+            embed_type (str): The embedding type, 'query' or 'documents'.
+
+        Returns:
+            tuple: The cache key of each text, the cached vectors by key and the missing texts by key.
+        """
+        keys = [EmbeddingCache.make_key(text, embed_type, self.MODEL) for text in texts]
+        found = self.cache.get_many(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        metrics = Metrics.shared()
+        metrics.inc('rag_cache_hits_total', len(keys) - len(missing), cache='embedding')
+        metrics.inc('rag_cache_misses_total', len(missing), cache='embedding')
+        return keys, found, missing
+
+    def _cache_fill(self, keys: List[str], found: Dict[str, List[float]], missing: Dict[str, str],
+                    vectors: List[List[float]]) -> List[List[float]]:
+        """
+        Stores freshly embedded vectors and assembles the result in input order.
+        """
+        fetched = dict(zip(missing.keys(), vectors))
+        if fetched:
+            self.cache.put_many(fetched)
+        found.update(fetched)
+        return [found[key] for key in keys]
+
+    def _embed_cached(self, texts: List[str], embed_type: str, fetch) -> List[List[float]]:
+        """
+        Serves embeddings from the cache and only sends the missing texts to the server.
+
+        Args:
+            texts (List[str]): The texts to embed.
+            embed_type (str): The embedding type, 'query' or 'documents'.
+            fetch: Callable embedding a list of texts on the server.
+
+        Returns:
+            List[List[float]]: One vector per text, in input order.
+        """
+        if self.cache is None:
+            return self._fetch(fetch, texts, embed_type)
+
+        keys, found, missing = self._cache_lookup(texts, embed_type)
+        vectors = self._fetch(fetch, list(missing.values()), embed_type) if missing else []
+        return self._cache_fill(keys, found, missing, vectors)
+
+    @staticmethod
+    def _fetch(fetch, texts: List[str], embed_type: str) -> List[List[float]]:
+        """
+        Embeds texts on the server, timed as the 'embed' stage.
+        """
+        metrics = Metrics.shared()
+        metrics.inc('rag_embedded_texts_total', len(texts), type=embed_type)
+        with metrics.span('embed'):
+            return fetch(texts)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_cached(
+            texts, 'documents', lambda missing: self._post({'input': missing, 'type': 'documents'})
+        )
+
     def embed_query(self, text: str) -> List[float]:
-        data = {'input': text, 'type': 'query'}
-        response = requests.post(self.EMBEDDING_API, json=data, verify=False)
-        return response.json()
\ No newline at end of file
+        return self._embed_cached(
+            [text], 'query', lambda missing: [self._post({'input': missing[0], 'type': 'query'})]
+        )[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds many queries, with a single request to the server if it accepts lists of queries
+        (QUERY_BATCH), else with one request per query.
+
+        Args:
+            texts (List[str]): The queries to embed.
+
+        Returns:
+            List[List[float]]: One vector per query, in input order.
+        """
+        if NVEmbed.QUERY_BATCH:
+            return self._embed_cached(
+                texts, 'query', lambda missing: self._post({'input': missing, 'type': 'query'})
+            )
+        return self._embed_cached(
+            texts, 'query', lambda missing: [self._post({'input': text, 'type': 'query'}) for text in missing]
+        )
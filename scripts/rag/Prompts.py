@@ -1,4 +1,4 @@
-from langchain.prompts import PromptTemplate
+from langchain_core.prompts import PromptTemplate
 
 
 class FinancialExpertPrompt:
@@ -10,6 +10,9 @@ class FinancialExpertPrompt:
     including handling cases where the knowledge base does not contain relevant information.
     """
 
+    # Bump when the template changes, so cached answers of the previous template are not reused
+    PROMPT_VERSION: str = "1"
+
     def __init__(self):
         """
         Initializes the FinancialExpertPrompt with a predefined template.
@@ -1,58 +1,111 @@
 import os
-from pymilvus import connections, db, CollectionSchema, FieldSchema, DataType, utility, Collection, MilvusClient
-from langchain_core.runnables import ConfigurableField
-from langchain_milvus import Milvus
-from scripts.model.embedModel import NVEmbed
+import json
+import time
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from scripts.model.asyncEmbedModel import AsyncNVEmbed
+from scripts.rag.index_config import IndexConfig
+from scripts.rag.filter_config import FilterConfig
+from scripts.rag.sparse_index import BM25Index
+from scripts.rag.vector_backend import VectorBackend
+from scripts.rag.vector_codec import VectorCodec
 from scripts.logger.logger import Log
-from scripts.logger.exceptions import MissingDBInfoError, CollectionNotFoundError
+from scripts.logger.metrics import Metrics
+from scripts.logger.exceptions import CodecNotFittedError
 
 from dotenv import load_dotenv, find_dotenv
 load_dotenv(find_dotenv())
 
 class MilvusDB:
     # Class-level attributes
-    conn = None
-
-    # Retrieve host and port from environment variables
+    # Storage of the collections, shared by every instance and opened by VDB_BACKEND on first use
+    _backend: Optional[VectorBackend] = None
+    # Names of the collections known to exist
+    _existing_collections: set = set()
+    _metadata_lock = threading.Lock()
+    # Number of names per bulk existence query, keeps the filter expression bounded
+    EXISTENCE_BATCH: int = 500
+    # Number of query vectors per multi-vector search request
+    SEARCH_BATCH: int = 256
+    # BM25 index of each collection, maintained on insert and delete for hybrid retrieval
+    SPARSE_INDEX: bool = os.getenv('SPARSE_INDEX', '1') != '0'
+    _sparse_indexes: dict = {}
+    # Version of each document by (collection, name) when its chunks in the sparse index were last checked
+    _sparse_versions: dict = {}
+    # Vector codec and document filter configuration of each collection, read from its description on first use
+    _codecs: dict = {}
+    _filter_configs: dict = {}
+    # Version of each document by (collection, name), with its expiry time, see `document_version`
+    DOCUMENT_VERSION_TTL: float = float(os.getenv('DOCUMENT_VERSION_TTL', '5'))
+    _document_versions: dict = {}
+
+    # 'milvus' for a Milvus server, or 'embedded' for the in-process store under VDB_PATH
+    backend_name: str = os.getenv('VDB_BACKEND', 'milvus').lower()
+    # Retrieve host and port from environment variables, or a Milvus URI / Milvus Lite file
     host: str = os.getenv('VDB_HOST')
     port: str = os.getenv('VDB_PORT')
-
-    # Initialize the embedding model
-    embed_model: NVEmbed = NVEmbed()
+    uri: str = os.getenv('VDB_URI')
 
     # Define keys for various fields in the collection
     ID_KEY: str = "pdf_id"
     VECTOR: str = "text_embedding"
     TEXT: str = "chunk_text"
 
+    # Fields of a collection, see `VectorBackend`
+    FIELDS: list = [
+        {"name": ID_KEY, "dtype": "INT64", "is_primary": True, "auto_id": True},
+        {"name": "pdf_name", "dtype": "VARCHAR", "max_length": 200},
+        {"name": "chunk_number", "dtype": "INT64"},
+        {"name": TEXT, "dtype": "VARCHAR", "max_length": 65000},
+        # SHA-256 of chunk_text, used to re-embed only changed chunks when a file is revised
+        {"name": "chunk_hash", "dtype": "VARCHAR", "max_length": 64},
+        # SHA-256 of the source file and its revision number when the chunk was written
+        {"name": "doc_hash", "dtype": "VARCHAR", "max_length": 64},
+        {"name": "doc_version", "dtype": "INT64"},
+        {"name": VECTOR, "dtype": "FLOAT_VECTOR", "dim": AsyncNVEmbed.DIM},
+    ]
+
     def __init__(self):
         """
-        Initialize the MilvusDB instance by establishing a connection
-        to the Milvus server and setting up the database.
+        Initialize the MilvusDB instance. The vector store backend and the embedding model are
+        process-wide and only opened on first use, so constructing an instance does no I/O.
         """
         super().__init__()
         self.logger = Log(f'{os.path.basename(__file__)}').getlog()
-        if not MilvusDB.conn:
-            if not self.host or not self.port:
-                raise MissingDBInfoError()
-            else:
-                MilvusDB.conn = connections.connect(host=MilvusDB.host, port=MilvusDB.port)
-                self.logger.info(f"Connected to Vector Database")
-        # existing_db = db.list_database()
-        # if MilvusDB.db_name not in existing_db:
-        #     db.create_database(MilvusDB.db_name)
-        #     self.logger.info(f"Successfully created database: {MilvusDB.db_name}")
-
-        # db.using_database(MilvusDB.db_name)
-        # if not connections.has_connection(self.db_name):
-        #     connections.connect(alias=self.db_name, host=self.host, port=self.port)
-
-    def load_collection(self, colname):
-        Collection(colname).load()
+
+    @property
+    def backend(self) -> VectorBackend:
+        """
+        The vector store backend, opened on first use: a Milvus server, or the embedded store if
+        VDB_BACKEND=embedded. Only the selected backend's client library is imported.
+        """
+        if MilvusDB._backend is None:
+            with MilvusDB._metadata_lock:
+                if MilvusDB._backend is None:
+                    if MilvusDB.backend_name == 'embedded':
+                        from scripts.rag.embedded_backend import EmbeddedBackend
+                        MilvusDB._backend = EmbeddedBackend()
+                        self.logger.info(f"Opened the embedded vector store at {MilvusDB._backend.directory}")
+                    elif MilvusDB.backend_name == 'milvus':
+                        from scripts.rag.milvus_backend import MilvusBackend
+                        MilvusDB._backend = MilvusBackend(host=MilvusDB.host, port=MilvusDB.port, uri=MilvusDB.uri)
+                        self.logger.info(f"Connected to Vector Database")
+                    else:
+                        raise ValueError(f"Unsupported VDB_BACKEND '{MilvusDB.backend_name}', "
+                                         f"choose 'milvus' or 'embedded'")
+        return MilvusDB._backend
+
+    @property
+    def embed_model(self) -> AsyncNVEmbed:
+        """
+        The embedding model, shared by the ingestion and the retrievers so concurrent queries are coalesced.
+        """
+        return AsyncNVEmbed.shared()
 
     def is_collection_exists(self, col_name: str):
         """
         Check if a collection with the given name exists in the database.
+        Collections found once are remembered, so repeated checks do not reach the server.
 
         Args:
             col_name (str): The name of the collection to check.
@@ -60,146 +113,560 @@ class MilvusDB:
         Returns:
             bool: True if the collection exists, False otherwise.
         """
-
-        collections = utility.list_collections()
-        for col in collections:
-            if col == col_name:
-                return True
+        if col_name in MilvusDB._existing_collections:
+            return True
+        if self.backend.has_collection(col_name):
+            with MilvusDB._metadata_lock:
+                MilvusDB._existing_collections.add(col_name)
+            return True
         return False
 
-    def create_collection(self, colname: str):
+    def create_collection(self, colname: str, index_config: Optional[IndexConfig] = None,
+                          codec: Optional[VectorCodec] = None, filter_config: Optional[FilterConfig] = None):
         """
         Create a new collection in the database with the specified schema.
 
         Args:
             colname (str): The name of the collection to create.
+            index_config (Optional[IndexConfig]): The vector index type, build parameters, metric and
+                search parameters. Defaults to IVF_FLAT with nlist=128 and L2.
+            codec (Optional[VectorCodec]): The element type and dimension reduction of the stored vectors.
+                Defaults to full-precision float32 vectors.
+            filter_config (Optional[FilterConfig]): The partition key and scalar index serving the
+                document filter. Defaults to an INVERTED index on pdf_name, without partition key.
         """
         if not self.is_collection_exists(colname):
-
-            pdf_id = FieldSchema(
-                name=MilvusDB.ID_KEY,
-                dtype=DataType.INT64,
-                is_primary=True,
-                auto_id=True
+            index_config = index_config or IndexConfig()
+            codec = codec or VectorCodec()
+            filter_config = filter_config or FilterConfig()
+            fields = filter_config.apply([
+                {**field, "dtype": codec.vector_type, "dim": codec.output_dim(AsyncNVEmbed.DIM)}
+                if field["name"] == MilvusDB.VECTOR else field
+                for field in MilvusDB.FIELDS
+            ], MilvusDB.VECTOR)
+            # The search parameters, the codec and the filter configuration are kept with the collection,
+            # so every retriever uses the same ones
+            self.backend.create_collection(
+                colname,
+                fields,
+                index_config,
+                description=json.dumps({
+                    "description": "Embed pdf file",
+                    "search_params": index_config.search_params,
+                    "codec": codec.to_dict(),
+                    "filter": filter_config.to_dict()
+                }),
+                num_partitions=filter_config.num_partitions if filter_config.partition_key else None
             )
+            if codec.reduction == 'pca' and codec.fitted:
+                self.backend.save_projection(colname, codec.mean, codec.components)
+            with MilvusDB._metadata_lock:
+                MilvusDB._existing_collections.add(colname)
+                MilvusDB._codecs[colname] = codec
+                MilvusDB._filter_configs[colname] = filter_config
+            # A sparse index left over from a collection of the same name is stale
+            self._forget_sparse_versions(colname)
+            sparse_index = self.get_sparse_index(colname)
+            if sparse_index is not None:
+                sparse_index.clear()
+
+    def get_index_config(self, colname: str) -> IndexConfig:
+        """
+        Return the vector index configuration of a collection, including its stored search parameters.
 
-            pdf_name = FieldSchema(
-                name="pdf_name",
-                dtype=DataType.VARCHAR,
-                max_length=200,
-            )
-            chunk_number = FieldSchema(
-                name="chunk_number",
-                dtype=DataType.INT64,
-            )
-            chunk_text = FieldSchema(
-                name=MilvusDB.TEXT,
-                dtype=DataType.VARCHAR,
-                max_length=65000
-            )
-            text_embedding = FieldSchema(
-                name=MilvusDB.VECTOR,
-                dtype=DataType.FLOAT_VECTOR,
-                dim=MilvusDB.embed_model.DIM
-            )
+        Args:
+            colname (str): The name of the collection.
 
-            schema = CollectionSchema(
-                fields=[pdf_id, pdf_name, chunk_number, chunk_text, text_embedding],
-                description="Embed pdf file"
-            )
+        Returns:
+            IndexConfig: The index configuration.
+        """
+        return self.backend.index_config(colname)
+
+    def get_codec(self, colname: str) -> VectorCodec:
+        """
+        Return the vector codec of a collection, with its projection if it is fitted.
+
+        Args:
+            colname (str): The name of the collection.
 
-            collection = Collection(colname, schema)
+        Returns:
+            VectorCodec: The codec, full-precision for collections created without one.
+        """
+        codec = MilvusDB._codecs.get(colname)
+        if codec is None:
+            try:
+                config = json.loads(self.backend.description(colname)).get("codec")
+            except (ValueError, AttributeError):
+                config = None
+            codec = VectorCodec.from_dict(config)
+            if codec.reduction == 'pca':
+                projection = self.backend.load_projection(colname)
+                if projection is not None:
+                    codec.set_projection(*projection)
+            with MilvusDB._metadata_lock:
+                codec = MilvusDB._codecs.setdefault(colname, codec)
+        return codec
+
+    def _fitted_codec(self, colname: str) -> VectorCodec:
+        """
+        Return the vector codec of a collection, reading its projection again if it was not fitted yet,
+        as it may have been fitted by another process since.
+
+        Raises:
+            CodecNotFittedError: The collection is PCA-reduced and its projection is not fitted.
+        """
+        codec = self.get_codec(colname)
+        if not codec.fitted:
+            projection = self.backend.load_projection(colname)
+            if projection is None:
+                raise CodecNotFittedError(colname, codec.dim)
+            with MilvusDB._metadata_lock:
+                codec.set_projection(*projection)
+        return codec
+
+    def get_filter_config(self, colname: str) -> FilterConfig:
+        """
+        Return how a collection serves the document filter.
 
-            # Create an index for the text_embedding field
-            index_params = {
-                "index_type": "IVF_FLAT",
-                "params": {"nlist": 128},
-                "metric_type": "L2"
-            }
-            collection.create_index(field_name="text_embedding", index_params=index_params)
+        Args:
+            colname (str): The name of the collection.
 
-    def insert_collection(self, colname: str, data: list):
+        Returns:
+            FilterConfig: The configuration, without partition key or scalar index for collections
+                          created without one.
+        """
+        filter_config = MilvusDB._filter_configs.get(colname)
+        if filter_config is None:
+            try:
+                config = json.loads(self.backend.description(colname)).get("filter")
+            except (ValueError, AttributeError):
+                config = None
+            with MilvusDB._metadata_lock:
+                filter_config = MilvusDB._filter_configs.setdefault(colname, FilterConfig.from_dict(config))
+        return filter_config
+
+    def document_filter(self, colname: str, pdf_names) -> dict:
+        """
+        Build the filter restricting a query to one document, or to any of many documents. On a
+        collection partitioned by document id, the filter selects the documents' partitions.
+
+        Args:
+            colname (str): The name of the collection.
+            pdf_names (str | List[str]): The name of the PDF document, or a list of names.
+
+        Returns:
+            dict: The filter, see `VectorBackend`.
+        """
+        return self.get_filter_config(colname).document_filter(pdf_names)
+
+    def fit_codec(self, colname: str, vectors: List[List[float]]):
+        """
+        Fit the PCA projection of a collection on a representative sample of embeddings, and store it
+        with the collection. A PCA-reduced collection needs it before anything is inserted, and it is
+        never refitted, as stored vectors would no longer match the queries.
+
+        Args:
+            colname (str): The name of the collection.
+            vectors (List[List[float]]): The sample, at least as many full-dimension embeddings as the
+                                         reduced dimension.
+
+        Raises:
+            ValueError: The projection is already fitted, or the sample is too small.
+        """
+        codec = self.get_codec(colname)
+        if codec.reduction != 'pca':
+            return
+        with MilvusDB._metadata_lock:
+            if not codec.fitted:
+                projection = self.backend.load_projection(colname)
+                if projection is not None:
+                    codec.set_projection(*projection)
+            if codec.fitted:
+                raise ValueError(f"The projection of '{colname}' is already fitted, recreate the collection to refit it")
+            codec.fit(vectors)
+            self.backend.save_projection(colname, codec.mean, codec.components)
+        self.logger.info(f'Fitted the PCA projection of {colname} on {len(vectors)} vectors')
+
+    def supports_incremental(self, colname: str) -> bool:
+        """
+        Check whether a collection stores chunk hashes and document versions. Collections created
+        before these fields were added can only skip or fully insert a file.
+
+        Args:
+            colname (str): The name of the collection.
+
+        Returns:
+            bool: True if the collection supports incremental re-ingestion.
+        """
+        fields = self.backend.field_names(colname)
+        return "chunk_hash" in fields and "doc_hash" in fields
+
+    def insert_collection(self, colname: str, data):
         """
         Insert data into the specified collection.
 
         Args:
             colname (str): The name of the collection to insert data into.
-            data (dict): A dictionary containing the data to insert.
-                         Expected keys: 'text', 'pdf_name', 'chunk_number'
+            data (dict | list): Column lists keyed by field name, or column lists in schema order,
+                                one entry per row. A whole batch is written in a single insert.
+
+        Returns:
+            list: The primary keys of the inserted rows, which are also added to the sparse index.
         """
 
         # self.logger.info(f"{filename} - {chunk} is being inserted to: " + colname)
-        col = Collection(colname)
-        col.load()
-        col.insert(data)
+        filter_config = self.get_filter_config(colname)
+        if not isinstance(data, dict):
+            # The document id is derived from the name, it is not passed by the caller
+            fields = [field for field in self.backend.field_names(colname)
+                      if field != MilvusDB.ID_KEY and not (filter_config.uses_doc_id and field == FilterConfig.DOC_ID)]
+            data = dict(zip(fields, data))
+        if filter_config.uses_doc_id:
+            data = {**data, FilterConfig.DOC_ID: [FilterConfig.document_id(name) for name in data["pdf_name"]]}
+        codec = self._fitted_codec(colname)
+        if not codec.is_identity:
+            data = {**data, MilvusDB.VECTOR: codec.reduce(data[MilvusDB.VECTOR])}
+        metrics = Metrics.shared()
+        with metrics.span('insert'):
+            pks = self.backend.insert(colname, data)
+        for pdf_name in set(data["pdf_name"]):
+            MilvusDB._document_versions.pop((colname, pdf_name), None)
+        metrics.inc('rag_chunks_total', len(pks), op='inserted')
+        sparse_index = self.get_sparse_index(colname)
+        if sparse_index is not None:
+            sparse_index.add(pks, data["pdf_name"], data[MilvusDB.TEXT])
+        return pks
+
+    def check_existing_file(self, colname: str, pdf_name: str, doc_hash: str = None):
+        """
+        Check whether a file is already stored in the collection.
 
-    def check_existing_file(self, colname: str, pdf_name: str):
+        Args:
+            colname (str): The name of the collection.
+            pdf_name (str): The name of the PDF document.
+            doc_hash (str): The SHA-256 of the file. If given and the collection supports incremental
+                            re-ingestion, a file only counts as existing if it was stored from this exact
+                            content, so revised files are re-ingested.
 
-        collection = Collection(colname)
-        self.load_collection(colname)
-        query_expr = f'pdf_name == "{pdf_name}"'
-        search_results = collection.query(expr=query_expr)
+        Returns:
+            bool: True if the file exists.
+        """
+        # The first chunk is written last, so a file only exists once it was fully inserted
+        filters = {**self.document_filter(colname, pdf_name), "chunk_number": 0}
+        if doc_hash is not None and self.supports_incremental(colname):
+            # The first chunk is rewritten on every revision, so it always carries the latest file hash
+            filters["doc_hash"] = doc_hash
+        search_results = self.backend.query(colname, filters, output_fields=["pdf_name"], limit=1)
         if len(search_results) == 0:
             return False
         else:
             self.logger.info(f'{pdf_name} is already exist in our vector database')
             return True
 
-    def drop_collection(self, colname):
+    def existing_files(self, colname: str, pdf_names: Iterable[str],
+                       doc_hashes: Optional[Dict[str, str]] = None) -> Set[str]:
+        """
+        Check which of many files are already stored in the collection, with one bounded query per
+        `EXISTENCE_BATCH` names. Only the first chunk of each file is fetched.
 
-        utility.drop_collection(colname)
-
-class MilvusWLangChain(Milvus):
-
-    """
-    A class that integrates Milvus with Langchain to provide a configurable retriever.
-
-    Attributes:
-        milvus (Milvus): An instance of the Milvus vector store.
-    """
-
-    def __init__(self, colname: str, pdf_name: str, *args, **kwargs):
-        if not colname:
-            raise CollectionNotFoundError(colname)
-        # Initialize the Milvus vector store with Langchain compatibility
-        self.milvus = Milvus(
-            embedding_function=MilvusDB.embed_model,
-            collection_name=colname,
-            connection_args={
-                "host": MilvusDB.host,
-                "port": MilvusDB.port
-            },
-            vector_field=MilvusDB.VECTOR,
-            primary_field=MilvusDB.ID_KEY,
-            text_field="chunk_text",
-            *args,
-            **kwargs
+        Args:
+            colname (str): The name of the collection.
+            pdf_names (Iterable[str]): The names of the PDF documents.
+            doc_hashes (Optional[Dict[str, str]]): The SHA-256 of each file by name. If given and the
+                collection supports incremental re-ingestion, a file only counts as existing if it was
+                stored from this exact content.
+
+        Returns:
+            Set[str]: The names of the files already stored.
+        """
+        match_hash = doc_hashes is not None and self.supports_incremental(colname)
+        output_fields = ["pdf_name", "doc_hash"] if match_hash else ["pdf_name"]
+        pdf_names = list(dict.fromkeys(pdf_names))
+
+        existing = set()
+        for start in range(0, len(pdf_names), MilvusDB.EXISTENCE_BATCH):
+            names = pdf_names[start:start + MilvusDB.EXISTENCE_BATCH]
+            # A file has a single first chunk, written once the rest of the file is stored
+            rows = self.backend.query(
+                colname,
+                {**self.document_filter(colname, names), "chunk_number": 0},
+                output_fields=output_fields,
+                limit=2 * len(names)
+            )
+            for row in rows:
+                if not match_hash or row["doc_hash"] == doc_hashes.get(row["pdf_name"]):
+                    existing.add(row["pdf_name"])
+        return existing
+
+    def document_version(self, colname: str, pdf_name: str) -> str:
+        """
+        Return the version of a stored document, read from its first chunk, which is rewritten on every
+        revision: its file hash and revision number, or its primary key in collections without them.
+        Versions are cached for DOCUMENT_VERSION_TTL seconds, so revisions written by other processes
+        are seen within that delay, and those written by this process at once.
+
+        Args:
+            colname (str): The name of the collection.
+            pdf_name (str): The name of the PDF document.
+
+        Returns:
+            str: The version, '' if the document is not stored.
+        """
+        key = (colname, pdf_name)
+        now = time.time()
+        cached = MilvusDB._document_versions.get(key)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        incremental = self.supports_incremental(colname)
+        rows = self.backend.query(
+            colname,
+            {**self.document_filter(colname, pdf_name), "chunk_number": 0},
+            output_fields=[MilvusDB.ID_KEY, "doc_hash", "doc_version"] if incremental else [MilvusDB.ID_KEY],
+            limit=1
         )
-        self.pdf_name = pdf_name
+        if not rows:
+            version = ''
+        elif incremental:
+            version = f'{rows[0]["doc_hash"]}:{rows[0]["doc_version"]}'
+        else:
+            version = str(rows[0][MilvusDB.ID_KEY])
+        MilvusDB._document_versions[key] = (version, now + MilvusDB.DOCUMENT_VERSION_TTL)
+        return version
 
-    def get_retriever(self, relavant_chunk_size):
+    def get_file_chunks(self, colname: str, pdf_name: str) -> list:
         """
-        Configures and returns a retriever with specified filters.
+        Fetch the primary key, number, hash and version of every stored chunk of a file. Collections
+        without chunk hashes only return the primary key and number.
+
+        Args:
+            colname (str): The name of the collection.
+            pdf_name (str): The name of the PDF document.
 
         Returns:
-            Retriever: A configured retriever instance.
+            list: One dict per chunk.
         """
-        return self.milvus.as_retriever().configurable_fields(
-            search_kwargs=ConfigurableField(
-                id="expr_filter",
-            )
-        ).with_config(
-            configurable={
-                "expr_filter": {
-                    "expr": f"pdf_name == '{self.pdf_name}'",
-                    "k": relavant_chunk_size,
-                }
-            }
+        fields = self.backend.field_names(colname)
+        return self.backend.query(
+            colname,
+            self.document_filter(colname, pdf_name),
+            output_fields=[field for field in (MilvusDB.ID_KEY, "chunk_number", "chunk_hash", "doc_version")
+                           if field in fields]
         )
 
+    def delete_chunks(self, colname: str, pks: list):
+        """
+        Delete chunks by primary key.
+
+        Args:
+            colname (str): The name of the collection.
+            pks (list): The primary keys of the chunks to delete.
+        """
+        self.backend.delete(colname, pks)
+        Metrics.shared().inc('rag_chunks_total', len(pks), op='deleted')
+        sparse_index = self.get_sparse_index(colname)
+        if sparse_index is not None:
+            sparse_index.delete(pks)
+
+    def renumber_chunks(self, colname: str, numbers: Dict[int, int]) -> Dict[int, int]:
+        """
+        Set the chunk number of stored chunks, e.g. of unchanged chunks moved by a revision of their file.
+
+        Args:
+            colname (str): The name of the collection.
+            numbers (Dict[int, int]): The new chunk number of each chunk, by primary key.
+
+        Returns:
+            Dict[int, int]: The primary key of each chunk after the update, by its previous key,
+                            see `VectorBackend.update`.
+        """
+        if not numbers:
+            return {}
+        pks = list(numbers)
+        new_pks = self.backend.update(colname, pks, {"chunk_number": [numbers[pk] for pk in pks]})
+        sparse_index = self.get_sparse_index(colname)
+        if sparse_index is not None:
+            sparse_index.rekey(new_pks)
+        return new_pks
+
+    def get_chunks(self, colname: str, pks: list, output_fields: Optional[List[str]] = None) -> List[dict]:
+        """
+        Fetch chunks by primary key.
+
+        Args:
+            colname (str): The name of the collection.
+            pks (list): The primary keys of the chunks.
+            output_fields (Optional[List[str]]): The fields returned, defaults to the document name,
+                                                 chunk number and text.
+
+        Returns:
+            List[dict]: The chunks found, in the order of `pks`.
+        """
+        if not pks:
+            return []
+        output_fields = output_fields or ["pdf_name", "chunk_number", MilvusDB.TEXT]
+        rows = self.backend.query(colname, {MilvusDB.ID_KEY: list(pks)}, output_fields=output_fields)
+        by_pk = {row[MilvusDB.ID_KEY]: row for row in rows}
+        return [by_pk[pk] for pk in pks if pk in by_pk]
+
+    def get_sparse_index(self, colname: str) -> Optional[BM25Index]:
+        """
+        Return the BM25 index of a collection, opening it on first use.
+
+        Args:
+            colname (str): The name of the collection.
+
+        Returns:
+            Optional[BM25Index]: The index, or None if sparse indexing is disabled (SPARSE_INDEX=0).
+        """
+        if not MilvusDB.SPARSE_INDEX:
+            return None
+        with MilvusDB._metadata_lock:
+            if colname not in MilvusDB._sparse_indexes:
+                MilvusDB._sparse_indexes[colname] = BM25Index.for_collection(colname, self.backend.location)
+            return MilvusDB._sparse_indexes[colname]
+
+    def sparse_search(self, colname: str, query: str, pdf_name: str, k: int = 6) -> List[Tuple[int, float]]:
+        """
+        Search the BM25 index of a collection within one PDF document. The indexed chunks of the document
+        are first checked against the stored ones whenever its version changed, as chunks written by
+        another process or before sparse indexing was enabled are missing from the local index.
+
+        Args:
+            colname (str): The name of the collection.
+            query (str): The query text.
+            pdf_name (str): The name of the PDF document to search.
+            k (int): The number of chunks to return.
+
+        Returns:
+            List[Tuple[int, float]]: The primary key and BM25 score of each chunk, best first, or an
+                                     empty list if sparse indexing is disabled.
+        """
+        sparse_index = self.get_sparse_index(colname)
+        if sparse_index is None:
+            return []
+        key = (colname, pdf_name)
+        version = self.document_version(colname, pdf_name)
+        if MilvusDB._sparse_versions.get(key) != version:
+            self._sync_sparse_document(colname, pdf_name, sparse_index)
+            MilvusDB._sparse_versions[key] = version
+        return sparse_index.search(query, pdf_name, k=k)
+
+    def _sync_sparse_document(self, colname: str, pdf_name: str, sparse_index: BM25Index):
+        """
+        Index the stored chunks of a document missing from the sparse index, and remove those no longer stored.
+        """
+        rows = self.backend.query(colname, self.document_filter(colname, pdf_name), output_fields=[MilvusDB.ID_KEY])
+        stored = {row[MilvusDB.ID_KEY] for row in rows}
+        indexed = sparse_index.pks(pdf_name)
+        if stored == indexed:
+            return
+        missing, stale = stored - indexed, indexed - stored
+        self.logger.warning(f'The sparse index of {colname} lacks {len(missing)} and has {len(stale)} '
+                            f'removed chunks of {pdf_name}, re-indexing them')
+        sparse_index.delete(stale)
+        chunks = self.get_chunks(colname, sorted(missing), output_fields=["pdf_name", MilvusDB.TEXT])
+        sparse_index.add([chunk[MilvusDB.ID_KEY] for chunk in chunks], [chunk["pdf_name"] for chunk in chunks],
+                         [chunk[MilvusDB.TEXT] for chunk in chunks])
+
+    def _forget_sparse_versions(self, colname: str):
+        for key in [key for key in MilvusDB._sparse_versions if key[0] == colname]:
+            MilvusDB._sparse_versions.pop(key, None)
+
+    def rebuild_sparse_index(self, colname: str) -> int:
+        """
+        Rebuild the BM25 index of a collection from its stored chunks, e.g. for a collection
+        populated before sparse indexing was enabled.
+
+        Args:
+            colname (str): The name of the collection.
+
+        Returns:
+            int: The number of chunks indexed.
+        """
+        sparse_index = self.get_sparse_index(colname)
+        if sparse_index is None:
+            return 0
+        sparse_index.clear()
+        self._forget_sparse_versions(colname)
+        total = 0
+        for batch in self.backend.scan(colname, None, output_fields=[MilvusDB.ID_KEY, "pdf_name", MilvusDB.TEXT]):
+            sparse_index.add(
+                [row[MilvusDB.ID_KEY] for row in batch],
+                [row["pdf_name"] for row in batch],
+                [row[MilvusDB.TEXT] for row in batch]
+            )
+            total += len(batch)
+        self.logger.info(f'Rebuilt the sparse index of {colname}: {total} chunks')
+        return total
+
+    def search_batch(self, colname: str, vectors: List[List[float]], pdf_names: List[str], k: int = 6,
+                     output_fields: Optional[List[str]] = None) -> List[list]:
+        """
+        Search many query vectors, each restricted to its own PDF document. Queries on the same
+        document are sent together as one multi-vector search, up to `SEARCH_BATCH` vectors per request.
+
+        Args:
+            colname (str): The name of the collection.
+            vectors (List[List[float]]): The query vectors.
+            pdf_names (List[str]): The document searched by each query.
+            k (int): The number of chunks returned per query.
+            output_fields (Optional[List[str]]): The fields returned with each hit, defaults to the
+                                                 document name, chunk number and text.
+
+        Returns:
+            List[list]: The hits of each query in input order, each hit a dict of its fields
+                        with its primary key under `ID_KEY` and its 'distance'.
+        """
+        param = self.get_index_config(colname).search_param()
+        output_fields = output_fields or ["pdf_name", "chunk_number", MilvusDB.TEXT]
+        filter_config = self.get_filter_config(colname)
+        codec = self._fitted_codec(colname)
+        if not codec.is_identity:
+            vectors = codec.reduce(vectors)
+
+        groups = {}
+        for position, pdf_name in enumerate(pdf_names):
+            groups.setdefault(pdf_name, []).append(position)
+
+        results = [[] for _ in vectors]
+        for pdf_name, positions in groups.items():
+            for start in range(0, len(positions), MilvusDB.SEARCH_BATCH):
+                batch = positions[start:start + MilvusDB.SEARCH_BATCH]
+                hits = self.backend.search(
+                    colname,
+                    [vectors[position] for position in batch],
+                    k,
+                    filters=filter_config.document_filter(pdf_name),
+                    output_fields=output_fields,
+                    param=param
+                )
+                for position, query_hits in zip(batch, hits):
+                    results[position] = query_hits
+        return results
+
+    def drop_collection(self, colname):
+
+        with MilvusDB._metadata_lock:
+            MilvusDB._existing_collections.discard(colname)
+            MilvusDB._codecs.pop(colname, None)
+            MilvusDB._filter_configs.pop(colname, None)
+            for key in [key for key in MilvusDB._document_versions if key[0] == colname]:
+                MilvusDB._document_versions.pop(key, None)
+        self.backend.drop_collection(colname)
+        self._forget_sparse_versions(colname)
+        sparse_index = self.get_sparse_index(colname)
+        if sparse_index is not None:
+            sparse_index.clear()
+
+def __getattr__(name):
+    # The LangChain retriever pulls in langchain_milvus and pymilvus, it is only imported when asked for
+    if name == 'MilvusWLangChain':
+        from scripts.rag.milvus_langchain import MilvusWLangChain
+        return MilvusWLangChain
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == '__main__':
 
     milvusdb = MilvusDB()
     milvusdb.drop_collection('col_test')
-
-
@@ -0,0 +1,202 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+from dotenv import load_dotenv, find_dotenv
+load_dotenv(find_dotenv())
+
+
+class AnswerCache:
+    """
+    In-memory cache of generated answers, in front of the language model.
+
+    An answer is found by an exact match on the normalized query, collection, PDF document, model,
+    prompt version, number of retrieved chunks `k` and document version, so answers built on a previous
+    revision of the document never match, even if it was re-ingested by another process. If
+    `similarity_threshold` is set, a query missing the exact match can also reuse the answer of a
+    previous query in the same scope whose embedding has a cosine similarity of at least the threshold.
+    Entries expire after `ttl` seconds, the least recently used ones are evicted past `max_items`, and
+    the entries of a document are invalidated when it is re-ingested.
+    """
+
+    DEFAULT_MAX_ITEMS: int = int(os.getenv('ANSWER_CACHE_SIZE', '1000'))
+    DEFAULT_TTL: float = float(os.getenv('ANSWER_CACHE_TTL', '86400'))
+    # Unset disables the semantic lookup, e.g. 0.95 to reuse answers of near-identical questions
+    DEFAULT_SIMILARITY: Optional[float] = (
+        float(os.getenv('ANSWER_CACHE_SIMILARITY')) if os.getenv('ANSWER_CACHE_SIMILARITY') else None
+    )
+
+    def __init__(self,
+                 max_items: int = None,
+                 ttl: float = None,
+                 similarity_threshold: Optional[float] = DEFAULT_SIMILARITY):
+        """
+        Initializes the AnswerCache.
+
+        Args:
+            max_items (int): The maximum number of cached answers.
+            ttl (float): Seconds an answer stays valid.
+            similarity_threshold (Optional[float]): The minimum cosine similarity of a semantic match,
+                                                    None disables the semantic lookup.
+        """
+        self.max_items = max_items or AnswerCache.DEFAULT_MAX_ITEMS
+        self.ttl = ttl or AnswerCache.DEFAULT_TTL
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+        # Keys of the entries of each (collection, document, model, prompt version, k, document version),
+        # for semantic lookups
+        self._scopes: dict = {}
+
+    @staticmethod
+    def normalize(user_query: str) -> str:
+        """
+        Normalizes a query so trivially different spellings share an entry: case, surrounding and
+        repeated whitespace and trailing punctuation are ignored.
+        """
+        return re.sub(r'\s+', ' ', user_query).strip().rstrip('?!.').strip().lower()
+
+    @staticmethod
+    def make_key(colname: str, user_query: str, pdf_name: str, model: str, prompt_version: str,
+                 k: int = 6, doc_version: str = '') -> str:
+        """
+        Builds the exact-match key of an answer.
+
+        Returns:
+            str: The hex digest identifying the answer.
+        """
+        payload = '\x1f'.join([colname, AnswerCache.normalize(user_query), pdf_name, model, prompt_version,
+                               str(k), doc_version])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key)
+        scope = self._scopes.get(entry['scope'])
+        if scope is not None:
+            scope.discard(key)
+            if not scope:
+                del self._scopes[entry['scope']]
+
+    def _alive(self, key: str, now: float) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry['expires'] < now:
+            self._drop(key)
+            return None
+        return entry
+
+    def get(self, colname: str, user_query: str, pdf_name: str, model: str, prompt_version: str,
+            k: int = 6, doc_version: str = '') -> Optional[str]:
+        """
+        Returns the answer of the exact same query, or None.
+
+        Args:
+            k (int): The number of chunks the answer is retrieved from.
+            doc_version (str): The version of the document the answer is built on, see `MilvusDB.document_version`.
+        """
+        key = self.make_key(colname, user_query, pdf_name, model, prompt_version, k, doc_version)
+        with self._lock:
+            entry = self._alive(key, time.time())
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry['answer']
+
+    def get_similar(self, colname: str, vector: List[float], pdf_name: str, model: str,
+                    prompt_version: str, k: int = 6, doc_version: str = '') -> Optional[str]:
+        """
+        Returns the answer of the most similar cached query on the same document version, if its cosine
+        similarity reaches the threshold.
+
+        Args:
+            vector (List[float]): The embedding of the query.
+
+        Returns:
+            Optional[str]: The cached answer, or None.
+        """
+        if self.similarity_threshold is None:
+            return None
+        scope = (colname, pdf_name, model, prompt_version, k, doc_version)
+        now = time.time()
+        with self._lock:
+            keys = [key for key in list(self._scopes.get(scope, ())) if self._alive(key, now) is not None]
+            keys = [key for key in keys if self._entries[key]['vector'] is not None]
+            if not keys:
+                return None
+            matrix = np.stack([self._entries[key]['vector'] for key in keys])
+            query = np.asarray(vector, dtype=np.float32)
+            query /= np.linalg.norm(query) or 1.0
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                return None
+            self.semantic_hits += 1
+            self._entries.move_to_end(keys[best])
+            return self._entries[keys[best]]['answer']
+
+    def put(self, colname: str, user_query: str, pdf_name: str, model: str, prompt_version: str,
+            answer: str, vector: Optional[List[float]] = None, k: int = 6, doc_version: str = ''):
+        """
+        Stores the answer of a query.
+
+        Args:
+            answer (str): The generated answer.
+            vector (Optional[List[float]]): The embedding of the query, enables semantic matches.
+            k (int): The number of chunks the answer was retrieved from.
+            doc_version (str): The version of the document the answer was built on.
+        """
+        key = self.make_key(colname, user_query, pdf_name, model, prompt_version, k, doc_version)
+        scope = (colname, pdf_name, model, prompt_version, k, doc_version)
+        if vector is not None:
+            vector = np.asarray(vector, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = {
+                'answer': answer, 'vector': vector, 'scope': scope, 'expires': time.time() + self.ttl
+            }
+            self._scopes.setdefault(scope, set()).add(key)
+            while len(self._entries) > self.max_items:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, colname: Optional[str] = None, pdf_name: Optional[str] = None):
+        """
+        Drops the answers of a document, of a whole collection, or all answers.
+
+        Args:
+            colname (Optional[str]): The name of the collection, all collections if None.
+            pdf_name (Optional[str]): The name of the PDF document, all documents if None.
+        """
+        with self._lock:
+            for scope in list(self._scopes):
+                if (colname is None or scope[0] == colname) and (pdf_name is None or scope[1] == pdf_name):
+                    for key in list(self._scopes[scope]):
+                        self._drop(key)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: Exact hit, exact miss and semantic hit counts, the overall hit rate and the number of entries.
+        """
+        with self._lock:
+            # Semantic lookups only follow exact misses
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'semantic_hits': self.semantic_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.semantic_hits) / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+            }
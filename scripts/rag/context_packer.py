@@ -0,0 +1,203 @@
+import os
+import re
+from typing import List, Optional
+
+from langchain_core.documents import Document
+
+from scripts.data_processing.token_counter import count_tokens
+from scripts.logger.logger import Log
+
+from dotenv import load_dotenv, find_dotenv
+load_dotenv(find_dotenv())
+
+
+class ContextPacker:
+    """
+    Assembles the retrieved chunks of a query into the context passed to the language model.
+
+    Chunks of the same document that are adjacent by `chunk_number` are merged into one passage,
+    with the text they share through the splitter overlap kept once. Passages repeating an already
+    selected one are dropped, and the rest are packed, most relevant first, into a token budget.
+    """
+
+    # Context window of Ollama when the model is run without num_ctx
+    DEFAULT_CONTEXT_WINDOW: int = 2048
+    # Tokens kept free in the context window for the prompt template, the question and the answer
+    RESERVED_TOKENS: int = 768
+    # Smaller budgets for the models whose prefill is the slowest
+    MODEL_BUDGETS: dict = {
+        'llama3.1:70b': 1024,
+        'llama3.1:70b-instruct-q4_0': 1024,
+    }
+    # Word shingles of a passage compared by the near-duplicate check
+    SHINGLE_SIZE: int = 3
+
+    def __init__(self, budget_tokens: int, duplicate_threshold: float = 0.9, separator: str = "\n\n"):
+        """
+        Args:
+            budget_tokens (int): The maximum number of tokens of the packed context.
+            duplicate_threshold (float): The share of a passage's word shingles found in a selected passage
+                                         from which it is considered a near-duplicate.
+            separator (str): Inserted between passages, and between adjacent chunks that do not overlap.
+        """
+        self.logger = Log(f'{os.path.basename(__file__)}').getlog()
+        self.budget_tokens = budget_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.separator = separator
+
+    @classmethod
+    def for_model(cls, model: str, context_window: Optional[int] = None, **kwargs) -> 'ContextPacker':
+        """
+        Builds the packer of a model. The budget is CONTEXT_TOKEN_BUDGET if set, else the budget of the
+        model in `MODEL_BUDGETS`, else what the context window leaves after `RESERVED_TOKENS`.
+
+        Args:
+            model (str): The name of the language model.
+            context_window (Optional[int]): The context window of the model (num_ctx), defaults to
+                                            Ollama's default.
+
+        Returns:
+            ContextPacker: The packer.
+        """
+        budget = (context_window or cls.DEFAULT_CONTEXT_WINDOW) - cls.RESERVED_TOKENS
+        if model in cls.MODEL_BUDGETS:
+            budget = min(cls.MODEL_BUDGETS[model], budget)
+        budget = int(os.getenv('CONTEXT_TOKEN_BUDGET', budget))
+        return cls(budget_tokens=budget, **kwargs)
+
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        """
+        Counts the tokens of a text, see `token_counter.count_tokens`, as the chunker does.
+        """
+        return count_tokens(text)
+
+    @staticmethod
+    def join_overlapping(first: str, second: str, separator: str = "\n\n") -> str:
+        """
+        Joins two consecutive chunks, keeping the text they share once.
+
+        Args:
+            first (str): The earlier chunk.
+            second (str): The next chunk, possibly starting with the end of `first`.
+            separator (str): Inserted between the chunks if they do not overlap.
+
+        Returns:
+            str: The merged text.
+        """
+        probe = second[:32]
+        if probe:
+            # The longest overlap starts at the earliest occurrence of the probe in the tail of first
+            position = first.find(probe, max(0, len(first) - len(second)))
+            while position != -1:
+                if second.startswith(first[position:]):
+                    return first + second[len(first) - position:]
+                position = first.find(probe, position + 1)
+        return first + separator + second
+
+    def merge_adjacent(self, docs: List[Document]) -> List[Document]:
+        """
+        Merges the chunks of a document that follow each other by chunk number into one passage.
+        Passages keep the rank of their most relevant chunk.
+
+        Args:
+            docs (List[Document]): The retrieved chunks, most relevant first.
+
+        Returns:
+            List[Document]: The passages, most relevant first.
+        """
+        ranked = [(rank, doc) for rank, doc in enumerate(docs) if doc.metadata.get('chunk_number') is not None]
+        unnumbered = [(rank, doc) for rank, doc in enumerate(docs) if doc.metadata.get('chunk_number') is None]
+        ranked.sort(key=lambda item: (str(item[1].metadata.get('pdf_name')), item[1].metadata['chunk_number']))
+
+        passages = []
+        for rank, doc in ranked:
+            if passages:
+                best, last = passages[-1]
+                same_file = last.metadata.get('pdf_name') == doc.metadata.get('pdf_name')
+                number, last_number = doc.metadata['chunk_number'], last.metadata['last_chunk_number']
+                if same_file and number == last_number:
+                    # The same chunk retrieved twice, e.g. from two revisions
+                    passages[-1] = (min(best, rank), last)
+                    continue
+                if same_file and number == last_number + 1:
+                    last.page_content = self.join_overlapping(last.page_content, doc.page_content, self.separator)
+                    last.metadata['last_chunk_number'] = number
+                    passages[-1] = (min(best, rank), last)
+                    continue
+            passage = Document(
+                page_content=doc.page_content,
+                metadata={**doc.metadata, 'last_chunk_number': doc.metadata['chunk_number']}
+            )
+            passages.append((rank, passage))
+        passages.extend(unnumbered)
+        passages.sort(key=lambda item: item[0])
+        return [doc for _, doc in passages]
+
+    def _shingles(self, text: str) -> set:
+        words = re.findall(r'\w+', text.lower())
+        size = self.SHINGLE_SIZE
+        if len(words) < size:
+            return {tuple(words)}
+        return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+    def drop_duplicates(self, docs: List[Document]) -> List[Document]:
+        """
+        Drops passages whose text is a near-duplicate of a more relevant one.
+
+        Args:
+            docs (List[Document]): The passages, most relevant first.
+
+        Returns:
+            List[Document]: The remaining passages, most relevant first.
+        """
+        kept, kept_shingles = [], []
+        for doc in docs:
+            shingles = self._shingles(doc.page_content)
+            duplicate = False
+            for other in kept_shingles:
+                # Mostly contained in a selected passage
+                if len(shingles & other) / len(shingles) >= self.duplicate_threshold:
+                    duplicate = True
+                    break
+            if not duplicate:
+                kept.append(doc)
+                kept_shingles.append(shingles)
+        return kept
+
+    def truncate(self, text: str, budget_tokens: int) -> str:
+        """
+        Cuts a text to a token budget, at a sentence boundary if there is one.
+        """
+        # Start from the character estimate and shrink until the text fits
+        cut = text[:budget_tokens * 4]
+        while cut and self.count_tokens(cut) > budget_tokens:
+            cut = cut[:int(len(cut) * 0.9)]
+        boundary = max(cut.rfind('. '), cut.rfind('\n'))
+        return cut[:boundary + 1] if boundary > len(cut) // 2 else cut
+
+    def pack(self, docs: List[Document]) -> str:
+        """
+        Merges, deduplicates and packs retrieved chunks into the context of a query.
+
+        Args:
+            docs (List[Document]): The retrieved chunks, most relevant first.
+
+        Returns:
+            str: The context, at most `budget_tokens` long.
+        """
+        passages = self.drop_duplicates(self.merge_adjacent(docs))
+        separator_tokens = self.count_tokens(self.separator)
+        selected, used = [], 0
+        for doc in passages:
+            tokens = self.count_tokens(doc.page_content) + (separator_tokens if selected else 0)
+            if used + tokens <= self.budget_tokens:
+                selected.append(doc.page_content)
+                used += tokens
+            elif not selected:
+                # The most relevant passage alone exceeds the budget
+                selected.append(self.truncate(doc.page_content, self.budget_tokens))
+                used = self.budget_tokens
+        context = self.separator.join(selected)
+        self.logger.info(f'Packed {len(docs)} chunks into {len(selected)} passages ({used} tokens)')
+        return context
@@ -0,0 +1,475 @@
+import os
+import json
+import shutil
+import sqlite3
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from scripts.rag.index_config import IndexConfig
+from scripts.rag.vector_backend import VectorBackend
+from scripts.rag.vector_codec import to_bfloat16, from_bfloat16
+from scripts.logger.logger import Log
+
+from dotenv import load_dotenv, find_dotenv
+load_dotenv(find_dotenv())
+
+
+class EmbeddedCollection:
+    """
+    One collection of the EmbeddedBackend, stored in its own directory:
+
+    - meta.json: the field specs, index configuration, row count and next primary key
+    - vectors.f32, .f16 or .bf16: the vectors, one row per inserted entity, memory-mapped
+    - norms.f32 and alive.u8: the squared norm of each vector and whether its row is not deleted
+    - rows.sqlite: the scalar fields of each row, keyed by row number
+    - ivf_centroids.npy and ivf_lists.i32: the IVF index, once trained
+    - projection.npz: the PCA projection of a reduced collection, once fitted
+    """
+
+    # Rows added to the memory-mapped files at once when they are full
+    GROWTH: int = 1024
+    # Storage dtype and file of each vector type, bfloat16 is kept as its uint16 bit pattern
+    STORAGE: dict = {
+        'FLOAT_VECTOR': (np.float32, 'vectors.f32'),
+        'FLOAT16_VECTOR': (np.float16, 'vectors.f16'),
+        'BFLOAT16_VECTOR': (np.uint16, 'vectors.bf16'),
+    }
+    # Rows decoded and multiplied at once by the exact search
+    SEARCH_BLOCK: int = 65536
+
+    def __init__(self, directory: str, meta: dict):
+        self.logger = Log(f'{os.path.basename(__file__)}').getlog()
+        self.directory = directory
+        self.meta = meta
+        self.lock = threading.RLock()
+        vector = next(field for field in meta['fields'] if field['dtype'] in VectorBackend.VECTOR_TYPES)
+        self.vector_field = vector['name']
+        self.vector_type = vector['dtype']
+        self.dim = vector['dim']
+        self.dtype, self.vector_file = EmbeddedCollection.STORAGE[self.vector_type]
+        self.primary_field = next(field['name'] for field in meta['fields'] if field.get('is_primary'))
+        self.scalar_fields = [field['name'] for field in meta['fields'] if field['name'] != self.vector_field]
+        self.index_config = IndexConfig(**meta['index'])
+
+        self.conn = sqlite3.connect(os.path.join(directory, 'rows.sqlite'), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        columns = ', '.join(
+            f'"{field["name"]}" {"INTEGER" if field["dtype"] == "INT64" else "TEXT"}'
+            for field in meta['fields'] if field['name'] != self.vector_field
+        )
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS rows (row INTEGER PRIMARY KEY, {columns})')
+        self.conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS rows_pk ON rows ("{self.primary_field}")')
+        for field in meta.get('indexed_fields', []):
+            self.conn.execute(f'CREATE INDEX IF NOT EXISTS "rows_{field}" ON rows ("{field}")')
+        self.conn.commit()
+        self._map()
+        self.centroids = None
+        self.lists = None
+        if os.path.exists(self._path('ivf_centroids.npy')):
+            self.centroids = np.load(self._path('ivf_centroids.npy'))
+            self.lists = np.memmap(self._path('ivf_lists.i32'), dtype=np.int32, mode='r+')
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _map(self):
+        """
+        Memory-maps the vector, norm and alive files at their current capacity.
+        """
+        capacity = self.meta['capacity']
+        self.vectors = np.memmap(self._path(self.vector_file), dtype=self.dtype, mode='r+', shape=(capacity, self.dim))
+        self.norms = np.memmap(self._path('norms.f32'), dtype=np.float32, mode='r+', shape=(capacity,))
+        self.alive = np.memmap(self._path('alive.u8'), dtype=np.uint8, mode='r+', shape=(capacity,))
+
+    def _grow(self, rows: int):
+        """
+        Extends the memory-mapped files to hold at least `rows` rows.
+        """
+        capacity = self.meta['capacity']
+        if rows <= capacity:
+            return
+        capacity = max(rows, capacity * 2)
+        for name, itemsize in ((self.vector_file, np.dtype(self.dtype).itemsize * self.dim),
+                               ('norms.f32', 4), ('alive.u8', 1)):
+            with open(self._path(name), 'r+b') as f:
+                f.truncate(capacity * itemsize)
+        if self.lists is not None:
+            with open(self._path('ivf_lists.i32'), 'r+b') as f:
+                f.truncate(capacity * 4)
+            self.lists = np.memmap(self._path('ivf_lists.i32'), dtype=np.int32, mode='r+')
+        self.meta['capacity'] = capacity
+        self._map()
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Converts float32 vectors to the storage dtype.
+        """
+        if self.vector_type == 'BFLOAT16_VECTOR':
+            return to_bfloat16(vectors)
+        return vectors.astype(self.dtype)
+
+    def decode(self, stored: np.ndarray) -> np.ndarray:
+        """
+        Converts stored vectors back to float32.
+        """
+        if self.vector_type == 'BFLOAT16_VECTOR':
+            return from_bfloat16(stored)
+        return np.asarray(stored, dtype=np.float32)
+
+    def save_meta(self):
+        tmp_path = self._path(f'meta.json.{os.getpid()}.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self._path('meta.json'))
+
+    def filter_sql(self, filters: Optional[dict]) -> tuple:
+        """
+        Builds the WHERE clause and parameters of a filter.
+        """
+        if not filters:
+            return '', []
+        conditions, params = [], []
+        for field, value in filters.items():
+            if field not in self.scalar_fields:
+                raise ValueError(f"Unknown field '{field}'")
+            if isinstance(value, (list, tuple, set)):
+                value = list(value)
+                conditions.append(f'"{field}" IN ({",".join("?" * len(value))})' if value else '0')
+                params.extend(value)
+            else:
+                conditions.append(f'"{field}" = ?')
+                params.append(value)
+        return ' WHERE ' + ' AND '.join(conditions), params
+
+    def train_ivf(self, sample_size: int = 256, iterations: int = 10, seed: int = 0):
+        """
+        Trains the IVF centroids with k-means on a sample of the vectors and assigns every row to a list.
+        """
+        rows = np.flatnonzero(self.alive[:self.meta['rows']])
+        nlist = min(int(self.index_config.build_params.get('nlist', 128)), len(rows))
+        if nlist == 0:
+            return
+        rng = np.random.default_rng(seed)
+        sample = self.decode(self.vectors[np.sort(rng.choice(rows, min(len(rows), sample_size * nlist), replace=False))])
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = self._nearest_centroid(sample, centroids)
+            for cluster in range(nlist):
+                members = sample[assignment == cluster]
+                if len(members):
+                    centroids[cluster] = members.mean(axis=0)
+        self.centroids = centroids
+        np.save(self._path('ivf_centroids.npy'), centroids)
+        with open(self._path('ivf_lists.i32'), 'wb') as f:
+            f.truncate(self.meta['capacity'] * 4)
+        self.lists = np.memmap(self._path('ivf_lists.i32'), dtype=np.int32, mode='r+')
+        for start in range(0, self.meta['rows'], 65536):
+            stop = min(start + 65536, self.meta['rows'])
+            self.lists[start:stop] = self._nearest_centroid(self.decode(self.vectors[start:stop]), centroids)
+        self.lists.flush()
+        self.meta['ivf_trained_rows'] = int(len(rows))
+        self.save_meta()
+        self.logger.info(f'Trained an IVF index with {nlist} lists on {len(sample)} vectors')
+
+    @staticmethod
+    def _nearest_centroid(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        distances = (centroids * centroids).sum(axis=1)[None, :] - 2 * vectors @ centroids.T
+        return np.argmin(distances, axis=1).astype(np.int32)
+
+
+class EmbeddedBackend(VectorBackend):
+    """
+    In-process VectorBackend for local runs and tests, needing no server.
+
+    Vectors are kept in NumPy memory-mapped float32 matrices and scalar fields in SQLite, one
+    directory per collection. Searches are exact and vectorized with matrix multiplication over the
+    rows matching the filter, which makes this backend a reference for recall measurements. For IVF
+    index types, an IVF index is trained on disk once the collection is large enough, and unfiltered
+    searches only scan the `nprobe` closest lists. Other index types are searched exactly.
+    """
+
+    # Default location of the collections
+    DEFAULT_DIR: str = os.getenv(
+        'VDB_PATH',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../cache/vdb")
+    )
+    # Scalar fields indexed in SQLite, used by the document filters
+    INDEXED_FIELDS: tuple = ('pdf_name',)
+    # Rows per IVF list from which an IVF index is trained
+    IVF_MIN_ROWS_PER_LIST: int = 39
+
+    def __init__(self, directory: str = None):
+        """
+        Args:
+            directory (str): The directory holding the collections.
+        """
+        self.directory = directory or EmbeddedBackend.DEFAULT_DIR
+        os.makedirs(self.directory, exist_ok=True)
+        self._collections: dict = {}
+        self._lock = threading.Lock()
+
+    @property
+    def location(self) -> str:
+        return os.path.abspath(self.directory)
+
+    def _collection_dir(self, colname: str) -> str:
+        return os.path.join(self.directory, colname)
+
+    def _open(self, colname: str) -> EmbeddedCollection:
+        with self._lock:
+            if colname not in self._collections:
+                try:
+                    with open(os.path.join(self._collection_dir(colname), 'meta.json'), encoding='utf-8') as f:
+                        meta = json.load(f)
+                except FileNotFoundError:
+                    raise ValueError(f"Collection '{colname}' does not exist")
+                self._collections[colname] = EmbeddedCollection(self._collection_dir(colname), meta)
+            return self._collections[colname]
+
+    def has_collection(self, colname: str) -> bool:
+        return os.path.exists(os.path.join(self._collection_dir(colname), 'meta.json'))
+
+    def create_collection(self, colname: str, fields: List[dict], index_config: IndexConfig, description: str = "",
+                          num_partitions: Optional[int] = None):
+        directory = self._collection_dir(colname)
+        os.makedirs(directory, exist_ok=True)
+        # A projection left over from a collection of the same name is stale
+        if os.path.exists(os.path.join(directory, 'projection.npz')):
+            os.remove(os.path.join(directory, 'projection.npz'))
+        vector = next(field for field in fields if field['dtype'] in VectorBackend.VECTOR_TYPES)
+        dtype, vector_file = EmbeddedCollection.STORAGE[vector['dtype']]
+        # Files are created sparse, at the initial capacity
+        for name, itemsize in ((vector_file, np.dtype(dtype).itemsize * vector['dim']),
+                               ('norms.f32', 4), ('alive.u8', 1)):
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.truncate(EmbeddedCollection.GROWTH * itemsize)
+        meta = {
+            'fields': fields,
+            'index': {
+                'index_type': index_config.index_type,
+                'metric_type': index_config.metric_type,
+                'build_params': index_config.build_params,
+                'search_params': index_config.search_params,
+            },
+            'description': description,
+            # Partition keys and fields with a scalar index are indexed in SQLite
+            'indexed_fields': [field['name'] for field in fields
+                               if field['name'] in EmbeddedBackend.INDEXED_FIELDS
+                               or field.get('index') or field.get('is_partition_key')],
+            'rows': 0,
+            'capacity': EmbeddedCollection.GROWTH,
+            'next_pk': 1,
+        }
+        collection = EmbeddedCollection(directory, meta)
+        collection.save_meta()
+        with self._lock:
+            self._collections[colname] = collection
+
+    def drop_collection(self, colname: str):
+        with self._lock:
+            collection = self._collections.pop(colname, None)
+        if collection is not None:
+            collection.conn.close()
+        shutil.rmtree(self._collection_dir(colname), ignore_errors=True)
+
+    def save_projection(self, colname: str, mean: np.ndarray, components: np.ndarray):
+        self._open(colname)
+        path = os.path.join(self._collection_dir(colname), 'projection.npz')
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, mean=mean, components=components)
+        os.replace(tmp_path, path)
+
+    def load_projection(self, colname: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        path = os.path.join(self._collection_dir(colname), 'projection.npz')
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as projection:
+            return projection['mean'], projection['components']
+
+    def field_names(self, colname: str) -> List[str]:
+        return [field['name'] for field in self._open(colname).meta['fields']]
+
+    def description(self, colname: str) -> str:
+        return self._open(colname).meta['description']
+
+    def index_config(self, colname: str) -> IndexConfig:
+        return self._open(colname).index_config
+
+    def insert(self, colname: str, columns: Dict[str, list]) -> list:
+        collection = self._open(colname)
+        vectors = np.asarray(columns[collection.vector_field], dtype=np.float32).reshape(-1, collection.dim)
+        count = len(vectors)
+        with collection.lock:
+            first_row, first_pk = collection.meta['rows'], collection.meta['next_pk']
+            rows = list(range(first_row, first_row + count))
+            pks = list(range(first_pk, first_pk + count))
+            collection._grow(first_row + count)
+            stored = collection.encode(vectors)
+            collection.vectors[first_row:first_row + count] = stored
+            # Norms and IVF lists are those of the vectors as stored
+            vectors = collection.decode(stored)
+            collection.norms[first_row:first_row + count] = (vectors * vectors).sum(axis=1)
+            collection.alive[first_row:first_row + count] = 1
+            if collection.lists is not None:
+                collection.lists[first_row:first_row + count] = collection._nearest_centroid(
+                    vectors, collection.centroids
+                )
+
+            fields = [field for field in collection.scalar_fields if field != collection.primary_field]
+            values = [columns[field] for field in fields]
+            names = ', '.join(f'"{field}"' for field in ['row', collection.primary_field, *fields])
+            collection.conn.executemany(
+                f'INSERT INTO rows ({names}) VALUES ({",".join("?" * (len(fields) + 2))})',
+                [(row, pk, *[column[i] for column in values]) for i, (row, pk) in enumerate(zip(rows, pks))]
+            )
+            collection.conn.commit()
+            for array in (collection.vectors, collection.norms, collection.alive):
+                array.flush()
+            collection.meta['rows'] = first_row + count
+            collection.meta['next_pk'] = first_pk + count
+            collection.save_meta()
+        return pks
+
+    def update(self, colname: str, pks: list, columns: Dict[str, list]) -> dict:
+        collection = self._open(colname)
+        fields = list(columns)
+        assignments = ', '.join(f'"{field}" = ?' for field in fields)
+        with collection.lock:
+            collection.conn.executemany(
+                f'UPDATE rows SET {assignments} WHERE "{collection.primary_field}" = ?',
+                [(*[columns[field][i] for field in fields], int(pk)) for i, pk in enumerate(pks)]
+            )
+            collection.conn.commit()
+        return {pk: pk for pk in pks}
+
+    def delete(self, colname: str, pks: list):
+        collection = self._open(colname)
+        with collection.lock:
+            for start in range(0, len(pks), 1000):
+                batch = [int(pk) for pk in pks[start:start + 1000]]
+                marks = ','.join('?' * len(batch))
+                rows = [row for row, in collection.conn.execute(
+                    f'SELECT row FROM rows WHERE "{collection.primary_field}" IN ({marks})', batch
+                )]
+                collection.alive[rows] = 0
+                collection.conn.execute(f'DELETE FROM rows WHERE "{collection.primary_field}" IN ({marks})', batch)
+            collection.conn.commit()
+            collection.alive.flush()
+
+    def scan(self, colname: str, filters: Optional[dict], output_fields: List[str],
+             batch_size: int = 1000) -> Iterator[List[dict]]:
+        collection = self._open(colname)
+        fields = list(dict.fromkeys([collection.primary_field, *output_fields]))
+        where, params = collection.filter_sql(filters)
+        with collection.lock:
+            rows = collection.conn.execute(
+                f'SELECT {", ".join(f"{chr(34)}{field}{chr(34)}" for field in fields)} FROM rows{where} ORDER BY row',
+                params
+            ).fetchall()
+        for start in range(0, len(rows), batch_size):
+            yield [dict(zip(fields, row)) for row in rows[start:start + batch_size]]
+
+    def _candidate_rows(self, collection: EmbeddedCollection, filters: Optional[dict]) -> Optional[np.ndarray]:
+        """
+        Returns the rows matching the filters, or None for every live row.
+        """
+        if not filters:
+            return None
+        where, params = collection.filter_sql(filters)
+        with collection.lock:
+            return np.fromiter(
+                (row for row, in collection.conn.execute(f'SELECT row FROM rows{where}', params)), dtype=np.int64
+            )
+
+    def _maybe_train(self, collection: EmbeddedCollection):
+        if not collection.index_config.index_type.startswith('IVF') or collection.lists is not None:
+            return
+        nlist = int(collection.index_config.build_params.get('nlist', 128))
+        if collection.meta['rows'] >= nlist * EmbeddedBackend.IVF_MIN_ROWS_PER_LIST:
+            with collection.lock:
+                if collection.lists is None:
+                    collection.train_ivf()
+
+    def search(self, colname: str, vectors: List[List[float]], k: int, filters: Optional[dict],
+               output_fields: List[str], param: Optional[dict] = None) -> List[List[dict]]:
+        collection = self._open(colname)
+        metric = (param or {}).get('metric_type', collection.index_config.metric_type)
+        params = (param or {}).get('params', collection.index_config.search_params)
+        queries = np.asarray(vectors, dtype=np.float32).reshape(-1, collection.dim)
+        if metric == 'COSINE':
+            queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+        candidates = self._candidate_rows(collection, filters)
+        total = collection.meta['rows']
+        if candidates is None:
+            self._maybe_train(collection)
+        results = []
+        for query in queries:
+            if candidates is not None:
+                rows = candidates
+            elif collection.lists is not None:
+                # Probe the nprobe lists closest to the query
+                nprobe = min(int(params.get('nprobe', 16)), len(collection.centroids))
+                scores = (collection.centroids * collection.centroids).sum(axis=1) - 2 * collection.centroids @ query
+                probed = np.argpartition(scores, nprobe - 1)[:nprobe]
+                rows = np.flatnonzero(np.isin(collection.lists[:total], probed) & (collection.alive[:total] == 1))
+            else:
+                rows = np.flatnonzero(collection.alive[:total])
+            results.append(self._exact(collection, query, rows, k, metric))
+
+        return self._fetch(collection, results, output_fields)
+
+    @staticmethod
+    def _exact(collection: EmbeddedCollection, query: np.ndarray, rows: np.ndarray, k: int, metric: str) -> list:
+        """
+        Brute-force search of one query among the given rows.
+
+        Returns:
+            list: (row, distance) pairs, nearest first.
+        """
+        if len(rows) == 0:
+            return []
+        # Rows are decoded block by block, so half-precision vectors are multiplied in float32
+        products = []
+        for start in range(0, len(rows), EmbeddedCollection.SEARCH_BLOCK):
+            block = rows[start:start + EmbeddedCollection.SEARCH_BLOCK]
+            if block[-1] - block[0] + 1 == len(block):
+                stored = collection.vectors[block[0]:block[-1] + 1]
+            else:
+                stored = collection.vectors[block]
+            products.append(collection.decode(stored) @ query)
+        products = np.concatenate(products)
+        if metric == 'L2':
+            # Squared euclidean distance as reported by Milvus, smaller is nearer
+            scores = collection.norms[rows] - 2 * products + query @ query
+            ranks = scores
+        else:
+            # Inner product or cosine similarity, larger is nearer
+            scores = products / np.sqrt(np.maximum(collection.norms[rows], 1e-24)) if metric == 'COSINE' else products
+            ranks = -scores
+        top = np.argpartition(ranks, k)[:k] if len(rows) > k else np.arange(len(rows))
+        top = top[np.argsort(ranks[top], kind='stable')]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+    @staticmethod
+    def _fetch(collection: EmbeddedCollection, results: list, output_fields: List[str]) -> List[List[dict]]:
+        """
+        Attaches the output fields to the hits.
+        """
+        fields = list(dict.fromkeys([collection.primary_field, *output_fields]))
+        rows = sorted({row for hits in results for row, _ in hits})
+        values = {}
+        with collection.lock:
+            for start in range(0, len(rows), 900):
+                batch = rows[start:start + 900]
+                for record in collection.conn.execute(
+                        f'SELECT row, {", ".join(f"{chr(34)}{field}{chr(34)}" for field in fields)} FROM rows '
+                        f'WHERE row IN ({",".join("?" * len(batch))})', batch):
+                    values[record[0]] = dict(zip(fields, record[1:]))
+        return [
+            [{**values[row], 'distance': distance} for row, distance in hits if row in values]
+            for hits in results
+        ]
@@ -0,0 +1,121 @@
+import hashlib
+from typing import List, Optional, Union
+
+
+class FilterConfig:
+    """
+    How a collection serves the document filter of searches and existence checks.
+
+    - `partition_key`: 'pdf_name', or 'doc_id' for an INT64 id derived from the document name, is
+      made the partition key of the collection. Milvus hashes its values into `num_partitions`
+      partitions and only searches the partition of the filtered document.
+    - `scalar_index`: a scalar index on the filtered field (and on pdf_name), e.g. 'INVERTED', so
+      matching rows are found without scanning the field.
+
+    Both need a Milvus server from 2.4 on; Milvus Lite supports the INVERTED index but no partition key.
+    The embedded store always serves the document filter from its SQLite index.
+    """
+
+    PARTITION_KEYS: tuple = ('pdf_name', 'doc_id')
+    SCALAR_INDEXES: tuple = ('INVERTED', 'BITMAP', 'TRIE', 'STL_SORT')
+    DOC_ID: str = 'doc_id'
+
+    def __init__(self,
+                 partition_key: Optional[str] = None,
+                 num_partitions: int = 64,
+                 scalar_index: Optional[str] = 'INVERTED'):
+        """
+        Args:
+            partition_key (Optional[str]): None, 'pdf_name' or 'doc_id'.
+            num_partitions (int): The number of partitions the partition key is hashed into.
+            scalar_index (Optional[str]): The scalar index type of the filtered fields, None for no index.
+        """
+        if partition_key is not None and partition_key not in FilterConfig.PARTITION_KEYS:
+            raise ValueError(f"Unsupported partition key '{partition_key}', "
+                             f"choose one of: {', '.join(FilterConfig.PARTITION_KEYS)}")
+        scalar_index = scalar_index.upper() if scalar_index else None
+        if scalar_index is not None and scalar_index not in FilterConfig.SCALAR_INDEXES:
+            raise ValueError(f"Unsupported scalar index '{scalar_index}', "
+                             f"choose one of: {', '.join(FilterConfig.SCALAR_INDEXES)}")
+        self.partition_key = partition_key
+        self.num_partitions = num_partitions
+        self.scalar_index = scalar_index
+
+    @classmethod
+    def from_dict(cls, config: Optional[dict]) -> 'FilterConfig':
+        """
+        Builds a configuration from its stored form. Collections created before it was stored have
+        neither a partition key nor a scalar index.
+        """
+        return cls(**config) if config else cls(scalar_index=None)
+
+    def to_dict(self) -> dict:
+        """
+        Returns:
+            dict: The configuration stored with the collection.
+        """
+        return {'partition_key': self.partition_key, 'num_partitions': self.num_partitions,
+                'scalar_index': self.scalar_index}
+
+    @property
+    def uses_doc_id(self) -> bool:
+        """
+        True if the collection stores the derived document id.
+        """
+        return self.partition_key == FilterConfig.DOC_ID
+
+    @staticmethod
+    def document_id(pdf_name: str) -> int:
+        """
+        Derives the stable INT64 id of a document from its name.
+        """
+        return int.from_bytes(hashlib.sha256(pdf_name.encode('utf-8')).digest()[:8], 'big') >> 1
+
+    def apply(self, fields: List[dict], vector_field: str) -> List[dict]:
+        """
+        Adds the partition key, the document id and the scalar indexes to the field specs of a collection.
+
+        Args:
+            fields (List[dict]): The field specs, see `VectorBackend`.
+            vector_field (str): The name of the vector field, the document id is added before it.
+
+        Returns:
+            List[dict]: The new field specs.
+        """
+        applied = []
+        for field in fields:
+            if field['name'] == vector_field and self.uses_doc_id:
+                applied.append(self._filter_field({'name': FilterConfig.DOC_ID, 'dtype': 'INT64'}))
+            applied.append(self._filter_field(field) if field['name'] == 'pdf_name' else field)
+        return applied
+
+    def _filter_field(self, field: dict) -> dict:
+        field = dict(field)
+        if self.partition_key == field['name']:
+            field['is_partition_key'] = True
+        # STL_SORT only applies to numbers, the name then keeps an inverted index
+        index = self.scalar_index
+        if index == 'STL_SORT' and field['dtype'] != 'INT64':
+            index = 'INVERTED'
+        if index is not None:
+            field['index'] = index
+        return field
+
+    def document_filter(self, pdf_names: Union[str, List[str]]) -> dict:
+        """
+        Builds the filter matching the rows of one document, or of any of many documents.
+
+        Args:
+            pdf_names (Union[str, List[str]]): The name of the document, or a list of names.
+
+        Returns:
+            dict: The filter, on pdf_name and on the document id if the collection stores it.
+        """
+        filters = {'pdf_name': pdf_names}
+        if self.uses_doc_id:
+            # The id selects the partition, the name rules out the rare id collision
+            filters = {FilterConfig.DOC_ID: (
+                [FilterConfig.document_id(name) for name in pdf_names] if isinstance(pdf_names, list)
+                else FilterConfig.document_id(pdf_names)
+            ), **filters}
+        return filters
@@ -0,0 +1,91 @@
+import copy
+from typing import Optional
+
+
+class IndexConfig:
+    """
+    Vector index configuration of a collection: index type, build parameters, metric and
+    search parameters. Parameters not given fall back to the presets of the index type.
+    """
+
+    # Default build and search parameters per index type
+    PRESETS: dict = {
+        'FLAT': {'build': {}, 'search': {}},
+        'IVF_FLAT': {'build': {'nlist': 128}, 'search': {'nprobe': 16}},
+        'IVF_SQ8': {'build': {'nlist': 128}, 'search': {'nprobe': 16}},
+        'IVF_PQ': {'build': {'nlist': 128, 'm': 64, 'nbits': 8}, 'search': {'nprobe': 16}},
+        'HNSW': {'build': {'M': 16, 'efConstruction': 200}, 'search': {'ef': 64}},
+        'DISKANN': {'build': {}, 'search': {'search_list': 100}},
+        'SCANN': {'build': {'nlist': 128, 'with_raw_data': True}, 'search': {'nprobe': 16, 'reorder_k': 100}},
+        'AUTOINDEX': {'build': {}, 'search': {}},
+    }
+    METRICS: tuple = ('L2', 'IP', 'COSINE')
+
+    def __init__(self,
+                 index_type: str = 'IVF_FLAT',
+                 metric_type: str = 'L2',
+                 build_params: Optional[dict] = None,
+                 search_params: Optional[dict] = None):
+        """
+        Args:
+            index_type (str): One of the keys of `PRESETS`, e.g. 'HNSW' or 'IVF_PQ'.
+            metric_type (str): One of 'L2', 'IP' or 'COSINE'.
+            build_params (Optional[dict]): Index build parameters, merged over the preset.
+            search_params (Optional[dict]): Search parameters, merged over the preset.
+        """
+        index_type = index_type.upper()
+        metric_type = metric_type.upper()
+        if index_type not in IndexConfig.PRESETS:
+            raise ValueError(f"Unsupported index type '{index_type}', choose one of: {', '.join(IndexConfig.PRESETS)}")
+        if metric_type not in IndexConfig.METRICS:
+            raise ValueError(f"Unsupported metric '{metric_type}', choose one of: {', '.join(IndexConfig.METRICS)}")
+        preset = IndexConfig.PRESETS[index_type]
+        self.index_type = index_type
+        self.metric_type = metric_type
+        self.build_params = {**copy.deepcopy(preset['build']), **(build_params or {})}
+        self.search_params = {**copy.deepcopy(preset['search']), **(search_params or {})}
+
+    @classmethod
+    def from_index(cls, index: dict, search_params: Optional[dict] = None) -> 'IndexConfig':
+        """
+        Builds the configuration of an existing index.
+
+        Args:
+            index (dict): The index parameters as reported by Milvus, with 'index_type', 'metric_type'
+                          and 'params' keys.
+            search_params (Optional[dict]): Search parameters stored with the collection.
+
+        Returns:
+            IndexConfig: The index configuration.
+        """
+        return cls(
+            index_type=index['index_type'],
+            metric_type=index['metric_type'],
+            build_params=index.get('params') or {},
+            search_params=search_params
+        )
+
+    def index_params(self) -> dict:
+        """
+        Returns:
+            dict: The parameters passed to `Collection.create_index`.
+        """
+        return {
+            "index_type": self.index_type,
+            "metric_type": self.metric_type,
+            "params": dict(self.build_params)
+        }
+
+    def search_param(self) -> dict:
+        """
+        Returns:
+            dict: The `param` argument passed to `Collection.search`.
+        """
+        return {
+            "metric_type": self.metric_type,
+            "params": dict(self.search_params)
+        }
+
+    def __repr__(self):
+        return (f"IndexConfig(index_type={self.index_type!r}, metric_type={self.metric_type!r}, "
+                f"build_params={self.build_params!r}, search_params={self.search_params!r})")
@@ -1,32 +1,41 @@
 import os
-from scripts.logger.exceptions import ModelNotFoundError
+from typing import ClassVar, List
+from scripts.rag.models import AVAILABLE_MODELS, validate_model
 from langchain_community.llms import Ollama
 from dotenv import load_dotenv, find_dotenv
 load_dotenv(find_dotenv())
 
 class Llm(Ollama):
+    """
+    Client of a model on one Ollama host. `OllamaPool` creates one per host and model and routes
+    the generations across them.
+    """
 
-    def __init__(self, model, *args, **kwargs):
+    AVAILABLE_MODELS: ClassVar[List[str]] = AVAILABLE_MODELS
 
-        ollama_host = os.getenv('OLLAMA_HOST')
-        ollama_port = os.getenv('OLLAMA_PORT')
+    @classmethod
+    def validate(cls, model: str):
+        """
+        Raises ModelNotFoundError if the model is not served.
+        """
+        validate_model(model)
 
-        ollama_available_models = [
-            'gemma:7b',
-            'gemma2:27b',
-            'mistral:latest',
-            'phi3:latest',
-            'llama3.1:8b',
-            'llama3.1:70b',
-            'llama3.1:70b-instruct-q4_0'
-        ]
+    def __init__(self, model, *args, base_url: str = None, **kwargs):
+        """
+        Args:
+            model (str): The name of the Ollama model.
+            base_url (str): The URL of the Ollama host, defaults to OLLAMA_HOST:OLLAMA_PORT.
+        """
+        Llm.validate(model)
 
-        if model not in ollama_available_models:
-            raise ModelNotFoundError(model, ollama_available_models)
+        if base_url is None:
+            ollama_host = os.getenv('OLLAMA_HOST')
+            ollama_port = os.getenv('OLLAMA_PORT')
+            base_url = 'http://' + str(ollama_host) + ':' + str(ollama_port)
 
         super().__init__(
             model = model,
-            base_url = 'http://' + str(ollama_host) + ':' + str(ollama_port),
+            base_url = base_url,
             temperature = 0,
             *args, **kwargs
             )
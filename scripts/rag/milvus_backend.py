@@ -0,0 +1,294 @@
+import os
+import json
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from pymilvus import connections, CollectionSchema, FieldSchema, DataType, utility, Collection
+
+from scripts.rag.index_config import IndexConfig
+from scripts.rag.vector_backend import VectorBackend
+from scripts.logger.exceptions import MissingDBInfoError
+
+
+class MilvusBackend(VectorBackend):
+    """
+    VectorBackend storing collections on a Milvus server, or in a Milvus Lite file. The PCA projection
+    of a collection is stored in a companion collection, named with `PROJECTION_SUFFIX`.
+    """
+
+    PROJECTION_SUFFIX: str = '__projection'
+
+    def __init__(self, host: Optional[str] = None, port: Optional[str] = None, uri: Optional[str] = None):
+        """
+        Connects to Milvus.
+
+        Args:
+            host (Optional[str]): The host of the Milvus server.
+            port (Optional[str]): The port of the Milvus server.
+            uri (Optional[str]): A Milvus URI or Milvus Lite file, used instead of host and port.
+
+        Raises:
+            MissingDBInfoError: If neither a URI nor a host and port are given.
+        """
+        if uri:
+            connections.connect(uri=uri)
+        elif host and port:
+            connections.connect(host=host, port=port)
+        else:
+            raise MissingDBInfoError()
+        self.host = host
+        self.port = port
+        self.uri = uri
+        # Collection handles by name, and names already loaded into memory
+        self._collections: dict = {}
+        self._loaded: set = set()
+        self._lock = threading.Lock()
+
+    @property
+    def location(self) -> str:
+        if not self.uri:
+            return f'http://{self.host}:{self.port}'
+        # A Milvus Lite file is identified by its absolute path
+        return self.uri if '://' in self.uri else os.path.abspath(self.uri)
+
+    def get_collection(self, colname: str) -> Collection:
+        """
+        Returns a cached handle to the collection.
+        """
+        with self._lock:
+            if colname not in self._collections:
+                self._collections[colname] = Collection(colname)
+            return self._collections[colname]
+
+    def load_collection(self, colname: str) -> Collection:
+        """
+        Loads the collection into memory, once per process, and returns its handle.
+        """
+        collection = self.get_collection(colname)
+        if colname not in self._loaded:
+            collection.load()
+            with self._lock:
+                self._loaded.add(colname)
+        return collection
+
+    def _primary_field(self, colname: str) -> str:
+        return self.get_collection(colname).schema.primary_field.name
+
+    def _vector_field(self, colname: str) -> FieldSchema:
+        return next(field for field in self.get_collection(colname).schema.fields
+                    if field.dtype.name in VectorBackend.VECTOR_TYPES)
+
+    @staticmethod
+    def _cast(vectors, dtype: DataType) -> list:
+        """
+        Converts float32 vectors to the element type of a vector field.
+        """
+        if dtype == DataType.FLOAT_VECTOR:
+            return vectors.tolist() if isinstance(vectors, np.ndarray) else vectors
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if dtype == DataType.FLOAT16_VECTOR:
+            return list(vectors.astype(np.float16))
+        try:
+            # pymilvus only accepts bfloat16 vectors as ml_dtypes arrays
+            import ml_dtypes
+        except ImportError:
+            raise ImportError("BFLOAT16_VECTOR fields need the ml_dtypes package: pip install ml_dtypes")
+        return list(vectors.astype(ml_dtypes.bfloat16))
+
+    @staticmethod
+    def _to_float32(vector, dtype: DataType) -> np.ndarray:
+        """
+        Converts a vector returned by a query to float32, half-precision ones are returned as bytes.
+        """
+        if dtype == DataType.FLOAT_VECTOR:
+            return np.asarray(vector, dtype=np.float32)
+        raw = vector[0] if isinstance(vector, list) else vector
+        if dtype == DataType.FLOAT16_VECTOR:
+            return np.frombuffer(raw, dtype=np.float16).astype(np.float32)
+        return (np.frombuffer(raw, dtype=np.uint16).astype(np.uint32) << 16).view(np.float32)
+
+    def _expr(self, colname: str, filters: Optional[dict]) -> str:
+        """
+        Builds the boolean expression of a filter.
+        """
+        if not filters:
+            # Every row, Milvus needs an expression to query without a limit
+            return f'{self._primary_field(colname)} >= 0'
+        conditions = []
+        for field, value in filters.items():
+            if isinstance(value, (list, tuple, set)):
+                conditions.append(f'{field} in {json.dumps(list(value))}')
+            else:
+                conditions.append(f'{field} == {json.dumps(value)}')
+        return ' and '.join(conditions)
+
+    def has_collection(self, colname: str) -> bool:
+        return utility.has_collection(colname)
+
+    def create_collection(self, colname: str, fields: List[dict], index_config: IndexConfig, description: str = "",
+                          num_partitions: Optional[int] = None):
+        # A projection left over from a collection of the same name is stale
+        if utility.has_collection(self._projection_name(colname)):
+            utility.drop_collection(self._projection_name(colname))
+        schema = CollectionSchema(
+            fields=[
+                FieldSchema(**{**{key: value for key, value in field.items() if key != 'index'},
+                               'dtype': DataType[field['dtype']]})
+                for field in fields
+            ],
+            description=description
+        )
+        partitioned = any(field.get('is_partition_key') for field in fields)
+        collection = Collection(colname, schema, **({'num_partitions': num_partitions}
+                                                    if partitioned and num_partitions else {}))
+        with self._lock:
+            self._collections[colname] = collection
+        vector_field = next(field['name'] for field in fields if field['dtype'] in VectorBackend.VECTOR_TYPES)
+        collection.create_index(field_name=vector_field, index_params=index_config.index_params())
+        for field in fields:
+            if field.get('index'):
+                collection.create_index(
+                    field_name=field['name'], index_params={'index_type': field['index']}, index_name=f"{field['name']}_index"
+                )
+
+    def drop_collection(self, colname: str):
+        with self._lock:
+            self._collections.pop(colname, None)
+            self._loaded.discard(colname)
+        utility.drop_collection(colname)
+        if utility.has_collection(self._projection_name(colname)):
+            utility.drop_collection(self._projection_name(colname))
+
+    @staticmethod
+    def _projection_name(colname: str) -> str:
+        return f'{colname}{MilvusBackend.PROJECTION_SUFFIX}'
+
+    def save_projection(self, colname: str, mean: np.ndarray, components: np.ndarray):
+        name = self._projection_name(colname)
+        if utility.has_collection(name):
+            utility.drop_collection(name)
+        # Row -1 holds the mean, rows 0..dim-1 the components
+        collection = Collection(name, CollectionSchema(
+            fields=[
+                FieldSchema(name='row', dtype=DataType.INT64, is_primary=True),
+                FieldSchema(name='vector', dtype=DataType.FLOAT_VECTOR, dim=len(mean)),
+            ],
+            description=f'PCA projection of {colname}'
+        ))
+        collection.insert([list(range(-1, len(components))), np.vstack([mean, components]).astype(np.float32).tolist()])
+        collection.flush()
+        # Milvus only loads indexed collections
+        collection.create_index(field_name='vector', index_params={'index_type': 'FLAT', 'metric_type': 'L2', 'params': {}})
+
+    def load_projection(self, colname: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        name = self._projection_name(colname)
+        if not utility.has_collection(name):
+            return None
+        collection = Collection(name)
+        collection.load()
+        try:
+            rows = collection.query(expr='row >= -1', output_fields=['row', 'vector'], limit=16384)
+        finally:
+            collection.release()
+        vectors = np.asarray([row['vector'] for row in sorted(rows, key=lambda row: row['row'])], dtype=np.float32)
+        return vectors[0], vectors[1:]
+
+    def field_names(self, colname: str) -> List[str]:
+        return [field.name for field in self.get_collection(colname).schema.fields]
+
+    def description(self, colname: str) -> str:
+        return self.get_collection(colname).description
+
+    def index_config(self, colname: str) -> IndexConfig:
+        collection = self.get_collection(colname)
+        try:
+            search_params = json.loads(collection.description).get("search_params")
+        except (ValueError, AttributeError):
+            # Collections created before search parameters were stored
+            search_params = None
+        vector_field = self._vector_field(colname).name
+        for index in collection.indexes:
+            if index.field_name == vector_field:
+                return IndexConfig.from_index(index.params, search_params)
+        raise ValueError(f"Collection '{colname}' has no index on {vector_field}")
+
+    def insert(self, colname: str, columns: Dict[str, list]) -> list:
+        collection = self.get_collection(colname)
+        data = [
+            self._cast(columns[field.name], field.dtype) if field.dtype.name in VectorBackend.VECTOR_TYPES
+            else columns[field.name]
+            for field in collection.schema.fields if not field.auto_id
+        ]
+        return collection.insert(data).primary_keys
+
+    def update(self, colname: str, pks: list, columns: Dict[str, list]) -> dict:
+        # Milvus only updates whole rows: the rows are written again with their stored vectors, under new
+        # auto-generated keys, then the old rows are deleted
+        collection = self.get_collection(colname)
+        primary = self._primary_field(colname)
+        vector_field = self._vector_field(colname)
+        fields = [field.name for field in collection.schema.fields if not field.auto_id]
+        updates = {pk: {field: values[i] for field, values in columns.items()} for i, pk in enumerate(pks)}
+        rows = {row[primary]: row for row in self.query(colname, {primary: list(pks)}, fields)}
+        pks = [pk for pk in pks if pk in rows]
+        if not pks:
+            return {}
+        data = {
+            field: [updates[pk].get(field, rows[pk][field]) for pk in pks] for field in fields
+            if field != vector_field.name
+        }
+        data[vector_field.name] = np.stack([self._to_float32(rows[pk][vector_field.name], vector_field.dtype)
+                                            for pk in pks])
+        new_pks = self.insert(colname, data)
+        self.delete(colname, pks)
+        return dict(zip(pks, new_pks))
+
+    def delete(self, colname: str, pks: list):
+        collection = self.get_collection(colname)
+        primary = self._primary_field(colname)
+        for start in range(0, len(pks), 1000):
+            collection.delete(expr=f'{primary} in {list(pks[start:start + 1000])}')
+
+    def scan(self, colname: str, filters: Optional[dict], output_fields: List[str],
+             batch_size: int = 1000) -> Iterator[List[dict]]:
+        iterator = self.load_collection(colname).query_iterator(
+            batch_size=batch_size,
+            expr=self._expr(colname, filters),
+            output_fields=output_fields
+        )
+        try:
+            while True:
+                batch = iterator.next()
+                if not batch:
+                    return
+                yield batch
+        finally:
+            iterator.close()
+
+    def query(self, colname: str, filters: Optional[dict], output_fields: List[str],
+              limit: Optional[int] = None) -> List[dict]:
+        if limit is None:
+            return super().query(colname, filters, output_fields)
+        return self.load_collection(colname).query(
+            expr=self._expr(colname, filters), output_fields=output_fields, limit=limit
+        )
+
+    def search(self, colname: str, vectors: List[List[float]], k: int, filters: Optional[dict],
+               output_fields: List[str], param: Optional[dict] = None) -> List[List[dict]]:
+        collection = self.load_collection(colname)
+        vector_field = self._vector_field(colname)
+        primary = self._primary_field(colname)
+        hits = collection.search(
+            data=self._cast(vectors, vector_field.dtype),
+            anns_field=vector_field.name,
+            param=param or self.index_config(colname).search_param(),
+            limit=k,
+            expr=self._expr(colname, filters) if filters else None,
+            output_fields=output_fields
+        )
+        return [
+            [{primary: hit.id, 'distance': hit.distance, **{field: hit.entity.get(field) for field in output_fields}}
+             for hit in query_hits]
+            for query_hits in hits
+        ]
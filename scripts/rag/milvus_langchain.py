@@ -0,0 +1,65 @@
+from typing import Optional
+
+from langchain_core.runnables import ConfigurableField
+from langchain_milvus import Milvus
+
+from scripts.rag.VDB_Common import MilvusDB
+from scripts.model.asyncEmbedModel import AsyncNVEmbed
+from scripts.logger.exceptions import CollectionNotFoundError
+
+
+class MilvusWLangChain(Milvus):
+
+    """
+    A class that integrates Milvus with Langchain to provide a configurable retriever.
+
+    Attributes:
+        milvus (Milvus): An instance of the Milvus vector store.
+    """
+
+    def __init__(self, colname: str, pdf_name: str, *args, search_params: Optional[dict] = None, **kwargs):
+        """
+        Args:
+            colname (str): The name of the collection.
+            pdf_name (str): The name of the PDF document to retrieve from.
+            search_params (Optional[dict]): The `param` passed to every search, see `MilvusDB.get_index_config`.
+                                            Defaults to LangChain's parameters for the index type.
+        """
+        if not colname:
+            raise CollectionNotFoundError(colname)
+        # Initialize the Milvus vector store with Langchain compatibility
+        self.milvus = Milvus(
+            embedding_function=AsyncNVEmbed.shared(),
+            collection_name=colname,
+            connection_args={"uri": MilvusDB.uri} if MilvusDB.uri else {
+                "host": MilvusDB.host,
+                "port": MilvusDB.port
+            },
+            vector_field=MilvusDB.VECTOR,
+            primary_field=MilvusDB.ID_KEY,
+            text_field="chunk_text",
+            search_params=search_params,
+            *args,
+            **kwargs
+        )
+        self.pdf_name = pdf_name
+
+    def get_retriever(self, relavant_chunk_size):
+        """
+        Configures and returns a retriever with specified filters.
+
+        Returns:
+            Retriever: A configured retriever instance.
+        """
+        return self.milvus.as_retriever().configurable_fields(
+            search_kwargs=ConfigurableField(
+                id="expr_filter",
+            )
+        ).with_config(
+            configurable={
+                "expr_filter": {
+                    "expr": f"pdf_name == '{self.pdf_name}'",
+                    "k": relavant_chunk_size,
+                }
+            }
+        )
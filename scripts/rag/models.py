@@ -0,0 +1,22 @@
+from typing import List
+
+from scripts.logger.exceptions import ModelNotFoundError
+
+# Models served by the Ollama hosts, kept apart from the Ollama client so they are checked without importing it
+AVAILABLE_MODELS: List[str] = [
+    'gemma:7b',
+    'gemma2:27b',
+    'mistral:latest',
+    'phi3:latest',
+    'llama3.1:8b',
+    'llama3.1:70b',
+    'llama3.1:70b-instruct-q4_0'
+]
+
+
+def validate_model(model: str):
+    """
+    Raises ModelNotFoundError if the model is not served.
+    """
+    if model not in AVAILABLE_MODELS:
+        raise ModelNotFoundError(model, AVAILABLE_MODELS)
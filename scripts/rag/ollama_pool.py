@@ -0,0 +1,509 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Union
+
+import aiohttp
+import requests
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import Generation, GenerationChunk, LLMResult
+
+from scripts.rag.llm import Llm
+from scripts.logger.logger import Log
+from scripts.logger.metrics import Histogram, Metrics
+from scripts.logger.exceptions import LlmOverloadedError
+
+from dotenv import load_dotenv, find_dotenv
+load_dotenv(find_dotenv())
+
+
+class OllamaHost:
+    """
+    One Ollama server of the pool: its generation slots, its clients by model and its latency.
+    """
+
+    def __init__(self, url: str, max_concurrency: int):
+        """
+        Args:
+            url (str): The base URL of the server, e.g. 'http://gpu1:11434'.
+            max_concurrency (int): The number of generations the server runs at once.
+        """
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.down_until = 0.0
+        self.latency = Histogram(1000)
+        self.clients: Dict[str, Llm] = {}
+
+    @property
+    def available(self) -> bool:
+        """
+        False while the host is skipped after refusing a connection.
+        """
+        return time.monotonic() >= self.down_until
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: The outstanding generations, request and error counts and the latency summary of the host.
+        """
+        return {'url': self.url, 'outstanding': self.outstanding, 'max_concurrency': self.max_concurrency,
+                'requests': self.requests, 'errors': self.errors, 'available': self.available,
+                'latency': self.latency.summary()}
+
+
+class _Waiter:
+    """
+    A generation waiting for a slot in the queue of an `OllamaPool`, and the hosts it must not use.
+    """
+
+    __slots__ = ('exclude',)
+
+    def __init__(self, exclude):
+        self.exclude = exclude
+
+
+class OllamaPool:
+    """
+    Routes the generations of every model across a pool of Ollama hosts.
+
+    - Balancing: a generation goes to the host with the fewest outstanding generations relative to
+      its capacity. A host refusing connections is skipped for `cooldown` seconds and the generation
+      is retried on another host, unless it already streamed tokens.
+    - Admission: a host runs at most `max_concurrency` generations. The others wait in a queue of at
+      most `max_queue` generations for at most `queue_timeout` seconds, and are rejected beyond with
+      LlmOverloadedError. The queue is first in, first out: a freed slot goes to the oldest waiter
+      that may use its host, and new generations queue behind the waiters.
+    - Warm models: every request asks Ollama to keep the model loaded for `keep_alive` (-1 for as long
+      as the server runs), and the first use of a model preloads it on every host in the background,
+      so large models do not pay a cold load between requests.
+
+    Hosts come from OLLAMA_HOSTS ('gpu1:11434,gpu2:11434'), or from OLLAMA_HOST and OLLAMA_PORT.
+    The queue depth, the outstanding generations and the latency of each host are recorded in
+    `Metrics` as rag_llm_* series and returned by `stats`.
+    """
+
+    _shared: Optional['OllamaPool'] = None
+    _shared_lock = threading.Lock()
+
+    DEFAULT_PORT: int = 11434
+    # Errors meaning the host could not be reached, the generation did not start
+    CONNECTION_ERRORS: tuple = (requests.exceptions.ConnectionError, aiohttp.ClientConnectionError, ConnectionError)
+
+    def __init__(self,
+                 hosts: List[str],
+                 max_concurrency: int = 2,
+                 max_queue: int = 64,
+                 queue_timeout: float = 120.0,
+                 keep_alive: Union[int, str] = -1,
+                 request_timeout: Optional[int] = None,
+                 cooldown: float = 30.0,
+                 preload: bool = True,
+                 preload_timeout: float = 600.0):
+        """
+        Args:
+            hosts (List[str]): The Ollama hosts, as 'host', 'host:port' or URLs.
+            max_concurrency (int): The generations each host runs at once, e.g. its OLLAMA_NUM_PARALLEL.
+            max_queue (int): The generations waiting for a slot before new ones are rejected.
+            queue_timeout (float): The seconds a generation waits for a slot before it is rejected.
+            keep_alive (Union[int, str]): How long Ollama keeps a model loaded after a request,
+                in seconds or as a duration such as '30m', -1 for as long as the server runs.
+            request_timeout (Optional[int]): The timeout of the requests to Ollama, in seconds.
+            cooldown (float): The seconds a host refusing connections is skipped.
+            preload (bool): Whether the first use of a model loads it on every host.
+            preload_timeout (float): The timeout of a model load, in seconds.
+        """
+        if not hosts:
+            raise ValueError('The Ollama pool needs at least one host')
+        self.logger = Log(f'{os.path.basename(__file__)}').getlog()
+        self.hosts = [OllamaHost(OllamaPool.parse_url(host), max_concurrency) for host in hosts]
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.keep_alive = keep_alive
+        self.request_timeout = request_timeout
+        self.cooldown = cooldown
+        self.preload_models = preload
+        self.preload_timeout = preload_timeout
+        self.waiting = 0
+        self.metrics = Metrics.shared()
+        self._condition = threading.Condition()
+        self._queue: deque = deque()
+        self._llms: Dict[str, PooledLlm] = {}
+        # Threads of the async callers waiting for a slot
+        self._waiters = ThreadPoolExecutor(max_workers=max(1, max_queue), thread_name_prefix='OllamaPoolQueue')
+        self.metrics.set('rag_llm_queue_depth', 0)
+
+    @classmethod
+    def shared(cls) -> 'OllamaPool':
+        """
+        Returns the process-wide pool, configured from the OLLAMA_* environment variables:
+        OLLAMA_HOSTS, OLLAMA_MAX_CONCURRENCY, OLLAMA_MAX_QUEUE, OLLAMA_QUEUE_TIMEOUT, OLLAMA_KEEP_ALIVE,
+        OLLAMA_TIMEOUT, OLLAMA_HOST_COOLDOWN and OLLAMA_PRELOAD (0 to disable preloading).
+        """
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    hosts = [host.strip() for host in os.getenv('OLLAMA_HOSTS', '').split(',') if host.strip()]
+                    if not hosts:
+                        hosts = [f"{os.getenv('OLLAMA_HOST')}:{os.getenv('OLLAMA_PORT')}"]
+                    keep_alive = os.getenv('OLLAMA_KEEP_ALIVE', '-1')
+                    cls._shared = cls(
+                        hosts,
+                        max_concurrency=int(os.getenv('OLLAMA_MAX_CONCURRENCY', '2')),
+                        max_queue=int(os.getenv('OLLAMA_MAX_QUEUE', '64')),
+                        queue_timeout=float(os.getenv('OLLAMA_QUEUE_TIMEOUT', '120')),
+                        keep_alive=int(keep_alive) if keep_alive.lstrip('-').isdigit() else keep_alive,
+                        request_timeout=int(os.getenv('OLLAMA_TIMEOUT')) if os.getenv('OLLAMA_TIMEOUT') else None,
+                        cooldown=float(os.getenv('OLLAMA_HOST_COOLDOWN', '30')),
+                        preload=os.getenv('OLLAMA_PRELOAD', '1') != '0',
+                    )
+        return cls._shared
+
+    @staticmethod
+    def parse_url(host: str) -> str:
+        """
+        Returns:
+            str: The base URL of a host given as 'host', 'host:port' or a URL.
+        """
+        url = host if '://' in host else 'http://' + host
+        if ':' not in url.split('://', 1)[1]:
+            url = f'{url}:{OllamaPool.DEFAULT_PORT}'
+        return url.rstrip('/')
+
+    def llm(self, model: str) -> 'PooledLlm':
+        """
+        Returns the LangChain LLM of a model on the pool, created and preloaded on first use.
+
+        Args:
+            model (str): The name of the Ollama model.
+
+        Returns:
+            PooledLlm: The shared LLM of the model.
+        """
+        with self._condition:
+            if model not in self._llms:
+                Llm.validate(model)
+                self._llms[model] = PooledLlm(model=model, pool=self)
+                if self.preload_models:
+                    threading.Thread(target=self.preload, args=(model,), name='OllamaPreload', daemon=True).start()
+            return self._llms[model]
+
+    def client(self, host: OllamaHost, model: str) -> Llm:
+        """
+        Returns the client of a model on a host, created on first use.
+        """
+        with self._condition:
+            if model not in host.clients:
+                options = {'timeout': self.request_timeout} if self.request_timeout else {}
+                host.clients[model] = Llm(model, base_url=host.url, keep_alive=self.keep_alive, **options)
+            return host.clients[model]
+
+    def preload(self, model: str) -> Dict[str, bool]:
+        """
+        Loads a model on every host, an Ollama generate request without prompt, and keeps it loaded
+        for `keep_alive`.
+
+        Returns:
+            Dict[str, bool]: Whether the model was loaded, by host URL.
+        """
+        def load(host: OllamaHost) -> bool:
+            try:
+                response = requests.post(f'{host.url}/api/generate', json={'model': model, 'keep_alive': self.keep_alive},
+                                         timeout=self.preload_timeout)
+                response.raise_for_status()
+                loaded = True
+            except requests.exceptions.RequestException as e:
+                self.logger.warning(f'Could not preload {model} on {host.url}: {e}')
+                loaded = False
+            self.metrics.inc('rag_llm_preloads_total', host=host.url, status='ok' if loaded else 'error')
+            return loaded
+
+        with ThreadPoolExecutor(max_workers=len(self.hosts)) as executor:
+            return dict(zip([host.url for host in self.hosts], executor.map(load, self.hosts)))
+
+    def _select(self, exclude) -> Optional[OllamaHost]:
+        hosts = [host for host in self.hosts if host not in exclude]
+        # Hosts refusing connections are only tried when no other host is up
+        candidates = [host for host in hosts if host.available] or hosts
+        free = [host for host in candidates if host.outstanding < host.max_concurrency]
+        if not free:
+            return None
+        return min(free, key=lambda host: (host.outstanding / host.max_concurrency, host.requests))
+
+    def _next_host(self, waiter: _Waiter) -> Optional[OllamaHost]:
+        # A free slot goes to the first waiter of the queue that may use it
+        for queued in self._queue:
+            host = self._select(queued.exclude)
+            if host is not None:
+                return host if queued is waiter else None
+        return None
+
+    def _take(self, host: OllamaHost):
+        host.outstanding += 1
+        host.requests += 1
+        self.metrics.set('rag_llm_outstanding', host.outstanding, host=host.url)
+
+    def _reject(self, reason: str):
+        self.metrics.inc('rag_llm_rejected_total', reason=reason)
+        raise LlmOverloadedError(reason, self.waiting)
+
+    def acquire(self, exclude: List[OllamaHost] = ()) -> OllamaHost:
+        """
+        Takes a generation slot on the least loaded host, waiting in the queue if every host is busy.
+
+        Args:
+            exclude (List[OllamaHost]): Hosts not to use, e.g. those a generation already failed on.
+
+        Returns:
+            OllamaHost: The host, to `release` once the generation is over.
+
+        Raises:
+            LlmOverloadedError: The queue is full, or no slot was freed within `queue_timeout`.
+        """
+        start = time.monotonic()
+        with self._condition:
+            host = None if self._queue else self._select(exclude)
+            if host is None:
+                if self.waiting >= self.max_queue:
+                    self._reject('queue_full')
+                waiter = _Waiter(exclude)
+                self._queue.append(waiter)
+                self.waiting += 1
+                self.metrics.set('rag_llm_queue_depth', self.waiting)
+                try:
+                    host = self._next_host(waiter)
+                    while host is None:
+                        remaining = start + self.queue_timeout - time.monotonic()
+                        if remaining <= 0:
+                            self._reject('queue_timeout')
+                        self._condition.wait(remaining)
+                        host = self._next_host(waiter)
+                finally:
+                    self._queue.remove(waiter)
+                    self.waiting -= 1
+                    self.metrics.set('rag_llm_queue_depth', self.waiting)
+                    # The next waiters check whether a slot is left for them
+                    self._condition.notify_all()
+            self._take(host)
+        self.metrics.observe('rag_llm_queue_seconds', time.monotonic() - start)
+        return host
+
+    async def aacquire(self, exclude: List[OllamaHost] = ()) -> OllamaHost:
+        """
+        Async version of `acquire`, waiting for a slot on a thread of the pool.
+        """
+        with self._condition:
+            host = None if self._queue else self._select(exclude)
+            if host is not None:
+                self._take(host)
+                return host
+            if self.waiting >= self.max_queue:
+                self._reject('queue_full')
+        waiter = self._waiters.submit(self.acquire, exclude)
+        try:
+            return await asyncio.wrap_future(waiter)
+        except asyncio.CancelledError:
+            # The slot taken after the caller gave up is given back
+            waiter.add_done_callback(lambda done: done.exception() is None and self.release(done.result(), None))
+            raise
+
+    def release(self, host: OllamaHost, model: Optional[str], seconds: Optional[float] = None,
+                error: Optional[BaseException] = None):
+        """
+        Gives back a generation slot and records the outcome of the generation.
+
+        Args:
+            host (OllamaHost): The host returned by `acquire`.
+            model (Optional[str]): The model that generated, None if the slot was not used.
+            seconds (Optional[float]): The duration of the generation.
+            error (Optional[BaseException]): The error the generation failed with, if any.
+        """
+        unreachable = isinstance(error, OllamaPool.CONNECTION_ERRORS)
+        with self._condition:
+            host.outstanding -= 1
+            if error is not None:
+                host.errors += 1
+            elif seconds is not None:
+                host.latency.observe(seconds)
+            if unreachable:
+                host.down_until = time.monotonic() + self.cooldown
+            self.metrics.set('rag_llm_outstanding', host.outstanding, host=host.url)
+            # Waiters may exclude some hosts, all of them check the freed slot
+            self._condition.notify_all()
+        if model is None:
+            return
+        self.metrics.inc('rag_llm_requests_total', host=host.url, status='ok' if error is None else 'error')
+        if error is None and seconds is not None:
+            self.metrics.observe('rag_llm_seconds', seconds, host=host.url, model=model)
+        if unreachable:
+            self.logger.warning(f'Ollama host {host.url} is unreachable, skipping it for {self.cooldown:g}s: {error}')
+
+    def failover(self, error: BaseException, tried: List[OllamaHost], host: OllamaHost) -> bool:
+        """
+        Decides whether a failed generation is retried on another host: only if the host could not
+        be reached and another host is left.
+
+        Args:
+            error (BaseException): The error of the generation.
+            tried (List[OllamaHost]): The hosts already tried, the failed host is added to them.
+            host (OllamaHost): The host the generation failed on.
+        """
+        if not isinstance(error, OllamaPool.CONNECTION_ERRORS):
+            return False
+        tried.append(host)
+        return len(tried) < len(self.hosts)
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        The number of generations waiting for a slot.
+        """
+        return self.waiting
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: The queue depth and the state and latency of every host.
+        """
+        with self._condition:
+            return {'queue_depth': self.waiting, 'hosts': [host.stats() for host in self.hosts]}
+
+
+class PooledLlm(LLM):
+    """
+    LangChain LLM generating with a model on the hosts of an `OllamaPool`. A call, a stream and each
+    prompt of a batch hold a slot of one host while they generate, the prompts of a batch are
+    generated concurrently.
+    """
+
+    model: str
+    pool: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return 'ollama-pool'
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {'model': self.model, 'hosts': [host.url for host in self.pool.hosts]}
+
+    def _call(self,
+              prompt: str,
+              stop: Optional[List[str]] = None,
+              run_manager: Optional[CallbackManagerForLLMRun] = None,
+              **kwargs: Any) -> str:
+        tried = []
+        while True:
+            host = self.pool.acquire(tried)
+            start = time.perf_counter()
+            error = None
+            try:
+                result = self.pool.client(host, self.model)._generate(
+                    [prompt], stop=stop, run_manager=run_manager, **kwargs
+                )
+                return result.generations[0][0].text
+            except Exception as e:
+                error = e
+                if not self.pool.failover(e, tried, host):
+                    raise
+            finally:
+                self.pool.release(host, self.model, time.perf_counter() - start, error)
+
+    async def _acall(self,
+                     prompt: str,
+                     stop: Optional[List[str]] = None,
+                     run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                     **kwargs: Any) -> str:
+        tried = []
+        while True:
+            host = await self.pool.aacquire(tried)
+            start = time.perf_counter()
+            error = None
+            try:
+                result = await self.pool.client(host, self.model)._agenerate(
+                    [prompt], stop=stop, run_manager=run_manager, **kwargs
+                )
+                return result.generations[0][0].text
+            except Exception as e:
+                error = e
+                if not self.pool.failover(e, tried, host):
+                    raise
+            finally:
+                self.pool.release(host, self.model, time.perf_counter() - start, error)
+
+    def _generate(self,
+                  prompts: List[str],
+                  stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None,
+                  **kwargs: Any) -> LLMResult:
+        if len(prompts) == 1:
+            return super()._generate(prompts, stop=stop, run_manager=run_manager, **kwargs)
+        with ThreadPoolExecutor(max_workers=len(prompts)) as executor:
+            texts = list(executor.map(
+                lambda prompt: self._call(prompt, stop=stop, run_manager=run_manager, **kwargs), prompts
+            ))
+        return LLMResult(generations=[[Generation(text=text)] for text in texts])
+
+    async def _agenerate(self,
+                         prompts: List[str],
+                         stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                         **kwargs: Any) -> LLMResult:
+        texts = await asyncio.gather(
+            *(self._acall(prompt, stop=stop, run_manager=run_manager, **kwargs) for prompt in prompts)
+        )
+        return LLMResult(generations=[[Generation(text=text)] for text in texts])
+
+    def _stream(self,
+                prompt: str,
+                stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None,
+                **kwargs: Any) -> Iterator[GenerationChunk]:
+        tried = []
+        while True:
+            host = self.pool.acquire(tried)
+            start = time.perf_counter()
+            error = None
+            streamed = False
+            try:
+                for chunk in self.pool.client(host, self.model)._stream(prompt, stop=stop, run_manager=run_manager,
+                                                                        **kwargs):
+                    streamed = True
+                    yield chunk
+                return
+            except Exception as e:
+                error = e
+                if streamed or not self.pool.failover(e, tried, host):
+                    raise
+            finally:
+                self.pool.release(host, self.model, time.perf_counter() - start, error)
+
+    async def _astream(self,
+                       prompt: str,
+                       stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[GenerationChunk]:
+        tried = []
+        while True:
+            host = await self.pool.aacquire(tried)
+            start = time.perf_counter()
+            error = None
+            streamed = False
+            try:
+                async for chunk in self.pool.client(host, self.model)._astream(prompt, stop=stop,
+                                                                               run_manager=run_manager, **kwargs):
+                    streamed = True
+                    yield chunk
+                return
+            except Exception as e:
+                error = e
+                if streamed or not self.pool.failover(e, tried, host):
+                    raise
+            finally:
+                self.pool.release(host, self.model, time.perf_counter() - start, error)
@@ -0,0 +1,381 @@
+import os
+import asyncio
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import BasePromptTemplate
+
+from scripts.rag.VDB_Common import MilvusDB
+from scripts.rag.answer_cache import AnswerCache
+from scripts.rag.context_packer import ContextPacker
+from scripts.rag.search_batcher import SearchBatcher
+from scripts.rag.sparse_index import reciprocal_rank_fusion
+from scripts.logger.logger import Log
+from scripts.logger.metrics import Metrics
+
+
+class QueryService:
+    """
+    QueryService class to answer queries with long-lived resources. Chunks are retrieved through the
+    vector store backend of the MilvusDB, and the RAG chain is compiled once. The document filter and
+    the number of retrieved chunks are passed per call. Retrieved chunks are packed into the context by
+    a ContextPacker, and answers are cached in an AnswerCache.
+
+    In 'hybrid' retrieval mode, the vector search is fused with a BM25 search of the collection's sparse
+    index by reciprocal-rank fusion, so chunks sharing exact terms with the query rank higher.
+    """
+
+    RETRIEVAL_MODES: tuple = ('dense', 'hybrid')
+    # Candidates fetched from each retriever per retrieved chunk in hybrid mode
+    HYBRID_CANDIDATES: int = 4
+
+    def __init__(self,
+                 vdb: MilvusDB,
+                 llm,
+                 prompt: BasePromptTemplate,
+                 model: str = '',
+                 prompt_version: str = '',
+                 answer_cache: Optional[AnswerCache] = None,
+                 context_packer: Optional[ContextPacker] = None,
+                 retrieval_mode: Optional[str] = None,
+                 search_batcher: Optional[SearchBatcher] = None):
+        """
+        Initializes the QueryService and compiles the RAG chain.
+
+        Args:
+            vdb (MilvusDB): The vector database the chunks are retrieved from.
+            llm: The language model generating the answers (e.g. PooledLlm).
+            prompt (BasePromptTemplate): The prompt template, with 'context' and 'input' variables.
+            model (str): The name of the language model, part of the answer cache key.
+            prompt_version (str): The version of the prompt template, part of the answer cache key.
+            answer_cache (Optional[AnswerCache]): Cache of generated answers. Defaults to a new cache,
+                set ANSWER_CACHE=0 to disable caching.
+            context_packer (Optional[ContextPacker]): Assembles the retrieved chunks into the context.
+                Defaults to the packer of the model.
+            retrieval_mode (Optional[str]): 'dense' or 'hybrid', defaults to RETRIEVAL_MODE or 'dense'.
+            search_batcher (Optional[SearchBatcher]): Coalesces the searches of concurrent `aretrieve`
+                calls, e.g. in the query server. Each call searches on its own if None.
+        """
+        self.logger = Log(f'{os.path.basename(__file__)}').getlog()
+        self.vdb = vdb
+        self.llm = llm
+        self.prompt = prompt
+        self.model = model
+        self.prompt_version = prompt_version
+        if answer_cache is None and os.getenv('ANSWER_CACHE', '1') != '0':
+            answer_cache = AnswerCache()
+        self.answer_cache = answer_cache
+        self.context_packer = context_packer or ContextPacker.for_model(
+            model, context_window=getattr(llm, 'num_ctx', None)
+        )
+        self.retrieval_mode = retrieval_mode or os.getenv('RETRIEVAL_MODE', 'dense')
+        if self.retrieval_mode not in QueryService.RETRIEVAL_MODES:
+            raise ValueError(f"Unsupported retrieval mode '{self.retrieval_mode}', "
+                             f"choose one of: {', '.join(QueryService.RETRIEVAL_MODES)}")
+        self.rag_chain = self.prompt | self.llm | StrOutputParser()
+        self.search_batcher = search_batcher
+        self.metrics = Metrics.shared()
+
+    def invalidate(self, colname: Optional[str] = None):
+        """
+        Forgets the cached answers of a collection, e.g. after it was dropped and recreated.
+
+        Args:
+            colname (Optional[str]): The name of the collection, all collections if None.
+        """
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate(colname)
+
+    def invalidate_document(self, colname: str, pdf_name: str):
+        """
+        Forgets the cached answers about a document, e.g. after it was re-ingested.
+
+        Args:
+            colname (str): The name of the collection.
+            pdf_name (str): The name of the PDF document.
+        """
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate(colname, pdf_name)
+
+    def document_version(self, colname: str, pdf_name: str) -> str:
+        """
+        Returns the version of a document that its answers are cached under, see `MilvusDB.document_version`.
+        """
+        if self.answer_cache is None:
+            return ''
+        return self.vdb.document_version(colname, pdf_name)
+
+    def cached_answer(self, colname: str, user_query: str, pdf_name: str, k: int = 6,
+                      doc_version: Optional[str] = None) -> Optional[str]:
+        """
+        Returns the cached answer of the exact same query, without embedding it.
+
+        Args:
+            colname (str): The name of the collection.
+            user_query (str): The user's query string.
+            pdf_name (str): The name of the PDF document to search.
+            k (int): The number of chunks retrieved.
+            doc_version (Optional[str]): The current version of the document, read if None.
+
+        Returns:
+            Optional[str]: The cached answer, None if there is none.
+        """
+        if self.answer_cache is None:
+            return None
+        if doc_version is None:
+            doc_version = self.document_version(colname, pdf_name)
+        answer = self.answer_cache.get(colname, user_query, pdf_name, self.model, self.prompt_version, k, doc_version)
+        if answer is not None:
+            self.metrics.inc('rag_cache_hits_total', cache='answer', match='exact')
+        return answer
+
+    def _similar_answer(self, colname: str, vector: List[float], pdf_name: str, k: int,
+                        doc_version: str) -> Optional[str]:
+        if self.answer_cache is None:
+            return None
+        answer = self.answer_cache.get_similar(colname, vector, pdf_name, self.model, self.prompt_version,
+                                               k, doc_version)
+        if answer is not None:
+            self.metrics.inc('rag_cache_hits_total', cache='answer', match='semantic')
+        else:
+            self.metrics.inc('rag_cache_misses_total', cache='answer')
+        return answer
+
+    def lookup(self, colname: str, user_query: str, pdf_name: str,
+               k: int = 6) -> Tuple[Optional[str], Optional[List[float]], str]:
+        """
+        Looks up the cached answer of a query: first by exact match, then by similarity of the query
+        embedding. The embedding is only computed on an exact miss, and is returned for the retrieval.
+
+        Args:
+            colname (str): The name of the collection.
+            user_query (str): The user's query string.
+            pdf_name (str): The name of the PDF document to search.
+            k (int): The number of chunks retrieved.
+
+        Returns:
+            Tuple[Optional[str], Optional[List[float]], str]: The cached answer or None, the query embedding
+                if it was computed, and the document version to `remember` a generated answer under.
+        """
+        doc_version = self.document_version(colname, pdf_name)
+        answer = self.cached_answer(colname, user_query, pdf_name, k, doc_version)
+        if answer is not None:
+            return answer, None, doc_version
+        vector = self.vdb.embed_model.embed_query(user_query)
+        return self._similar_answer(colname, vector, pdf_name, k, doc_version), vector, doc_version
+
+    async def alookup(self, colname: str, user_query: str, pdf_name: str,
+                      k: int = 6) -> Tuple[Optional[str], Optional[List[float]], str]:
+        """
+        Asynchronous variant of `lookup`.
+        """
+        doc_version = await asyncio.to_thread(self.document_version, colname, pdf_name)
+        answer = self.cached_answer(colname, user_query, pdf_name, k, doc_version)
+        if answer is not None:
+            return answer, None, doc_version
+        vector = await self.vdb.embed_model.aembed_query(user_query)
+        return self._similar_answer(colname, vector, pdf_name, k, doc_version), vector, doc_version
+
+    def remember(self, colname: str, user_query: str, pdf_name: str, answer: str,
+                 vector: Optional[List[float]] = None, k: int = 6, doc_version: Optional[str] = None):
+        """
+        Caches the generated answer of a query.
+
+        Args:
+            colname (str): The name of the collection.
+            user_query (str): The user's query string.
+            pdf_name (str): The name of the PDF document searched.
+            answer (str): The generated answer.
+            vector (Optional[List[float]]): The query embedding, enables semantic matches.
+            k (int): The number of chunks retrieved.
+            doc_version (Optional[str]): The version of the document when the chunks were retrieved, as
+                                         returned by `lookup`, so an answer built on chunks re-ingested
+                                         meanwhile is never served. Read if None.
+        """
+        if self.answer_cache is not None:
+            if doc_version is None:
+                doc_version = self.document_version(colname, pdf_name)
+            self.answer_cache.put(colname, user_query, pdf_name, self.model, self.prompt_version, answer, vector,
+                                  k, doc_version)
+
+    def retrieve(self, colname: str, user_query: str, pdf_name: str, k: int = 6,
+                 vector: Optional[List[float]] = None) -> List[Document]:
+        """
+        Retrieves the chunks of a document most relevant to a query.
+
+        Args:
+            colname (str): The name of the collection.
+            user_query (str): The user's query string.
+            pdf_name (str): The name of the PDF document to search.
+            k (int): The number of chunks to retrieve.
+            vector (Optional[List[float]]): The query embedding if already computed, e.g. by `lookup`.
+
+        Returns:
+            List[Document]: The retrieved chunks, most relevant first.
+        """
+        candidates = k * QueryService.HYBRID_CANDIDATES if self.retrieval_mode == 'hybrid' else k
+        if vector is None:
+            vector = self.vdb.embed_model.embed_query(user_query)
+        with self.metrics.span('retrieve'):
+            hits = self.vdb.search_batch(colname, [vector], [pdf_name], k=candidates)[0]
+            return self._fuse(colname, user_query, pdf_name, self._documents(hits), k)
+
+    async def aretrieve(self, colname: str, user_query: str, pdf_name: str, k: int = 6,
+                        vector: Optional[List[float]] = None) -> List[Document]:
+        """
+        Asynchronous variant of `retrieve`.
+        """
+        candidates = k * QueryService.HYBRID_CANDIDATES if self.retrieval_mode == 'hybrid' else k
+        if vector is None:
+            vector = await self.vdb.embed_model.aembed_query(user_query)
+        with self.metrics.span('retrieve'):
+            if self.search_batcher is not None:
+                hits = await self.search_batcher.search(colname, vector, pdf_name, candidates)
+            else:
+                # The vector store clients are synchronous, the search runs in a worker thread
+                hits = (await asyncio.to_thread(self.vdb.search_batch, colname, [vector], [pdf_name], candidates))[0]
+            return self._fuse(colname, user_query, pdf_name, self._documents(hits), k)
+
+    def retrieve_batch(self, colname: str, user_queries: List[str], pdf_names: List[str],
+                       k: int = 6) -> List[List[Document]]:
+        """
+        Retrieves the relevant chunks of many queries at once. All queries are embedded in one batched
+        call, and the queries on the same document are searched together.
+
+        Args:
+            colname (str): The name of the collection.
+            user_queries (List[str]): The user queries.
+            pdf_names (List[str]): The PDF document searched by each query.
+            k (int): The number of chunks to retrieve per query.
+
+        Returns:
+            List[List[Document]]: The retrieved chunks of each query in input order, most relevant first.
+        """
+        candidates = k * QueryService.HYBRID_CANDIDATES if self.retrieval_mode == 'hybrid' else k
+        vectors = self.vdb.embed_model.embed_queries(user_queries)
+        with self.metrics.span('retrieve', batch='true'):
+            hits = self.vdb.search_batch(colname, vectors, pdf_names, k=candidates)
+            return [
+                self._fuse(colname, user_query, pdf_name, self._documents(query_hits), k)
+                for user_query, pdf_name, query_hits in zip(user_queries, pdf_names, hits)
+            ]
+
+    def _documents(self, hits: List[dict]) -> List[Document]:
+        """
+        Converts search hits to documents, the chunk text as content and the other fields as metadata.
+        """
+        return [Document(page_content=hit.pop(self.vdb.TEXT), metadata=hit) for hit in hits]
+
+    def _fuse(self, colname: str, user_query: str, pdf_name: str, docs: List[Document], k: int) -> List[Document]:
+        """
+        Fuses the vector search results with a BM25 search in hybrid mode, returns the top k chunks.
+        """
+        if self.retrieval_mode != 'hybrid':
+            return docs[:k]
+        if self.vdb.get_sparse_index(colname) is None:
+            return docs[:k]
+        sparse_hits = self.vdb.sparse_search(colname, user_query, pdf_name, k=k * QueryService.HYBRID_CANDIDATES)
+        dense_docs = {doc.metadata[self.vdb.ID_KEY]: doc for doc in docs}
+        fused = reciprocal_rank_fusion([list(dense_docs), [pk for pk, _ in sparse_hits]])
+        top = [pk for pk, _ in fused[:k]]
+        # Chunks found by BM25 only are fetched from the vector database
+        missing = {row[self.vdb.ID_KEY]: row for row in
+                   self.vdb.get_chunks(colname, [pk for pk in top if pk not in dense_docs])}
+        results = []
+        for pk in top:
+            if pk in dense_docs:
+                results.append(dense_docs[pk])
+            elif pk in missing:
+                row = missing[pk]
+                results.append(Document(page_content=row.pop(self.vdb.TEXT), metadata=row))
+        return results
+
+    def build_context(self, docs: List[Document]) -> str:
+        """
+        Merges, deduplicates and packs retrieved chunks into the context of a query.
+
+        Args:
+            docs (List[Document]): The retrieved chunks, most relevant first.
+
+        Returns:
+            str: The context passed to the language model.
+        """
+        with self.metrics.span('prompt'):
+            context = self.context_packer.pack(docs)
+        self.metrics.inc('rag_tokens_total', self.context_packer.count_tokens(context), kind='context')
+        return context
+
+    def generate(self, context: str, user_query: str) -> str:
+        """
+        Generates the answer to a query from the retrieved context.
+
+        Args:
+            context (str): The formatted retrieved chunks.
+            user_query (str): The user's query string.
+
+        Returns:
+            str: The response generated by the language model.
+        """
+        with self.metrics.span('generate'):
+            answer = self.rag_chain.invoke({"context": context, "input": user_query})
+        self.metrics.inc('rag_tokens_total', self.context_packer.count_tokens(answer), kind='generated')
+        return answer
+
+    def stream(self, context: str, user_query: str) -> Iterator[str]:
+        """
+        Generates the answer to a query, yielding its tokens as the language model produces them.
+
+        Args:
+            context (str): The formatted retrieved chunks.
+            user_query (str): The user's query string.
+
+        Yields:
+            str: The tokens of the response.
+        """
+        tokens = 0
+        with self.metrics.span('generate'):
+            for token in self.rag_chain.stream({"context": context, "input": user_query}):
+                tokens += 1
+                yield token
+        self.metrics.inc('rag_tokens_total', tokens, kind='generated')
+
+    async def astream(self, context: str, user_query: str) -> AsyncIterator[str]:
+        """
+        Asynchronous variant of `stream`.
+        """
+        tokens = 0
+        with self.metrics.span('generate'):
+            async for token in self.rag_chain.astream({"context": context, "input": user_query}):
+                tokens += 1
+                yield token
+        self.metrics.inc('rag_tokens_total', tokens, kind='generated')
+
+    def generate_batch(self, contexts: List[str], user_queries: List[str], max_concurrency: int = 4,
+                       return_exceptions: bool = False) -> list:
+        """
+        Generates the answers to many queries, with a bounded number of requests to the language model
+        in flight.
+
+        Args:
+            contexts (List[str]): The formatted retrieved chunks of each query.
+            user_queries (List[str]): The user queries.
+            max_concurrency (int): The maximum number of concurrent generations.
+            return_exceptions (bool): Return the exception of a failed generation in place of its answer
+                                      instead of raising it.
+
+        Returns:
+            list: The responses in input order.
+        """
+        with self.metrics.span('generate', batch='true'):
+            answers = self.rag_chain.batch(
+                [{"context": context, "input": user_query} for context, user_query in zip(contexts, user_queries)],
+                config={"max_concurrency": max_concurrency},
+                return_exceptions=return_exceptions
+            )
+        self.metrics.inc(
+            'rag_tokens_total',
+            sum(self.context_packer.count_tokens(answer) for answer in answers if isinstance(answer, str)),
+            kind='generated'
+        )
+        return answers
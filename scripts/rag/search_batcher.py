@@ -0,0 +1,82 @@
+import asyncio
+from typing import List, Optional
+
+from scripts.logger.metrics import Metrics
+
+
+class SearchBatcher:
+    """
+    Coalesces the vector searches of concurrent queries into batched searches.
+
+    Searches awaited within `batch_window` seconds of each other are sent together, up to
+    `max_batch_size`. The searches of a batch on the same collection, document and number of results
+    are sent as one multi-vector request, and the requests on different documents run concurrently,
+    at most `max_concurrency` at once, in worker threads as the vector store clients are synchronous.
+    A batcher serves the event loop it is first used on.
+    """
+
+    def __init__(self, vdb, batch_window: float = 0.005, max_batch_size: int = 64, max_concurrency: int = 16):
+        """
+        Args:
+            vdb (MilvusDB): The vector database searched.
+            batch_window (float): Seconds to wait for more searches before sending a batch.
+            max_batch_size (int): The maximum number of searches in a batch.
+            max_concurrency (int): The maximum number of batched searches in flight.
+        """
+        self.vdb = vdb
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.metrics = Metrics.shared()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._pending: List[tuple] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    async def search(self, colname: str, vector: List[float], pdf_name: str, k: int) -> list:
+        """
+        Searches the chunks of a document closest to a query vector, in the next batch.
+
+        Args:
+            colname (str): The name of the collection.
+            vector (List[float]): The query vector.
+            pdf_name (str): The name of the PDF document to search.
+            k (int): The number of chunks returned.
+
+        Returns:
+            list: The hits, as returned by `MilvusDB.search_batch` for one query.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((colname, vector, pdf_name, k, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            self.metrics.observe('rag_search_batch_size', len(batch))
+            groups = {}
+            for search in batch:
+                groups.setdefault((search[0], search[2], search[3]), []).append(search)
+            for (colname, pdf_name, k), searches in groups.items():
+                asyncio.get_running_loop().create_task(self._send(colname, pdf_name, k, searches))
+
+    async def _send(self, colname: str, pdf_name: str, k: int, searches: List[tuple]):
+        try:
+            async with self._semaphore:
+                hits = await asyncio.to_thread(
+                    self.vdb.search_batch, colname, [search[1] for search in searches], [pdf_name] * len(searches), k
+                )
+        except Exception as e:
+            for search in searches:
+                if not search[4].done():
+                    search[4].set_exception(e)
+            return
+        for search, query_hits in zip(searches, hits):
+            if not search[4].done():
+                search[4].set_result(query_hits)
@@ -0,0 +1,214 @@
+import os
+import re
+import math
+import hashlib
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv, find_dotenv
+load_dotenv(find_dotenv())
+
+
+class BM25Index:
+    """
+    Persistent BM25 inverted index over the chunks of a collection.
+
+    Postings are stored in a local SQLite database, keyed by the primary key of the chunk in the
+    vector database, and kept in sync as chunks are inserted and deleted. Searches are restricted
+    to one PDF document, and term statistics are those of that document's chunks.
+    """
+
+    # Default directory of the index databases, one subdirectory per vector store and one database per collection
+    DEFAULT_DIR: str = os.getenv(
+        'SPARSE_INDEX_DIR',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../cache/sparse")
+    )
+    # Terms keep inner dots, dashes and apostrophes, so figures like 12.5 and tickers like BRK-B stay whole
+    TOKEN = re.compile(r"[a-z0-9]+(?:[.\-'][a-z0-9]+)*")
+    STOPWORDS: frozenset = frozenset(
+        "a an and are as at be by for from has have in is it its of on or that the this to was were "
+        "what when where which who will with".split()
+    )
+
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75):
+        """
+        Initializes the BM25Index and creates its database if needed.
+
+        Args:
+            path (str): Path of the SQLite database, ':memory:' keeps the index in memory only.
+            k1 (float): BM25 term frequency saturation.
+            b (float): BM25 document length normalization.
+        """
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS chunks (pk INTEGER PRIMARY KEY, pdf_name TEXT NOT NULL, length INTEGER NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS postings (pdf_name TEXT NOT NULL, term TEXT NOT NULL, pk INTEGER NOT NULL, '
+            'tf INTEGER NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS chunks_pdf ON chunks (pdf_name)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS postings_term ON postings (pdf_name, term)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS postings_pk ON postings (pk)')
+        self._conn.commit()
+
+    @classmethod
+    def for_collection(cls, colname: str, location: str, directory: str = None) -> 'BM25Index':
+        """
+        Opens the index of a collection in the index directory.
+
+        Args:
+            colname (str): The name of the collection.
+            location (str): The vector store of the collection, see `VectorBackend.location`, so
+                            collections of the same name in different stores have their own index.
+            directory (str): The index directory, defaults to DEFAULT_DIR.
+        """
+        store = hashlib.sha256(location.encode('utf-8')).hexdigest()[:16]
+        return cls(os.path.join(directory or cls.DEFAULT_DIR, store, f"{colname}.sqlite"))
+
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        """
+        Splits a text into lowercase terms, without stopwords.
+        """
+        return [term for term in cls.TOKEN.findall(text.lower()) if term not in cls.STOPWORDS]
+
+    def add(self, pks: Iterable[int], pdf_names: Iterable[str], texts: Iterable[str]):
+        """
+        Indexes chunks.
+
+        Args:
+            pks (Iterable[int]): The primary keys of the chunks in the vector database.
+            pdf_names (Iterable[str]): The PDF document of each chunk.
+            texts (Iterable[str]): The text of each chunk.
+        """
+        chunks, postings = [], []
+        for pk, pdf_name, text in zip(pks, pdf_names, texts):
+            terms = self.tokenize(text)
+            chunks.append((int(pk), pdf_name, len(terms)))
+            postings.extend((pdf_name, term, int(pk), tf) for term, tf in Counter(terms).items())
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO chunks VALUES (?, ?, ?)', chunks)
+            self._conn.executemany('INSERT INTO postings VALUES (?, ?, ?, ?)', postings)
+            self._conn.commit()
+
+    def delete(self, pks: Iterable[int]):
+        """
+        Removes chunks from the index.
+
+        Args:
+            pks (Iterable[int]): The primary keys of the chunks.
+        """
+        rows = [(int(pk),) for pk in pks]
+        with self._lock:
+            self._conn.executemany('DELETE FROM postings WHERE pk = ?', rows)
+            self._conn.executemany('DELETE FROM chunks WHERE pk = ?', rows)
+            self._conn.commit()
+
+    def rekey(self, pks: Dict[int, int]):
+        """
+        Moves chunks to new primary keys, e.g. after the vector database rewrote their rows.
+
+        Args:
+            pks (Dict[int, int]): The new primary key of each chunk, by its previous key.
+        """
+        rows = [(int(new), int(old)) for old, new in pks.items() if old != new]
+        with self._lock:
+            self._conn.executemany('UPDATE postings SET pk = ? WHERE pk = ?', rows)
+            self._conn.executemany('UPDATE chunks SET pk = ? WHERE pk = ?', rows)
+            self._conn.commit()
+
+    def count(self, pdf_name: Optional[str] = None) -> int:
+        """
+        Returns:
+            int: The number of indexed chunks, of one PDF document if given.
+        """
+        with self._lock:
+            if pdf_name is None:
+                return self._conn.execute('SELECT COUNT(*) FROM chunks').fetchone()[0]
+            return self._conn.execute('SELECT COUNT(*) FROM chunks WHERE pdf_name = ?', (pdf_name,)).fetchone()[0]
+
+    def pks(self, pdf_name: str) -> Set[int]:
+        """
+        Returns:
+            Set[int]: The primary keys of the indexed chunks of a PDF document.
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT pk FROM chunks WHERE pdf_name = ?', (pdf_name,)).fetchall()
+        return {pk for pk, in rows}
+
+    def search(self, query: str, pdf_name: str, k: int = 6) -> List[Tuple[int, float]]:
+        """
+        Finds the chunks of a PDF document best matching a query.
+
+        Args:
+            query (str): The query text.
+            pdf_name (str): The name of the PDF document to search.
+            k (int): The number of chunks to return.
+
+        Returns:
+            List[Tuple[int, float]]: The primary key and BM25 score of each chunk, best first.
+        """
+        terms = list(dict.fromkeys(self.tokenize(query)))
+        if not terms:
+            return []
+        marks = ','.join('?' * len(terms))
+        with self._lock:
+            total, average = self._conn.execute(
+                'SELECT COUNT(*), AVG(length) FROM chunks WHERE pdf_name = ?', (pdf_name,)
+            ).fetchone()
+            if not total:
+                return []
+            rows = self._conn.execute(
+                f'SELECT p.term, p.pk, p.tf, c.length FROM postings p JOIN chunks c ON c.pk = p.pk '
+                f'WHERE p.pdf_name = ? AND p.term IN ({marks})',
+                (pdf_name, *terms)
+            ).fetchall()
+
+        frequencies = Counter(term for term, _, _, _ in rows)
+        average = average or 1.0
+        scores = Counter()
+        for term, pk, tf, length in rows:
+            idf = math.log(1 + (total - frequencies[term] + 0.5) / (frequencies[term] + 0.5))
+            scores[pk] += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / average))
+        return scores.most_common(k)
+
+    def clear(self):
+        """
+        Removes all chunks from the index.
+        """
+        with self._lock:
+            self._conn.execute('DELETE FROM postings')
+            self._conn.execute('DELETE FROM chunks')
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """
+    Fuses rankings of the same items with reciprocal-rank fusion.
+
+    Args:
+        rankings (List[List[int]]): The item ids of each ranking, best first.
+        k (int): The RRF constant, damping the weight of the top ranks.
+
+    Returns:
+        List[Tuple[int, float]]: The item ids and fused scores, best first.
+    """
+    scores = Counter()
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] += 1.0 / (k + rank + 1)
+    return scores.most_common()
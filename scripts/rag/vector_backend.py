@@ -0,0 +1,175 @@
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from scripts.rag.index_config import IndexConfig
+
+
+class VectorBackend(ABC):
+    """
+    Storage interface of the vector database, implemented by MilvusBackend and EmbeddedBackend.
+
+    A collection is described by a list of field specs, dicts with a 'name' and a 'dtype' among
+    'INT64', 'VARCHAR' and one of `VECTOR_TYPES`, plus 'is_primary' and 'auto_id' for the primary key,
+    'max_length' for strings and 'dim' for the vector. A scalar field may also set 'is_partition_key',
+    and 'index' to the type of its scalar index (e.g. 'INVERTED'), see FilterConfig. Vectors are passed
+    as float32 and converted to the element type of the vector field by the backend. Filters are dicts
+    mapping a field to a value it must equal, or to a list of values it must be one of; all conditions
+    must hold.
+    """
+
+    VECTOR_TYPES: tuple = ('FLOAT_VECTOR', 'FLOAT16_VECTOR', 'BFLOAT16_VECTOR')
+
+    @property
+    @abstractmethod
+    def location(self) -> str:
+        """
+        Identifies the store, e.g. its URI, so state kept locally per collection is not shared between stores.
+        """
+
+    @abstractmethod
+    def has_collection(self, colname: str) -> bool:
+        """
+        Returns:
+            bool: True if the collection exists.
+        """
+
+    @abstractmethod
+    def create_collection(self, colname: str, fields: List[dict], index_config: IndexConfig, description: str = "",
+                          num_partitions: Optional[int] = None):
+        """
+        Creates a collection, its vector index and the scalar indexes of its fields.
+
+        Args:
+            colname (str): The name of the collection.
+            fields (List[dict]): The field specs, exactly one of them a vector.
+            index_config (IndexConfig): The vector index and search parameters.
+            description (str): Stored with the collection.
+            num_partitions (Optional[int]): The number of partitions of the partition key, if a field is one.
+        """
+
+    @abstractmethod
+    def drop_collection(self, colname: str):
+        """
+        Deletes a collection and its data.
+        """
+
+    @abstractmethod
+    def save_projection(self, colname: str, mean: np.ndarray, components: np.ndarray):
+        """
+        Stores the PCA projection of a collection with the collection, replacing any previous one.
+        It is deleted with the collection.
+
+        Args:
+            colname (str): The name of the collection.
+            mean (np.ndarray): The mean of the full-dimension vectors the projection was fitted on.
+            components (np.ndarray): The principal components, one full-dimension vector per row.
+        """
+
+    @abstractmethod
+    def load_projection(self, colname: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Returns:
+            Optional[Tuple[np.ndarray, np.ndarray]]: The mean and components stored by `save_projection`,
+                                                      None if the collection has no projection.
+        """
+
+    @abstractmethod
+    def field_names(self, colname: str) -> List[str]:
+        """
+        Returns:
+            List[str]: The names of the fields of the collection, in schema order.
+        """
+
+    @abstractmethod
+    def description(self, colname: str) -> str:
+        """
+        Returns:
+            str: The description stored with the collection.
+        """
+
+    @abstractmethod
+    def index_config(self, colname: str) -> IndexConfig:
+        """
+        Returns:
+            IndexConfig: The vector index of the collection, with its stored search parameters.
+        """
+
+    @abstractmethod
+    def insert(self, colname: str, columns: Dict[str, list]) -> list:
+        """
+        Inserts rows.
+
+        Args:
+            colname (str): The name of the collection.
+            columns (Dict[str, list]): One list of values per field, except the auto-generated primary key.
+
+        Returns:
+            list: The primary keys of the inserted rows.
+        """
+
+    @abstractmethod
+    def update(self, colname: str, pks: list, columns: Dict[str, list]) -> dict:
+        """
+        Sets scalar fields of rows by primary key, keeping their vectors.
+
+        Args:
+            colname (str): The name of the collection.
+            pks (list): The primary keys of the rows.
+            columns (Dict[str, list]): One list of new values per updated field, one value per row.
+
+        Returns:
+            dict: The primary key of each updated row after the update, by its previous key. Backends
+                  which rewrite the rows to update them give them new keys.
+        """
+
+    @abstractmethod
+    def delete(self, colname: str, pks: list):
+        """
+        Deletes rows by primary key.
+        """
+
+    @abstractmethod
+    def scan(self, colname: str, filters: Optional[dict], output_fields: List[str],
+             batch_size: int = 1000) -> Iterator[List[dict]]:
+        """
+        Iterates over the rows matching the filters, in batches.
+
+        Yields:
+            List[dict]: Rows with the output fields and the primary key.
+        """
+
+    def query(self, colname: str, filters: Optional[dict], output_fields: List[str],
+              limit: Optional[int] = None) -> List[dict]:
+        """
+        Returns the rows matching the filters, at most `limit` of them.
+
+        Returns:
+            List[dict]: Rows with the output fields and the primary key.
+        """
+        rows = []
+        for batch in self.scan(colname, filters, output_fields, batch_size=min(limit or 1000, 1000)):
+            rows.extend(batch)
+            if limit is not None and len(rows) >= limit:
+                return rows[:limit]
+        return rows
+
+    @abstractmethod
+    def search(self, colname: str, vectors: List[List[float]], k: int, filters: Optional[dict],
+               output_fields: List[str], param: Optional[dict] = None) -> List[List[dict]]:
+        """
+        Finds the nearest rows of each query vector among the rows matching the filters.
+
+        Args:
+            colname (str): The name of the collection.
+            vectors (List[List[float]]): The query vectors.
+            k (int): The number of rows returned per query.
+            filters (Optional[dict]): Restrict the search to the matching rows.
+            output_fields (List[str]): The fields returned with each hit.
+            param (Optional[dict]): The search parameters, see `IndexConfig.search_param`.
+
+        Returns:
+            List[List[dict]]: The hits of each query, nearest first, each a dict of its output fields
+                              with its primary key and its 'distance' as defined by the metric.
+        """
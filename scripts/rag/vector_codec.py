@@ -0,0 +1,161 @@
+from typing import Optional
+
+import numpy as np
+
+
+def to_bfloat16(vectors: np.ndarray) -> np.ndarray:
+    """
+    Rounds float32 values to bfloat16, to the nearest even.
+
+    Returns:
+        np.ndarray: The bfloat16 bit patterns, as uint16.
+    """
+    bits = np.ascontiguousarray(vectors, dtype=np.float32).view(np.uint32)
+    return ((bits + 0x7FFF + ((bits >> 16) & 1)) >> 16).astype(np.uint16)
+
+
+def from_bfloat16(bits: np.ndarray) -> np.ndarray:
+    """
+    Expands bfloat16 bit patterns, as uint16, to float32.
+    """
+    return (np.asarray(bits, dtype=np.uint16).astype(np.uint32) << 16).view(np.float32)
+
+
+class VectorCodec:
+    """
+    Compact representation of the vectors of a collection: the element type of the vector field
+    and an optional dimension reduction applied to every stored and query vector.
+
+    - 'truncate' keeps the first `dim` dimensions, Matryoshka-style, and renormalizes.
+    - 'pca' projects onto the `dim` principal components of the vectors, and renormalizes. The
+      projection is fitted with `fit` on a sample of at least `dim` vectors before anything is stored,
+      and is stored with the collection, see `MilvusDB.fit_codec`.
+
+    The default codec stores full-precision float32 vectors unchanged. Scalar and product quantization
+    are index types of the collection (IVF_SQ8, IVF_PQ), see IndexConfig.
+    """
+
+    VECTOR_TYPES: tuple = ('FLOAT_VECTOR', 'FLOAT16_VECTOR', 'BFLOAT16_VECTOR')
+    REDUCTIONS: tuple = ('truncate', 'pca')
+    # Bytes per element of each vector type
+    ELEMENT_BYTES: dict = {'FLOAT_VECTOR': 4, 'FLOAT16_VECTOR': 2, 'BFLOAT16_VECTOR': 2}
+
+    def __init__(self, vector_type: str = 'FLOAT_VECTOR', reduction: Optional[str] = None, dim: Optional[int] = None):
+        """
+        Args:
+            vector_type (str): One of 'FLOAT_VECTOR', 'FLOAT16_VECTOR' or 'BFLOAT16_VECTOR'.
+            reduction (Optional[str]): None, 'truncate' or 'pca'.
+            dim (Optional[int]): The reduced dimension, required with a reduction.
+        """
+        vector_type = vector_type.upper()
+        if vector_type not in VectorCodec.VECTOR_TYPES:
+            raise ValueError(f"Unsupported vector type '{vector_type}', "
+                             f"choose one of: {', '.join(VectorCodec.VECTOR_TYPES)}")
+        if reduction is not None and reduction not in VectorCodec.REDUCTIONS:
+            raise ValueError(f"Unsupported reduction '{reduction}', choose one of: {', '.join(VectorCodec.REDUCTIONS)}")
+        if reduction is not None and not dim:
+            raise ValueError(f"The '{reduction}' reduction needs a target dimension")
+        self.vector_type = vector_type
+        self.reduction = reduction
+        self.dim = dim if reduction else None
+        # PCA projection, set by `fit` or `set_projection`
+        self.mean: Optional[np.ndarray] = None
+        self.components: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_dict(cls, config: Optional[dict]) -> 'VectorCodec':
+        """
+        Builds a codec from its stored configuration, the full-precision codec if None.
+        """
+        return cls(**config) if config else cls()
+
+    def to_dict(self) -> dict:
+        """
+        Returns:
+            dict: The configuration stored with the collection.
+        """
+        return {'vector_type': self.vector_type, 'reduction': self.reduction, 'dim': self.dim}
+
+    @property
+    def is_identity(self) -> bool:
+        """
+        True if vectors are stored without dimension reduction.
+        """
+        return self.reduction is None
+
+    @property
+    def fitted(self) -> bool:
+        """
+        False for a PCA codec whose projection is not fitted yet.
+        """
+        return self.reduction != 'pca' or self.components is not None
+
+    def output_dim(self, input_dim: int) -> int:
+        """
+        Returns:
+            int: The dimension of the stored vectors.
+        """
+        return min(self.dim, input_dim) if self.dim else input_dim
+
+    def bytes_per_vector(self, input_dim: int) -> int:
+        """
+        Returns:
+            int: The raw size of one stored vector.
+        """
+        return self.output_dim(input_dim) * VectorCodec.ELEMENT_BYTES[self.vector_type]
+
+    def fit(self, vectors) -> 'VectorCodec':
+        """
+        Fits the PCA projection on a sample of vectors.
+
+        Args:
+            vectors: The sample, one vector per row, at least as many as the target dimension.
+
+        Raises:
+            ValueError: The sample is smaller than the target dimension, so the projection would
+                        have fewer principal components than stored dimensions.
+        """
+        if self.reduction != 'pca':
+            return self
+        sample = np.asarray(vectors, dtype=np.float32)
+        dim = self.output_dim(sample.shape[1])
+        if len(sample) < dim:
+            raise ValueError(f"The PCA projection to {dim} dimensions needs a sample of at least {dim} vectors, "
+                             f"got {len(sample)}")
+        self.mean = sample.mean(axis=0)
+        _, _, components = np.linalg.svd(sample - self.mean, full_matrices=False)
+        self.components = np.ascontiguousarray(components[:dim], dtype=np.float32)
+        return self
+
+    def set_projection(self, mean, components) -> 'VectorCodec':
+        """
+        Sets the PCA projection, as stored with a collection.
+
+        Args:
+            mean: The mean of the sample the projection was fitted on.
+            components: The principal components, one per row.
+        """
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.ascontiguousarray(components, dtype=np.float32)
+        return self
+
+    def reduce(self, vectors) -> np.ndarray:
+        """
+        Applies the dimension reduction to vectors.
+
+        Args:
+            vectors: The full-dimension vectors, one per row.
+
+        Returns:
+            np.ndarray: The float32 vectors to store or search, one per row.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.reduction is None:
+            return vectors
+        if self.reduction == 'truncate':
+            reduced = vectors[:, :self.dim]
+        else:
+            if self.components is None:
+                raise ValueError("The PCA projection is not fitted")
+            reduced = (vectors - self.mean) @ self.components.T
+        return reduced / np.maximum(np.linalg.norm(reduced, axis=1, keepdims=True), 1e-12)
@@ -0,0 +1,288 @@
+"""
+Long-running query service: answers concurrent queries over HTTP from collections loaded once.
+
+Endpoints:
+- POST /query    {"collection": ..., "query": ..., "pdf_name": ..., "k": 6, "stream": true}
+                 streams the answer as NDJSON lines {"token": ...}, ended by {"done": true, "cached": ...,
+                 "seconds": ...}, or an {"error": ...} line if the generation fails. With "stream": false,
+                 the answer is returned as {"answer": ..., "cached": ...}.
+- GET  /health   the load of the service.
+- GET  /metrics  the metrics in the Prometheus text format.
+
+Query embeddings of concurrent requests are coalesced by the embedding client, and their vector
+searches by a SearchBatcher. At most `--max-concurrency` queries are answered at once, and at most
+`--max-pending` more wait for `--queue-timeout` seconds. Queries beyond are shed with a 503 and a
+Retry-After header, as are new generations while `--max-llm-backlog` generations wait for an Ollama
+host. Exact repeats of cached answers are always served.
+
+Usage, from the repository root:
+    python -m scripts.server --model llama3.1:70b --collections col_test --port 8080
+    curl -N localhost:8080/query -d '{"collection": "col_test", "query": "what is actuarial spread?",
+                                      "pdf_name": "Actuarial Spread White Paper"}'
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+from contextlib import aclosing
+from typing import AsyncIterator, Iterable
+
+from aiohttp import web
+
+from scripts.main import SimpleRAG
+from scripts.rag.search_batcher import SearchBatcher
+from scripts.logger.logger import Log
+from scripts.logger.exceptions import CollectionNotFoundError, LlmOverloadedError
+
+
+class QueryServer:
+    """
+    HTTP front end of a SimpleRAG, with bounded concurrency and load shedding.
+    """
+
+    def __init__(self,
+                 rag: SimpleRAG,
+                 collections: Iterable[str] = (),
+                 max_concurrency: int = 16,
+                 max_pending: int = 64,
+                 queue_timeout: float = 30.0,
+                 max_llm_backlog: int = 32,
+                 retry_after: int = 5,
+                 batch_window: float = 0.005):
+        """
+        Args:
+            rag (SimpleRAG): The RAG answering the queries.
+            collections (Iterable[str]): The collections loaded and warmed up by `load`.
+            max_concurrency (int): The maximum number of queries answered at once.
+            max_pending (int): The maximum number of queries waiting to be answered.
+            queue_timeout (float): The seconds a query waits to be answered before it is shed.
+            max_llm_backlog (int): The number of generations waiting for an Ollama host from which
+                                   new generations are shed.
+            retry_after (int): The seconds clients are asked to wait after being shed.
+            batch_window (float): Seconds the SearchBatcher waits for more searches before sending a batch.
+        """
+        self.logger = Log(f'{os.path.basename(__file__)}').getlog()
+        self.rag = rag
+        self.collections = list(collections)
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self.max_llm_backlog = max_llm_backlog
+        self.retry_after = retry_after
+        self.batch_window = batch_window
+        self.metrics = rag.metrics
+        self.in_flight = 0
+        self.pending = 0
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    def load(self):
+        """
+        Creates the query service and warms up the language model and every collection: the
+        embedding client, the vector index, the collection metadata and, in hybrid mode, the BM25 index.
+
+        Raises:
+            CollectionNotFoundError: A collection does not exist.
+        """
+        service = self.rag.query_service
+        service.search_batcher = SearchBatcher(self.rag, batch_window=self.batch_window)
+        # Preloads the model on the Ollama hosts
+        self.rag.llm
+        for colname in self.collections:
+            if not self.rag.is_collection_exists(colname):
+                raise CollectionNotFoundError(colname)
+            start = time.time()
+            vector = self.rag.embed_model.embed_query('warm up')
+            self.rag.search_batch(colname, [vector], [''], k=1)
+            if service.retrieval_mode == 'hybrid':
+                self.rag.get_sparse_index(colname)
+            self.logger.info(f'Loaded collection {colname} in {time.time() - start:.2f}s')
+
+    def app(self) -> web.Application:
+        """
+        Returns:
+            web.Application: The application serving the endpoints.
+        """
+        app = web.Application()
+        app.router.add_post('/query', self.handle_query)
+        app.router.add_get('/health', self.handle_health)
+        app.router.add_get('/metrics', self.handle_metrics)
+        return app
+
+    @property
+    def llm_backlog(self) -> int:
+        """
+        The number of generations waiting for an Ollama host.
+        """
+        pool = getattr(self.rag.llm, 'pool', None)
+        return pool.queue_depth if pool is not None else 0
+
+    def _set_load(self):
+        self.metrics.set('rag_server_in_flight', self.in_flight)
+        self.metrics.set('rag_server_pending', self.pending)
+
+    def _shed(self, reason: str) -> web.Response:
+        self.metrics.inc('rag_server_rejected_total', reason=reason)
+        return web.json_response(
+            {'error': 'The service is overloaded, retry later', 'reason': reason},
+            status=503, headers={'Retry-After': str(self.retry_after)}
+        )
+
+    async def handle_query(self, request: web.Request) -> web.StreamResponse:
+        try:
+            body = await request.json()
+            colname, user_query, pdf_name = body['collection'], body['query'], body['pdf_name']
+            k = int(body.get('k', 6))
+            stream = bool(body.get('stream', True))
+        except (ValueError, KeyError, TypeError) as e:
+            return web.json_response({'error': f'Invalid request: {e!r}'}, status=400)
+        if not await asyncio.to_thread(self.rag.is_collection_exists, colname):
+            return web.json_response({'error': str(CollectionNotFoundError(colname))}, status=404)
+
+        start = time.perf_counter()
+        service = self.rag.query_service
+        reply = await asyncio.to_thread(service.cached_answer, colname, user_query, pdf_name, k)
+        if reply is not None:
+            return await self._respond(request, self._cached(reply), stream, start, cached=True)
+
+        if self.pending >= self.max_pending:
+            return self._shed('queue_full')
+        self.pending += 1
+        self._set_load()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            return self._shed('queue_timeout')
+        finally:
+            self.pending -= 1
+            self._set_load()
+
+        self.in_flight += 1
+        self._set_load()
+        try:
+            reply, vector, doc_version = await service.alookup(colname, user_query, pdf_name, k=k)
+            if reply is not None:
+                return await self._respond(request, self._cached(reply), stream, start, cached=True)
+            if self.llm_backlog >= self.max_llm_backlog:
+                return self._shed('llm_backlog')
+
+            docs = await service.aretrieve(colname, user_query, pdf_name, k=k, vector=vector)
+            context = service.build_context(docs)
+            tokens = []
+
+            async def generate() -> AsyncIterator[str]:
+                async for token in service.astream(context, user_query):
+                    tokens.append(token)
+                    yield token
+                service.remember(colname, user_query, pdf_name, ''.join(tokens), vector, k=k,
+                                 doc_version=doc_version)
+
+            return await self._respond(request, generate(), stream, start, cached=False)
+        finally:
+            self._slots.release()
+            self.in_flight -= 1
+            self._set_load()
+
+    @staticmethod
+    async def _cached(reply: str) -> AsyncIterator[str]:
+        yield reply
+
+    async def _respond(self, request: web.Request, tokens: AsyncIterator[str], stream: bool, start: float,
+                       cached: bool) -> web.StreamResponse:
+        """
+        Sends the answer, as one JSON object or streamed as NDJSON lines. The response starts with the
+        first token, so a generation the Ollama hosts cannot admit is still shed with a 503.
+        """
+        async with aclosing(tokens):
+            try:
+                first = await anext(tokens, None)
+                self.metrics.observe('rag_server_first_token_seconds', time.perf_counter() - start)
+                if not stream:
+                    answer = (first or '') + ''.join([token async for token in tokens])
+                    self._record(start, 'cached' if cached else 'ok')
+                    return web.json_response({'answer': answer, 'cached': cached})
+            except LlmOverloadedError:
+                return self._shed('llm_overloaded')
+            except Exception as e:
+                self.logger.error(f'Generation failed: {e!r}')
+                self._record(start, 'error')
+                return web.json_response({'error': repr(e)}, status=500)
+
+            response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+            await response.prepare(request)
+
+            async def send(line: dict):
+                await response.write(json.dumps(line).encode('utf-8') + b'\n')
+
+            try:
+                if first is not None:
+                    await send({'token': first})
+                async for token in tokens:
+                    await send({'token': token})
+            except ConnectionResetError:
+                # The client went away, closing `tokens` stops the generation
+                self._record(start, 'disconnected')
+                return response
+            except asyncio.CancelledError:
+                self._record(start, 'disconnected')
+                raise
+            except Exception as e:
+                self.logger.error(f'Generation failed: {e!r}')
+                self._record(start, 'error')
+                await send({'error': repr(e)})
+                await response.write_eof()
+                return response
+            seconds = self._record(start, 'cached' if cached else 'ok')
+            await send({'done': True, 'cached': cached, 'seconds': seconds})
+            await response.write_eof()
+            return response
+
+    def _record(self, start: float, status: str) -> float:
+        seconds = time.perf_counter() - start
+        self.metrics.inc('rag_server_requests_total', status=status)
+        self.metrics.observe('rag_server_seconds', seconds, status=status)
+        return seconds
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'status': 'ok',
+            'in_flight': self.in_flight,
+            'pending': self.pending,
+            'llm_backlog': self.llm_backlog,
+            'collections': self.collections,
+        })
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.metrics.to_prometheus(), content_type='text/plain')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='phi3:latest', help='The language model answering the queries')
+    parser.add_argument('--collections', nargs='*', default=[], help='Collections loaded at startup')
+    parser.add_argument('--retrieval-mode', default=None, help="'dense' or 'hybrid', defaults to RETRIEVAL_MODE")
+    parser.add_argument('--host', default='0.0.0.0', help='The address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='The port to listen on')
+    parser.add_argument('--max-concurrency', type=int, default=16, help='Queries answered at once')
+    parser.add_argument('--max-pending', type=int, default=64, help='Queries waiting before new ones are shed')
+    parser.add_argument('--queue-timeout', type=float, default=30.0, help='Seconds a query waits before it is shed')
+    parser.add_argument('--max-llm-backlog', type=int, default=32,
+                        help='Generations waiting for an Ollama host from which new ones are shed')
+    parser.add_argument('--batch-window', type=float, default=0.005, help='Seconds searches wait to be batched')
+    args = parser.parse_args()
+
+    server = QueryServer(
+        SimpleRAG(args.model, retrieval_mode=args.retrieval_mode),
+        collections=args.collections,
+        max_concurrency=args.max_concurrency,
+        max_pending=args.max_pending,
+        queue_timeout=args.queue_timeout,
+        max_llm_backlog=args.max_llm_backlog,
+        batch_window=args.batch_window,
+    )
+    server.load()
+    web.run_app(server.app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
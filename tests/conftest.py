@@ -0,0 +1,104 @@
+import json
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from scripts.model.asyncEmbedModel import AsyncNVEmbed
+from scripts.rag.VDB_Common import MilvusDB
+from scripts.rag.embedded_backend import EmbeddedBackend
+from scripts.rag.sparse_index import BM25Index
+
+DIM = 8
+
+
+class StubEmbedder:
+    """
+    Embeds texts into deterministic vectors, and fails on the `fail_on`-th call if given.
+    """
+
+    def __init__(self, fail_on: int = None):
+        self.fail_on = fail_on
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.calls == self.fail_on:
+            raise RuntimeError('embedding server unavailable')
+        return [self.embed_query(text) for text in texts]
+
+    def embed_queries(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        digest = hashlib.sha256(text.encode('utf-8')).digest()
+        return [byte / 255 for byte in digest[:DIM]]
+
+
+class FakeServer:
+    """
+    Local HTTP server answering POST requests with `respond(path, body) -> (status, payload)`,
+    and recording the path and JSON body of every request.
+    """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                server.requests.append((self.path, body))
+                status, payload = server.respond(self.path, body)
+                data = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self._server.server_address[1]}'
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def fake_server():
+    """
+    Starts FakeServer instances, stopped at the end of the test.
+    """
+    servers = []
+
+    def start(respond) -> FakeServer:
+        servers.append(FakeServer(respond))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture
+def vdb(tmp_path, monkeypatch):
+    """
+    A MilvusDB on an embedded store in a temporary directory, with small vectors.
+    """
+    monkeypatch.setattr(AsyncNVEmbed, 'DIM', DIM)
+    monkeypatch.setattr(BM25Index, 'DEFAULT_DIR', str(tmp_path / 'sparse'))
+    monkeypatch.setattr(MilvusDB, '_backend', EmbeddedBackend(str(tmp_path / 'vdb')))
+    monkeypatch.setattr(MilvusDB, '_existing_collections', set())
+    monkeypatch.setattr(MilvusDB, '_sparse_indexes', {})
+    monkeypatch.setattr(MilvusDB, '_sparse_versions', {})
+    monkeypatch.setattr(MilvusDB, '_codecs', {})
+    monkeypatch.setattr(MilvusDB, '_filter_configs', {})
+    monkeypatch.setattr(MilvusDB, '_document_versions', {})
+    monkeypatch.setattr(MilvusDB, 'embed_model', StubEmbedder())
+    return MilvusDB()
@@ -0,0 +1,47 @@
+from langchain_core.language_models.fake import FakeListLLM
+from langchain_core.prompts import PromptTemplate
+
+from scripts.data_processing.ingest import BatchIngestor
+from scripts.rag.VDB_Common import MilvusDB
+from scripts.rag.answer_cache import AnswerCache
+from scripts.rag.query_service import QueryService
+from tests.conftest import StubEmbedder
+
+QUERY = 'What is the actuarial spread?'
+
+
+def make_service(vdb):
+    prompt = PromptTemplate.from_template('{context}\n{input}')
+    return QueryService(vdb, FakeListLLM(responses=['answer']), prompt, model='phi3:latest',
+                        answer_cache=AnswerCache(max_items=10, ttl=60))
+
+
+def test_answers_are_scoped_by_k_and_version():
+    cache = AnswerCache(max_items=10, ttl=60)
+    cache.put('docs', QUERY, 'report', 'phi3', 'v1', 'two chunks', k=2, doc_version='a:1')
+    assert cache.get('docs', QUERY, 'report', 'phi3', 'v1', k=2, doc_version='a:1') == 'two chunks'
+    assert cache.get('docs', QUERY, 'report', 'phi3', 'v1', k=10, doc_version='a:1') is None
+    assert cache.get('docs', QUERY, 'report', 'phi3', 'v1', k=2, doc_version='b:2') is None
+
+
+def test_revision_by_another_process_is_not_served(vdb, monkeypatch):
+    vdb.create_collection('docs')
+    BatchIngestor(StubEmbedder(), vdb).sync('docs', 'report', ['first revision'], doc_hash='h1')
+    service = make_service(vdb)
+    reply, vector, doc_version = service.lookup('docs', QUERY, 'report', k=4)
+    assert reply is None and doc_version == 'h1:1'
+    service.remember('docs', QUERY, 'report', 'old answer', vector, k=4, doc_version=doc_version)
+    assert service.lookup('docs', QUERY, 'report', k=4)[0] == 'old answer'
+    assert service.lookup('docs', QUERY, 'report', k=2)[0] is None
+
+    # Another process re-ingests the document, straight into the store, and the cached version expires
+    old = [row[vdb.ID_KEY] for row in vdb.get_file_chunks('docs', 'report')]
+    vdb.backend.insert('docs', {
+        'pdf_name': ['report'], 'chunk_number': [0], vdb.TEXT: ['second revision'], 'chunk_hash': [''],
+        'doc_hash': ['h2'], 'doc_version': [2], vdb.VECTOR: [StubEmbedder().embed_query('second revision')],
+    })
+    vdb.backend.delete('docs', old)
+    assert service.lookup('docs', QUERY, 'report', k=4)[0] == 'old answer'
+    monkeypatch.setattr(MilvusDB, 'DOCUMENT_VERSION_TTL', 0)
+    MilvusDB._document_versions.clear()
+    assert service.lookup('docs', QUERY, 'report', k=4) == (None, StubEmbedder().embed_query(QUERY), 'h2:2')
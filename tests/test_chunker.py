@@ -0,0 +1,42 @@
+from scripts.data_processing.chunker import FastChunker
+from scripts.data_processing.token_counter import count_tokens
+
+
+def words(text):
+    return len(text.split())
+
+
+def test_empty_text_has_no_chunks():
+    assert FastChunker().split_offsets('') == []
+    assert FastChunker().split_offsets(' \n\n ') == []
+
+
+def test_headings_start_a_chunk_without_overlap():
+    text = '# Revenue\n\nRevenue grew. Margins held.\n\n# Risks\n\nRates rose. Spreads widened.'
+    chunks = FastChunker(chunk_tokens=20, overlap_tokens=5, token_counter=words).split_text(text)
+    assert chunks == ['# Revenue\n\nRevenue grew. Margins held.', '# Risks\n\nRates rose. Spreads widened.']
+
+
+def test_consecutive_chunks_overlap():
+    text = ' '.join(f'Sentence {number} of the filing.' for number in range(10))
+    chunker = FastChunker(chunk_tokens=12, overlap_tokens=5, token_counter=words)
+    chunks = chunker.split_text(text)
+    assert chunks[:2] == ['Sentence 0 of the filing. Sentence 1 of the filing.',
+                          'Sentence 1 of the filing. Sentence 2 of the filing.']
+    assert chunks[-1].endswith('Sentence 9 of the filing.')
+    assert max(words(chunk) for chunk in chunks) <= 12
+
+
+def test_text_without_spaces_is_cut_by_characters():
+    text = '財務報告顯示收入增長。' * 520
+    chunker = FastChunker(chunk_tokens=128, overlap_tokens=64)
+    offsets = chunker.split_offsets(text)
+    assert len(offsets) > 1
+    assert ''.join(text[start:end] for start, end in offsets) == text
+    assert max(count_tokens(text[start:end]) for start, end in offsets) <= 128
+
+
+def test_chunks_fit_the_shared_token_count():
+    text = ' '.join(f'{number * 1.37:,.2f}' for number in range(3000))
+    chunks = FastChunker(chunk_tokens=128, overlap_tokens=64).split_text(text)
+    assert max(count_tokens(chunk) for chunk in chunks) <= 128
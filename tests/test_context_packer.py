@@ -0,0 +1,51 @@
+from langchain_core.documents import Document
+
+from scripts.rag.context_packer import ContextPacker
+
+
+def chunk(text, number, pdf_name='report'):
+    return Document(page_content=text, metadata={'pdf_name': pdf_name, 'chunk_number': number})
+
+
+def test_passages_keep_the_rank_of_their_best_chunk():
+    packer = ContextPacker(budget_tokens=1000, separator=' | ')
+    docs = [
+        chunk('Gamma rays are ionising.', 7),
+        chunk('Alpha particles are helium nuclei.', 0, 'physics'),
+        chunk('Beta decay emits electrons.', 3),
+        chunk('Delta waves are slow.', 8),
+    ]
+    # Chunks 7 and 8 are adjacent and merge at the rank of chunk 7
+    assert packer.pack(docs) == ('Gamma rays are ionising. | Delta waves are slow. | '
+                                 'Alpha particles are helium nuclei. | Beta decay emits electrons.')
+
+
+def test_overlapping_chunks_are_joined_once():
+    packer = ContextPacker(budget_tokens=1000)
+    docs = [chunk('The spread is the margin paid over the risk free rate of the same maturity.', 1),
+            chunk('paid over the risk free rate of the same maturity. It is quoted in basis points.', 2)]
+    assert packer.pack(docs) == ('The spread is the margin paid over the risk free rate of the same maturity. '
+                                 'It is quoted in basis points.')
+
+
+def test_passages_past_the_budget_are_skipped():
+    long_text = ' '.join(f'word{i}' for i in range(200))
+    first, second = 'The first passage.', 'A short one.'
+    packer = ContextPacker(budget_tokens=packer_tokens(first, second, '\n\n'))
+    docs = [chunk(first, 0), chunk(long_text, 5), chunk(second, 9)]
+    # The long passage does not fit, the less relevant short one still does
+    assert packer.pack(docs) == first + '\n\n' + second
+
+
+def test_best_passage_over_the_budget_is_truncated():
+    sentences = ' '.join(f'Sentence number {i} is here.' for i in range(100))
+    packer = ContextPacker(budget_tokens=50)
+    context = packer.pack([chunk(sentences, 0), chunk('Never reached.', 4)])
+    assert sentences.startswith(context)
+    assert context.endswith('.')
+    assert packer.count_tokens(context) <= 50
+    assert 'Never reached.' not in context
+
+
+def packer_tokens(*texts):
+    return sum(ContextPacker.count_tokens(text) for text in texts)
@@ -0,0 +1,64 @@
+from array import array
+
+import pytest
+
+import scripts.model.embedCache as embed_cache
+from scripts.model.embedCache import EmbeddingCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Makes every access time of the cache one second later than the previous one.
+    """
+    now = iter(range(1_000_000))
+    monkeypatch.setattr(embed_cache.time, 'time', lambda: float(next(now)))
+
+
+def test_hits_and_misses(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / 'embeddings.sqlite'))
+    cache.put_many({'a': [0.5, 1.5], 'b': [2.0, 3.0]})
+    assert cache.get_many(['a', 'b', 'c']) == {'a': [0.5, 1.5], 'b': [2.0, 3.0]}
+    assert cache.get('c') is None
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (2, 2)
+    # Vectors are kept in memory as float32 arrays, and read back from the database by another instance
+    assert isinstance(cache._memory['a'], array)
+    assert EmbeddingCache(str(tmp_path / 'embeddings.sqlite')).get('b') == [2.0, 3.0]
+
+
+def test_memory_lru_is_bounded(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / 'embeddings.sqlite'), memory_items=2)
+    cache.put_many({'a': [1.0], 'b': [2.0], 'c': [3.0]})
+    assert list(cache._memory) == ['b', 'c']
+    assert cache.get('a') == [1.0]
+
+
+def test_eviction_keeps_the_vectors_read_from_memory(tmp_path, clock):
+    path = str(tmp_path / 'embeddings.sqlite')
+    # Ten 4-dimension vectors of 16 bytes fill the cache
+    cache = EmbeddingCache(path, max_bytes=160)
+    for index in range(10):
+        cache.put(f'key{index}', [float(index)] * 4)
+    assert cache.get('key0') == [0.0] * 4
+    assert 'key0' in cache._memory
+
+    cache.put('key10', [10.0] * 4)
+    stats = cache.stats()
+    assert stats['evictions'] == 2
+    assert stats['bytes'] <= 144
+    stored = EmbeddingCache(path, max_bytes=160)
+    assert stored.get('key0') == [0.0] * 4
+    assert stored.get_many(['key1', 'key2']) == {}
+
+
+def test_access_times_are_written_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(EmbeddingCache, 'FLUSH_INTERVAL', 3600)
+    cache = EmbeddingCache(str(tmp_path / 'embeddings.sqlite'), memory_items=0)
+    cache.put_many({f'key{index}': [float(index)] for index in range(5)})
+    statements = []
+    cache._conn.set_trace_callback(statements.append)
+    for index in range(5):
+        cache.get(f'key{index}')
+    assert not any(statement.startswith('UPDATE') for statement in statements)
+    cache.flush()
+    assert sum(statement.startswith('UPDATE') for statement in statements) == 5
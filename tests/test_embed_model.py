@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+import requests
+
+from scripts.logger.metrics import Metrics
+from scripts.model.asyncEmbedModel import AsyncNVEmbed
+from scripts.model.embedModel import NVEmbed
+
+
+def vector(text):
+    return [float(len(text)), float(sum(map(ord, text)))]
+
+
+def embedding_server(fake_server, failures=0, status=503):
+    """
+    An embedding server answering `failures` requests with `status` before embedding.
+    """
+    def respond(path, body):
+        if len(server.requests) <= failures:
+            return status, {'detail': 'overloaded'}
+        texts = body['input']
+        return 200, vector(texts) if isinstance(texts, str) else [vector(text) for text in texts]
+
+    server = fake_server(respond)
+    return server
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    monkeypatch.setenv('EMBEDDING_CACHE', '0')
+    monkeypatch.setattr(Metrics, '_shared', Metrics())
+    return Metrics.shared()
+
+
+def test_retries_on_server_errors(fake_server, metrics):
+    server = embedding_server(fake_server, failures=2)
+    model = NVEmbed(host=server.url, backoff=0)
+    assert model.embed_documents(['revenue', 'spread']) == [vector('revenue'), vector('spread')]
+    assert len(server.requests) == 3
+    assert metrics.counter('rag_http_retries_total', service='embedding') == 2
+
+
+def test_gives_up_after_max_retries(fake_server, metrics):
+    server = embedding_server(fake_server, failures=10, status=502)
+    with pytest.raises(requests.exceptions.RetryError):
+        NVEmbed(host=server.url, max_retries=2, backoff=0).embed_documents(['revenue'])
+    assert len(server.requests) == 3
+    assert metrics.counter('rag_http_retries_total', service='embedding') == 2
+
+
+def test_async_client_retries_on_server_errors(fake_server, metrics):
+    server = embedding_server(fake_server, failures=2, status=429)
+    model = AsyncNVEmbed(host=server.url, backoff=0)
+    try:
+        assert model.embed_documents(['revenue']) == [vector('revenue')]
+    finally:
+        model.close()
+    assert model.retries == 2
+    assert metrics.counter('rag_http_retries_total', service='embedding') == 2
+
+
+def embed_concurrently(model, queries):
+    async def embed_all():
+        return await asyncio.gather(*(model.aembed_query(query) for query in queries), return_exceptions=True)
+
+    try:
+        return asyncio.run(embed_all())
+    finally:
+        model.close()
+
+
+def test_concurrent_queries_are_sent_one_per_request(fake_server, metrics):
+    server = embedding_server(fake_server)
+    queries = [f'query {number % 4}' for number in range(8)]
+    vectors = embed_concurrently(AsyncNVEmbed(host=server.url, batch_window=0.05), queries)
+    assert vectors == [vector(query) for query in queries]
+    # Repeated queries of a micro-batch are embedded once, each query is sent alone
+    assert sorted(body['input'] for _, body in server.requests) == sorted(set(queries))
+
+
+def test_failed_query_only_fails_its_callers(fake_server, metrics):
+    server = fake_server(lambda path, body: (400, {}) if body['input'] == 'bad' else (200, vector(body['input'])))
+    vectors = embed_concurrently(AsyncNVEmbed(host=server.url, batch_window=0.05, max_retries=0), ['good', 'bad'])
+    assert vectors[0] == vector('good')
+    assert isinstance(vectors[1], Exception)
+
+
+def test_concurrent_queries_are_coalesced_on_servers_accepting_lists(fake_server, metrics, monkeypatch):
+    monkeypatch.setattr(NVEmbed, 'QUERY_BATCH', True)
+    server = embedding_server(fake_server)
+    queries = [f'query {number}' for number in range(8)]
+    vectors = embed_concurrently(AsyncNVEmbed(host=server.url, batch_window=0.05), queries)
+    assert vectors == [vector(query) for query in queries]
+    assert [body for _, body in server.requests] == [{'input': queries, 'type': 'query'}]
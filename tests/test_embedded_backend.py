@@ -0,0 +1,99 @@
+import numpy as np
+
+from scripts.rag.embedded_backend import EmbeddedBackend
+from scripts.rag.index_config import IndexConfig
+
+DIM = 16
+NLIST = 8
+FIELDS = [
+    {"name": "pk", "dtype": "INT64", "is_primary": True, "auto_id": True},
+    {"name": "pdf_name", "dtype": "VARCHAR", "max_length": 200},
+    {"name": "vector", "dtype": "FLOAT_VECTOR", "dim": DIM},
+]
+
+
+def clustered(count, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(scale=10, size=(NLIST, DIM))
+    return (centers[rng.integers(NLIST, size=count)] + rng.normal(size=(count, DIM))).astype(np.float32)
+
+
+def make_backend(tmp_path, vectors, index_type='IVF_FLAT', metric='L2'):
+    backend = EmbeddedBackend(str(tmp_path / 'vdb'))
+    config = IndexConfig(index_type, metric, build_params={'nlist': NLIST})
+    backend.create_collection('docs', FIELDS, config)
+    pks = backend.insert('docs', {'pdf_name': [f'doc{i % 3}' for i in range(len(vectors))],
+                                  'vector': vectors.tolist()})
+    return backend, np.array(pks)
+
+
+def brute_force(vectors, pks, query, k, metric='L2'):
+    if metric == 'L2':
+        order = np.argsort(((vectors - query) ** 2).sum(axis=1), kind='stable')
+    else:
+        order = np.argsort(-(vectors @ query), kind='stable')
+    return [int(pk) for pk in pks[order[:k]]]
+
+
+def search(backend, queries, k, nprobe, filters=None):
+    hits = backend.search('docs', queries.tolist(), k, filters, ['pk'], param={'params': {'nprobe': nprobe}})
+    return [[hit['pk'] for hit in query_hits] for query_hits in hits]
+
+
+def test_ivf_probing_every_list_matches_brute_force(tmp_path):
+    vectors = clustered(NLIST * EmbeddedBackend.IVF_MIN_ROWS_PER_LIST + 100)
+    backend, pks = make_backend(tmp_path, vectors)
+    queries = clustered(20, seed=1)
+    results = search(backend, queries, 10, nprobe=NLIST)
+    assert backend._open('docs').lists is not None
+    assert results == [brute_force(vectors, pks, query, 10) for query in queries]
+
+
+def test_ivf_recall_with_few_probes(tmp_path):
+    vectors = clustered(NLIST * EmbeddedBackend.IVF_MIN_ROWS_PER_LIST + 100)
+    backend, pks = make_backend(tmp_path, vectors)
+    queries = clustered(20, seed=1)
+    results = search(backend, queries, 10, nprobe=2)
+    found = sum(len(set(hits) & set(brute_force(vectors, pks, query, 10)))
+                for hits, query in zip(results, queries))
+    assert found / (10 * len(queries)) >= 0.9
+
+
+def test_rows_inserted_after_training_are_assigned_to_lists(tmp_path):
+    vectors = clustered(NLIST * EmbeddedBackend.IVF_MIN_ROWS_PER_LIST)
+    backend, pks = make_backend(tmp_path, vectors)
+    search(backend, vectors[:1], 1, nprobe=1)
+    extra = clustered(50, seed=2)
+    pks = np.concatenate([pks, backend.insert('docs', {'pdf_name': ['new'] * 50, 'vector': extra.tolist()})])
+    vectors = np.concatenate([vectors, extra])
+    assert search(backend, extra, 1, nprobe=NLIST) == [brute_force(vectors, pks, query, 1) for query in extra]
+
+
+def test_deleted_rows_are_never_returned(tmp_path):
+    vectors = clustered(NLIST * EmbeddedBackend.IVF_MIN_ROWS_PER_LIST + 100)
+    backend, pks = make_backend(tmp_path, vectors)
+    queries = clustered(10, seed=1)
+    search(backend, queries, 10, nprobe=NLIST)
+    # The best hits of every query are deleted
+    deleted = {pk for query in queries for pk in brute_force(vectors, pks, query, 3)}
+    backend.delete('docs', sorted(deleted))
+    alive = np.array([pk not in deleted for pk in pks])
+    for nprobe in (2, NLIST):
+        for hits in search(backend, queries, 10, nprobe):
+            assert not deleted & set(hits)
+    assert search(backend, queries, 10, NLIST) == [
+        brute_force(vectors[alive], pks[alive], query, 10) for query in queries
+    ]
+    # Filtered searches are exact and skip deleted rows too
+    doc0 = alive & (np.arange(len(pks)) % 3 == 0)
+    assert search(backend, queries, 5, 1, filters={'pdf_name': 'doc0'}) == [
+        brute_force(vectors[doc0], pks[doc0], query, 5) for query in queries
+    ]
+
+
+def test_flat_inner_product_matches_brute_force(tmp_path):
+    vectors = clustered(300)
+    backend, pks = make_backend(tmp_path, vectors, index_type='FLAT', metric='IP')
+    queries = clustered(10, seed=1)
+    assert search(backend, queries, 5, nprobe=1) == [brute_force(vectors, pks, query, 5, 'IP') for query in queries]
+    assert backend._open('docs').lists is None
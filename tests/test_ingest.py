@@ -0,0 +1,71 @@
+import pytest
+
+from scripts.data_processing.ingest import BatchIngestor
+from tests.conftest import StubEmbedder
+
+
+def stored_chunks(vdb, colname, pdf_name):
+    rows = vdb.get_chunks(colname, [row[vdb.ID_KEY] for row in vdb.get_file_chunks(colname, pdf_name)])
+    return sorted((row['chunk_number'], row[vdb.TEXT]) for row in rows)
+
+
+def test_first_ingest_interrupted_is_resumed(vdb):
+    vdb.create_collection('docs')
+    chunks = [f'chunk {number} of the report' for number in range(5)]
+
+    with pytest.raises(RuntimeError):
+        BatchIngestor(StubEmbedder(fail_on=2), vdb, batch_size=2).sync('docs', 'report', chunks, doc_hash='v1')
+    assert not vdb.check_existing_file('docs', 'report', doc_hash='v1')
+    assert not vdb.check_existing_file('docs', 'report')
+    assert vdb.existing_files('docs', ['report'], doc_hashes={'report': 'v1'}) == set()
+
+    BatchIngestor(StubEmbedder(), vdb, batch_size=2).sync('docs', 'report', chunks, doc_hash='v1')
+    assert vdb.check_existing_file('docs', 'report', doc_hash='v1')
+    assert stored_chunks(vdb, 'docs', 'report') == list(enumerate(chunks))
+
+
+def test_revision_interrupted_is_resumed(vdb):
+    vdb.create_collection('docs')
+    old = [f'chunk {number} of the report' for number in range(6)]
+    BatchIngestor(StubEmbedder(), vdb, batch_size=2).sync('docs', 'report', old, doc_hash='v1')
+
+    new = old[:2] + [f'revised chunk {number}' for number in range(2, 7)]
+    with pytest.raises(RuntimeError):
+        BatchIngestor(StubEmbedder(fail_on=2), vdb, batch_size=2).sync('docs', 'report', new, doc_hash='v2')
+    assert not vdb.check_existing_file('docs', 'report', doc_hash='v2')
+
+    result = BatchIngestor(StubEmbedder(), vdb, batch_size=2).sync('docs', 'report', new, doc_hash='v2')
+    assert vdb.check_existing_file('docs', 'report', doc_hash='v2')
+    assert not vdb.check_existing_file('docs', 'report', doc_hash='v1')
+    assert stored_chunks(vdb, 'docs', 'report') == list(enumerate(new))
+    # Chunk 1 is unchanged, and the chunks inserted before the failure are kept
+    assert result['kept'] == 3
+
+
+def test_chunk_inserted_at_the_front_keeps_the_others(vdb):
+    vdb.create_collection('docs')
+    old = [f'chunk {number} of the report' for number in range(6)]
+    BatchIngestor(StubEmbedder(), vdb, batch_size=2).sync('docs', 'report', old, doc_hash='v1')
+
+    new = ['a new opening paragraph'] + old
+    embedder = StubEmbedder()
+    result = BatchIngestor(embedder, vdb, batch_size=2).sync('docs', 'report', new, doc_hash='v2')
+    assert result['kept'] == len(old)
+    assert result['deleted'] == []
+    assert embedder.calls == 1
+    assert vdb.check_existing_file('docs', 'report', doc_hash='v2')
+    assert stored_chunks(vdb, 'docs', 'report') == list(enumerate(new))
+    hits = vdb.sparse_search('docs', 'chunk 5', 'report', k=1)
+    assert vdb.get_chunks('docs', [hits[0][0]])[0]['chunk_number'] == 6
+
+
+def test_duplicate_chunks_keep_one_row_each(vdb):
+    vdb.create_collection('docs')
+    old = ['header', 'repeated table', 'body', 'repeated table']
+    BatchIngestor(StubEmbedder(), vdb).sync('docs', 'report', old, doc_hash='v1')
+
+    new = ['header', 'repeated table', 'repeated table', 'body', 'repeated table']
+    result = BatchIngestor(StubEmbedder(), vdb).sync('docs', 'report', new, doc_hash='v2')
+    # The first chunk is rewritten, as the commit marker of the new version
+    assert (result['kept'], len(result['inserted']), len(result['deleted'])) == (3, 2, 1)
+    assert stored_chunks(vdb, 'docs', 'report') == list(enumerate(new))
@@ -0,0 +1,50 @@
+import time
+
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+from scripts.data_processing.ingest import BatchIngestor
+from scripts.data_processing.parseCache import ParseCache
+from scripts.logger.exceptions import ModelNotFoundError
+from scripts.main import SimpleRAG
+from tests.conftest import StubEmbedder
+
+
+def test_unknown_model_is_rejected_on_construction():
+    with pytest.raises(ModelNotFoundError):
+        SimpleRAG('bogus-model')
+
+
+def test_upper_case_extension_is_stripped_from_document_names(vdb, tmp_path, monkeypatch):
+    monkeypatch.setattr(ParseCache, 'DEFAULT_DIR', str(tmp_path / 'parsed'))
+    (tmp_path / 'pdfs').mkdir()
+    (tmp_path / 'pdfs' / 'Report.PDF').write_bytes(b'%PDF annual report')
+    rag = SimpleRAG('phi3:latest')
+    doc_hash = rag.parse_cache.file_hash(str(tmp_path / 'pdfs' / 'Report.PDF'))
+    rag.create_collection('docs')
+    BatchIngestor(StubEmbedder(), vdb).sync('docs', 'Report', ['annual report'], doc_hash=doc_hash)
+
+    is_stored = rag._existing_file_filter('docs', str(tmp_path / 'pdfs'))
+    assert is_stored('Report.PDF', doc_hash)
+
+
+def test_batch_answers_come_back_in_query_order(vdb, monkeypatch):
+    queries = [f'What is in chapter {i}?' for i in range(6)]
+
+    def answer(prompt):
+        text = prompt.to_string()
+        index = next(i for i, query in enumerate(queries) if query in text)
+        # Earlier queries finish last
+        time.sleep(0.02 * (len(queries) - index))
+        # Names the document whose chunk was retrieved into the context
+        return f'answer {index}: ' + next(name for name in 'abc' if f'chapter {name} text' in text)
+
+    monkeypatch.setattr(SimpleRAG, 'llm', property(lambda self: RunnableLambda(answer)))
+    rag = SimpleRAG('phi3:latest')
+    rag.create_collection('docs')
+    for name in 'abc':
+        BatchIngestor(StubEmbedder(), vdb).sync('docs', name, [f'chapter {name} text'], doc_hash=name)
+
+    pdf_names = ['abc'[i % 3] for i in range(len(queries))]
+    replies = rag.query_batch('docs', queries, pdf_names, k=2, max_concurrency=len(queries))
+    assert replies == [f'answer {i}: {name}' for i, name in enumerate(pdf_names)]
@@ -0,0 +1,120 @@
+import json
+import time
+import socket
+import threading
+import asyncio
+
+import pytest
+
+from scripts.logger.exceptions import LlmOverloadedError
+from scripts.logger.metrics import Metrics
+from scripts.rag.ollama_pool import OllamaPool
+
+
+def ollama_server(fake_server, text='pooled answer'):
+    """
+    An Ollama server streaming `text` as the response to every generation.
+    """
+    lines = [{'model': 'phi3:latest', 'response': text, 'done': False},
+             {'model': 'phi3:latest', 'response': '', 'done': True}]
+    return fake_server(lambda path, body: (200, ''.join(json.dumps(line) + '\n' for line in lines).encode('utf-8')))
+
+
+def closed_port_url():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return f'http://127.0.0.1:{probe.getsockname()[1]}'
+
+
+@pytest.fixture(autouse=True)
+def metrics(monkeypatch):
+    monkeypatch.setattr(Metrics, '_shared', Metrics())
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condition not met in time'
+        time.sleep(0.01)
+
+
+def test_generation_fails_over_to_a_reachable_host(fake_server):
+    server = ollama_server(fake_server)
+    pool = OllamaPool([closed_port_url(), server.url], preload=False)
+    down, up = pool.hosts
+
+    assert pool.llm('phi3:latest').invoke('What is the actuarial spread?') == 'pooled answer'
+    assert (down.errors, down.outstanding, down.available) == (1, 0, False)
+    assert (up.requests, up.outstanding) == (1, 0)
+    # The unreachable host is skipped during its cooldown
+    assert pool.acquire() is up
+
+
+def test_waiting_generation_is_rejected_after_the_queue_timeout():
+    pool = OllamaPool(['gpu1'], max_concurrency=1, queue_timeout=0.05, preload=False)
+    pool.acquire()
+    with pytest.raises(LlmOverloadedError) as raised:
+        pool.acquire()
+    assert raised.value.reason == 'queue_timeout'
+    assert pool.queue_depth == 0
+
+
+def test_generation_is_rejected_when_the_queue_is_full():
+    pool = OllamaPool(['gpu1'], max_concurrency=1, max_queue=0, preload=False)
+    pool.acquire()
+    with pytest.raises(LlmOverloadedError) as raised:
+        asyncio.run(pool.aacquire())
+    assert raised.value.reason == 'queue_full'
+
+
+def test_slot_is_released_when_a_waiting_caller_cancels():
+    pool = OllamaPool(['gpu1'], max_concurrency=1, queue_timeout=5, preload=False)
+    host = pool.acquire()
+
+    async def cancel_waiter():
+        waiter = asyncio.ensure_future(pool.aacquire())
+        await asyncio.to_thread(wait_for, lambda: pool.queue_depth == 1)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(cancel_waiter())
+    # The slot freed now goes to the abandoned waiter, which gives it back
+    pool.release(host, None)
+    wait_for(lambda: pool.queue_depth == 0 and host.outstanding == 0)
+    assert pool.acquire() is host
+
+
+def test_waiters_are_served_before_new_generations():
+    pool = OllamaPool(['gpu1'], max_concurrency=1, queue_timeout=0.2, preload=False)
+    host = pool.acquire()
+    served = []
+    waiter = threading.Thread(target=lambda: served.append(pool.acquire()))
+    waiter.start()
+    wait_for(lambda: pool.queue_depth == 1)
+
+    pool.release(host, None)
+    # The freed slot is the waiter's, a new generation queues behind it
+    with pytest.raises(LlmOverloadedError):
+        pool.acquire()
+    waiter.join()
+    assert served == [host]
+
+
+def test_waiter_excluding_the_freed_host_lets_the_next_one_take_it():
+    pool = OllamaPool(['gpu1', 'gpu2'], max_concurrency=1, queue_timeout=5, preload=False)
+    first, second = pool.acquire(), pool.acquire()
+    served = {}
+    excluding = threading.Thread(target=lambda: served.update(excluding=pool.acquire([first])))
+    excluding.start()
+    wait_for(lambda: pool.queue_depth == 1)
+    any_host = threading.Thread(target=lambda: served.update(any_host=pool.acquire()))
+    any_host.start()
+    wait_for(lambda: pool.queue_depth == 2)
+
+    pool.release(first, None)
+    any_host.join(5)
+    assert served == {'any_host': first}
+    pool.release(second, None)
+    excluding.join(5)
+    assert served == {'any_host': first, 'excluding': second}
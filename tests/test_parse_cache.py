@@ -0,0 +1,55 @@
+import os
+import json
+
+from scripts.data_processing.parseCache import ParseCache
+
+
+def write(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def test_index_is_written_once_per_flush(tmp_path, monkeypatch):
+    monkeypatch.setattr(ParseCache, 'FLUSH_INTERVAL', 3600)
+    cache = ParseCache(str(tmp_path / 'cache'))
+    writes = []
+    cache._write_atomic = lambda path, text: (writes.append(path), ParseCache._write_atomic(path, text))
+    for index in range(50):
+        write(tmp_path / f'{index}.pdf', f'file {index}')
+        cache.file_hash(str(tmp_path / f'{index}.pdf'))
+    assert writes == []
+    cache.flush()
+    cache.flush()
+    assert len(writes) == 1
+    assert len(ParseCache(str(tmp_path / 'cache'))._index) == 50
+
+
+def test_prune_deletes_entries_of_revised_and_deleted_files(tmp_path):
+    cache = ParseCache(str(tmp_path / 'cache'))
+    revised, deleted, kept = (str(tmp_path / f'{name}.pdf') for name in ('revised', 'deleted', 'kept'))
+    keys = {}
+    for path in (revised, deleted, kept):
+        write(path, f'{path} v1')
+        content_hash = cache.file_hash(path)
+        keys[path] = cache.make_key(content_hash, {'parser': 'local'})
+        cache.put(keys[path], 'parsed', content_hash)
+
+    write(revised, 'revised v2')
+    os.utime(revised, ns=(1, 1))
+    cache.file_hash(revised)
+    os.remove(deleted)
+    assert cache.prune() == 2
+    assert cache.get(keys[revised]) is None and cache.get(keys[deleted]) is None
+    assert cache.get(keys[kept]) == 'parsed'
+    assert sorted(ParseCache(str(tmp_path / 'cache'))._index) == sorted([revised, kept])
+
+
+def test_reads_index_without_entries(tmp_path):
+    path = str(tmp_path / 'file.pdf')
+    write(path, 'content')
+    stat = os.stat(path)
+    os.makedirs(tmp_path / 'cache')
+    write(tmp_path / 'cache' / ParseCache.INDEX_FILE, json.dumps(
+        {path: {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': 'memoized'}}
+    ))
+    assert ParseCache(str(tmp_path / 'cache')).file_hash(path) == 'memoized'
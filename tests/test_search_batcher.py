@@ -0,0 +1,70 @@
+import asyncio
+import threading
+
+from scripts.rag.search_batcher import SearchBatcher
+
+
+class RecordingVDB:
+    """
+    Returns, for each query vector, a hit naming the document and the vector, and fails the documents in `fail`.
+    """
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def search_batch(self, colname, vectors, pdf_names, k):
+        with self.lock:
+            self.calls.append((colname, list(vectors), list(pdf_names), k))
+        if pdf_names[0] in self.fail:
+            raise RuntimeError(f'{pdf_names[0]} is unavailable')
+        return [[{'pdf_name': pdf_name, 'vector': vector, 'k': k}] for vector, pdf_name in zip(vectors, pdf_names)]
+
+
+def run_searches(batcher, searches):
+    async def search_all():
+        return await asyncio.gather(*(batcher.search(*search) for search in searches), return_exceptions=True)
+    return asyncio.run(search_all())
+
+
+def test_searches_in_the_window_are_merged_per_document():
+    vdb = RecordingVDB()
+    batcher = SearchBatcher(vdb, batch_window=0.05)
+    searches = [('docs', [1.0], 'a', 4), ('docs', [2.0], 'b', 4), ('docs', [3.0], 'a', 4), ('docs', [4.0], 'a', 2)]
+    results = run_searches(batcher, searches)
+    assert results == [[{'pdf_name': pdf_name, 'vector': vector, 'k': k}] for _, vector, pdf_name, k in searches]
+    assert sorted(vdb.calls) == [
+        ('docs', [[1.0], [3.0]], ['a', 'a'], 4),
+        ('docs', [[2.0]], ['b'], 4),
+        ('docs', [[4.0]], ['a'], 2),
+    ]
+
+
+def test_full_batch_is_sent_without_waiting_for_the_window():
+    vdb = RecordingVDB()
+    batcher = SearchBatcher(vdb, batch_window=60, max_batch_size=3)
+    results = run_searches(batcher, [('docs', [float(i)], 'a', 4) for i in range(3)])
+    assert [hits[0]['vector'] for hits in results] == [[0.0], [1.0], [2.0]]
+    assert len(vdb.calls) == 1
+
+
+def test_searches_after_the_window_go_in_the_next_batch():
+    vdb = RecordingVDB()
+    batcher = SearchBatcher(vdb, batch_window=0.01)
+
+    async def search_twice():
+        first = await batcher.search('docs', [1.0], 'a', 4)
+        second = await batcher.search('docs', [2.0], 'a', 4)
+        return first, second
+    asyncio.run(search_twice())
+    assert [call[1] for call in vdb.calls] == [[[1.0]], [[2.0]]]
+
+
+def test_failure_reaches_only_the_searches_of_its_request():
+    vdb = RecordingVDB(fail={'b'})
+    batcher = SearchBatcher(vdb, batch_window=0.05)
+    results = run_searches(batcher, [('docs', [1.0], 'a', 4), ('docs', [2.0], 'b', 4), ('docs', [3.0], 'b', 4)])
+    assert results[0] == [{'pdf_name': 'a', 'vector': [1.0], 'k': 4}]
+    for error in results[1:]:
+        assert isinstance(error, RuntimeError) and str(error) == 'b is unavailable'
@@ -0,0 +1,35 @@
+from scripts.data_processing.ingest import BatchIngestor
+from scripts.rag.VDB_Common import MilvusDB
+from scripts.rag.embedded_backend import EmbeddedBackend
+from scripts.rag.sparse_index import BM25Index
+from tests.conftest import StubEmbedder
+
+
+def ingest_elsewhere(vdb, monkeypatch, chunks, doc_hash):
+    # Another host writes to the same store, its chunks never reach this host's sparse index
+    with monkeypatch.context() as elsewhere:
+        elsewhere.setattr(MilvusDB, 'SPARSE_INDEX', False)
+        BatchIngestor(StubEmbedder(), vdb).sync('docs', 'report', chunks, doc_hash=doc_hash)
+
+
+def test_indexes_are_kept_per_store(tmp_path):
+    first = BM25Index.for_collection('docs', EmbeddedBackend(str(tmp_path / 'first')).location, str(tmp_path))
+    second = BM25Index.for_collection('docs', EmbeddedBackend(str(tmp_path / 'second')).location, str(tmp_path))
+    first.add([1], ['report'], ['actuarial spread'])
+    assert first.path != second.path
+    assert second.search('actuarial', 'report') == []
+
+
+def test_chunks_written_by_another_host_are_searched(vdb, monkeypatch):
+    monkeypatch.setattr(MilvusDB, 'DOCUMENT_VERSION_TTL', 0)
+    vdb.create_collection('docs')
+    ingest_elsewhere(vdb, monkeypatch, ['revenue grew', 'the actuarial spread widened'], 'v1')
+    assert vdb.get_sparse_index('docs').count('report') == 0
+
+    hits = vdb.sparse_search('docs', 'actuarial spread', 'report')
+    assert [vdb.get_chunks('docs', [pk])[0]['chunk_number'] for pk, _ in hits] == [1]
+
+    ingest_elsewhere(vdb, monkeypatch, ['revenue grew', 'the solvency ratio fell'], 'v2')
+    assert vdb.sparse_search('docs', 'actuarial spread', 'report') == []
+    assert len(vdb.sparse_search('docs', 'solvency', 'report')) == 1
+    assert vdb.get_sparse_index('docs').count('report') == 2
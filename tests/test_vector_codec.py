@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from scripts.logger.exceptions import CodecNotFittedError
+from scripts.rag.VDB_Common import MilvusDB
+from scripts.rag.vector_codec import VectorCodec
+from tests.conftest import DIM
+
+
+def sample(count, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, DIM)).astype(np.float32)
+
+
+def insert(vdb, colname, vectors):
+    return vdb.insert_collection(colname, {
+        'pdf_name': ['report'] * len(vectors),
+        'chunk_number': list(range(len(vectors))),
+        vdb.TEXT: [f'chunk {number}' for number in range(len(vectors))],
+        'chunk_hash': [''] * len(vectors),
+        'doc_hash': [''] * len(vectors),
+        'doc_version': [1] * len(vectors),
+        vdb.VECTOR: vectors.tolist(),
+    })
+
+
+def test_fit_needs_a_sample_of_the_target_dimension():
+    with pytest.raises(ValueError):
+        VectorCodec(reduction='pca', dim=4).fit(sample(3))
+    codec = VectorCodec(reduction='pca', dim=4).fit(sample(4))
+    assert codec.components.shape == (4, DIM)
+
+
+def test_insert_without_projection_fails(vdb):
+    vdb.create_collection('docs', codec=VectorCodec(reduction='pca', dim=4))
+    with pytest.raises(CodecNotFittedError):
+        insert(vdb, 'docs', sample(16))
+    with pytest.raises(CodecNotFittedError):
+        vdb.search_batch('docs', sample(1).tolist(), ['report'])
+
+
+def test_projection_is_stored_with_the_collection(vdb, monkeypatch):
+    vdb.create_collection('docs', codec=VectorCodec(reduction='pca', dim=4))
+    vdb.fit_codec('docs', sample(64))
+    vectors = sample(16, seed=1)
+    insert(vdb, 'docs', vectors)
+    hits = vdb.search_batch('docs', vectors[:3].tolist(), ['report'] * 3, k=1)
+
+    # Another process reads the projection from the collection, and cannot refit it
+    monkeypatch.setattr(MilvusDB, '_codecs', {})
+    other = MilvusDB()
+    assert other.search_batch('docs', vectors[:3].tolist(), ['report'] * 3, k=1) == hits
+    with pytest.raises(ValueError):
+        other.fit_codec('docs', sample(64, seed=2))
+
+    other.drop_collection('docs')
+    other.create_collection('docs', codec=VectorCodec(reduction='pca', dim=4))
+    with pytest.raises(CodecNotFittedError):
+        insert(other, 'docs', vectors)